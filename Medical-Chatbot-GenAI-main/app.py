@@ -1,6 +1,7 @@
-from flask import Flask, render_template, jsonify, request
+from quart import Quart, render_template, jsonify, request
 from src.helper import download_hugging_face_embeddings
-from langchain_pinecone import PineconeVectorStore
+from src.vector_index import load_retriever
+from src.embedding_cache import CachedEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 from langchain.chains import create_retrieval_chain
@@ -10,28 +11,27 @@ from dotenv import load_dotenv
 from src.prompt import *
 import os
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 load_dotenv()
 
 PINECONE_API_KEY=os.environ.get('PINECONE_API_KEY')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+if PINECONE_API_KEY:
+    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 os.environ["GEMINI_API_KEY"] = GEMINI_API_KEY
 
-embeddings = download_hugging_face_embeddings()
+# Queries asked again reuse their embedding instead of running the model
+embeddings = CachedEmbeddings(download_hugging_face_embeddings(), cache_dir=None)
 
 
 index_name = "medicalbot"
 
-# Embed each chunk and upsert the embeddings into your Pinecone index.
-docsearch = PineconeVectorStore.from_existing_index(
-    index_name=index_name,
-    embedding=embeddings
-)
-
-retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k":3})
+# Retrieve from the local vector index written by store_index.py when there is one
+# (in-process, no network round trip), otherwise from the Pinecone index.
+# Set RETRIEVER_BACKEND=local or RETRIEVER_BACKEND=pinecone to choose explicitly.
+retriever = load_retriever(embeddings, k=3, index_name=index_name)
 
 
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -58,16 +58,17 @@ rag_chain = create_retrieval_chain(retriever, question_answer_chain)
 
 
 @app.route("/")
-def index():
-    return render_template('chat.html')
+async def index():
+    return await render_template('chat.html')
 
 
 @app.route("/get", methods=["GET", "POST"])
-def chat():
-    msg = request.form["msg"]
+async def chat():
+    msg = (await request.form)["msg"]
     input = msg
     print(input)
-    response = rag_chain.invoke({"input": msg})
+    # Await the retriever and LLM instead of holding a thread while they run
+    response = await rag_chain.ainvoke({"input": msg})
     print("Response : ", response["answer"])
     return str(response["answer"])
 
@@ -75,4 +76,6 @@ def chat():
 
 
 if __name__ == '__main__':
+    # Development server; for production use the ASGI entry point, e.g.
+    #   python ../serve.py app:app --port 8080 --workers 4
     app.run(host="0.0.0.0", port= 8080, debug= True)
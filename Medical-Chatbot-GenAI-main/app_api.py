@@ -1,10 +1,12 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, jsonify, make_response
+from quart_cors import cors
+import asyncio
 import time
 import logging
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
+from src.chat_backend import GeminiChatBackend, stream_chat_events
+from src.response_cache import ResponseCache, cache_stream, single_chunk
 
 # Initialize environment
 load_dotenv()
@@ -14,73 +16,106 @@ GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure the generative AI API
-genai.configure(api_key=GEMINI_API_KEY)
+# Build the Gemini model once and reuse it for every request
+# (available models are listed lazily at /api/models instead of at startup)
+chat_backend = GeminiChatBackend(model_name="models/gemini-1.5-flash-latest", api_key=GEMINI_API_KEY,
+                                 max_concurrency=int(os.environ.get('CHAT_MAX_CONCURRENCY', 0)) or None)
 
-# List available models
-logger.info("Available Gemini Models:")
-for m in genai.list_models():
-    if 'generateContent' in m.supported_generation_methods:
-        logger.info(f"- {m.name}")
+# Answer repeated questions from a cache (exact, then by MiniLM embedding similarity)
+response_cache = ResponseCache(similarity_threshold=float(os.environ.get('CHAT_CACHE_THRESHOLD', 0.92)))
 
-app = Flask(__name__)
-# Enable CORS with specific origins
-CORS(app, resources={
-    r"/*": {
-        "origins": ["http://localhost:5173", "http://localhost:8080", "http://localhost:8081", "http://localhost:8082", "http://localhost:3000", "http://localhost:5000", "*"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
+def load_embeddings():
+    # Imported here so the langchain/sentence-transformers import doesn't delay startup
+    from src.helper import download_hugging_face_embeddings
+    return download_hugging_face_embeddings()
 
-def get_response(query):
+response_cache.load_embeddings_async(load_embeddings)
+
+app = Quart(__name__)
+# Enable CORS for the frontend (any origin, as before)
+app = cors(app, allow_origin="*", allow_methods=["GET", "POST", "OPTIONS"],
+           allow_headers=["Content-Type", "Authorization"])
+
+def build_prompt(query):
     """
-    Process a user query and return an AI-generated response
+    Create a prompt with medical context for a user query
     """
-    try:
-        # Configure the model
-        generation_config = {
-            "temperature": 0.4,
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        }
-        
-        # Create a prompt with medical context
-        prompt = f"""As a medical assistant, please answer the following question. 
+    return f"""As a medical assistant, please answer the following question. 
         Give accurate medical information based on established medical knowledge.
         If you don't know the answer, say you don't know rather than making up information.
         
         Question: {query}
         """
-        
-        # Get response from Gemini
-        model = genai.GenerativeModel(model_name="models/gemini-1.5-flash-latest", generation_config=generation_config)
-        response = model.generate_content(prompt)
-        
-        return response.text
+
+async def get_response(query):
+    """
+    Process a user query and return an AI-generated response
+    """
+    # Repeated questions are answered from the cache (embedding lookups run off the event loop)
+    cached = await asyncio.to_thread(response_cache.get, query)
+    if cached is not None:
+        return cached
+    
+    try:
+        # Get response from Gemini, reusing the model built at startup
+        response = await chat_backend.generate(build_prompt(query))
+        await asyncio.to_thread(response_cache.put, query, response)
+        return response
     except Exception as e:
         logger.error(f"Error getting response: {str(e)}")
         return f"Sorry, I encountered an error: {str(e)}"
 
 @app.route('/')
-def home():
+async def home():
     return jsonify({"status": "API is running"})
 
+@app.route('/api/models')
+async def models():
+    try:
+        refresh = request.args.get('refresh') == '1'
+        return jsonify({"models": await asyncio.to_thread(chat_backend.available_models, refresh=refresh)})
+    except Exception as e:
+        logger.error(f"Error listing models: {str(e)}")
+        return jsonify({
+            "error": "Failed to list models",
+            "details": str(e)
+        }), 500
+
+@app.route('/api/cache')
+async def cache_stats():
+    return jsonify(response_cache.stats())
+
 @app.route('/api/chat', methods=['POST'])
-def chat():
+async def chat():
     start_time = time.time()
     
     try:
-        data = request.json
+        data = await request.get_json(silent=True)
         if not data or 'query' not in data:
             return jsonify({"error": "Missing 'query' in request"}), 400
         
         user_query = data['query']
         logger.info(f"Received query: {user_query}")
         
+        # Streaming mode: send the answer as server-sent events while it is generated
+        if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+            cached = await asyncio.to_thread(response_cache.get, user_query)
+            if cached is not None:
+                chunks = single_chunk(cached)
+            else:
+                chunks = cache_stream(response_cache, user_query,
+                                      chat_backend.generate_stream(build_prompt(user_query)))
+            response = await make_response(stream_chat_events(chunks, start_time), {
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            })
+            # Long answers may stream for longer than the default response timeout
+            response.timeout = None
+            return response
+        
         # Get response from the model
-        response = get_response(user_query)
+        response = await get_response(user_query)
         
         processing_time = time.time() - start_time
         logger.info(f"Query processed in {processing_time:.2f} seconds")
@@ -98,6 +133,8 @@ def chat():
         }), 500
 
 if __name__ == '__main__':
+    # Development server; for production use the ASGI entry point, e.g.
+    #   python ../serve.py app_api:app --port 5001 --workers 4
     # Make sure the port matches what's expected in the frontend
     port = 5001
     logger.info(f"Starting Medical Chatbot API server on port {port}")
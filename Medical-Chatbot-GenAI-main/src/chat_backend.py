@@ -0,0 +1,197 @@
+"""
+Gemini chat backend shared by the chat APIs.
+
+The Gemini client is configured and the GenerativeModel is built once per process and
+then reused for every request, so the underlying gRPC channel (or HTTP session with the
+REST transport) stays open between requests instead of being set up again each time.
+Model discovery is lazy: the list of available models is only fetched when asked for,
+and is cached on disk so restarts don't wait on a network round trip.
+
+Generation is async, so an ASGI server can hold hundreds of conversations on one event
+loop while they wait on the API; max_concurrency caps the calls in flight per process.
+generate_stream and stream_chat_events turn a streamed generation into server-sent
+events, so the chat APIs can show the answer while it is still being generated.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Default generation settings used by the chat APIs
+DEFAULT_GENERATION_CONFIG = {
+    "temperature": 0.4,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+# Where the list of available models is cached, and for how long
+MODELS_CACHE_FILE = os.path.join(tempfile.gettempdir(), "gemini_models.json")
+MODELS_CACHE_TTL = 24 * 60 * 60
+
+# genai.configure sets process-wide state, so it only runs once per process
+_configure_lock = threading.Lock()
+_configured_with = None
+
+
+def configure_genai(api_key=None, transport=None):
+    """Configure the Gemini client for this process (later calls with the same settings are no-ops)."""
+    global _configured_with
+    api_key = api_key or os.environ.get('GEMINI_API_KEY')
+    with _configure_lock:
+        if _configured_with == (api_key, transport):
+            return
+        if transport:
+            genai.configure(api_key=api_key, transport=transport)
+        else:
+            genai.configure(api_key=api_key)
+        _configured_with = (api_key, transport)
+
+
+class GeminiChatBackend:
+    """A Gemini model built once and reused for every request."""
+
+    def __init__(self, model_name, generation_config=None, api_key=None, transport=None,
+                 models_cache_file=MODELS_CACHE_FILE, models_cache_ttl=MODELS_CACHE_TTL,
+                 max_concurrency=None):
+        """
+        Args:
+            model_name: Gemini model to use (e.g. "models/gemini-1.5-flash-latest")
+            generation_config: Generation settings (default: DEFAULT_GENERATION_CONFIG)
+            api_key: API key (default: the GEMINI_API_KEY environment variable)
+            transport: genai transport ("grpc" or "rest"; default: the library default)
+            models_cache_file: JSON file caching the list of available models
+            models_cache_ttl: Seconds before the cached model list is fetched again
+            max_concurrency: Maximum generations in flight at once (None: no limit);
+                further requests wait for a free slot
+        """
+        self.model_name = model_name
+        self.generation_config = dict(generation_config or DEFAULT_GENERATION_CONFIG)
+        self.api_key = api_key
+        self.transport = transport
+        self.models_cache_file = models_cache_file
+        self.models_cache_ttl = models_cache_ttl
+
+        self._model = None
+        self._models = None
+        self._lock = threading.Lock()
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else contextlib.nullcontext()
+
+    @property
+    def model(self):
+        """The GenerativeModel, built on first use."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    configure_genai(self.api_key, self.transport)
+                    self._model = genai.GenerativeModel(model_name=self.model_name,
+                                                        generation_config=self.generation_config)
+        return self._model
+
+    async def generate(self, prompt):
+        """Return the model's text response to a prompt."""
+        async with self._slots:
+            response = await self.model.generate_content_async(prompt)
+            return response.text
+
+    async def generate_stream(self, prompt):
+        """Yield the model's text response to a prompt in pieces, as they are generated."""
+        async with self._slots:
+            response = await self.model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. only safety ratings)
+                    continue
+                if text:
+                    yield text
+
+    def available_models(self, refresh=False):
+        """
+        Return the names of the models that support generateContent.
+
+        The list comes from memory, then from the disk cache while it is fresh, and only
+        otherwise from the API.
+        """
+        if self._models is not None and not refresh:
+            return self._models
+
+        models = None if refresh else self._read_models_cache()
+        if models is None:
+            configure_genai(self.api_key, self.transport)
+            models = [m.name for m in genai.list_models()
+                      if 'generateContent' in m.supported_generation_methods]
+            self._write_models_cache(models)
+
+        self._models = models
+        return models
+
+    def _read_models_cache(self):
+        try:
+            if time.time() - os.path.getmtime(self.models_cache_file) > self.models_cache_ttl:
+                return None
+            with open(self.models_cache_file, 'r') as f:
+                return json.load(f)["models"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_models_cache(self, models):
+        try:
+            tmp_file = f"{self.models_cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({"models": models}, f)
+            os.replace(tmp_file, self.models_cache_file)
+        except OSError as e:
+            logger.warning(f"Could not cache the model list: {str(e)}")
+
+
+def sse_event(event, data):
+    """Format a server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_chat_events(chunks, start_time):
+    """
+    Turn streamed text pieces into server-sent events.
+
+    Yields a "token" event ({"text": ...}) per piece and a final "done" event with
+    processing_time and time_to_first_token, or an "error" event if generation fails or
+    ends without any text (e.g. when Gemini blocks the answer).
+
+    Args:
+        chunks: Async iterable of text pieces, e.g. GeminiChatBackend.generate_stream(prompt)
+        start_time: time.time() when the request arrived
+    """
+    first_token_time = None
+    try:
+        async for text in chunks:
+            if first_token_time is None:
+                first_token_time = time.time() - start_time
+                logger.info(f"First token after {first_token_time:.2f} seconds")
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        logger.error(f"Error streaming response: {str(e)}")
+        yield sse_event("error", {"error": "Failed to process query", "details": str(e)})
+        return
+
+    if first_token_time is None:
+        logger.warning("Response stream ended without any text")
+        yield sse_event("error", {"error": "Failed to process query",
+                                  "details": "The model returned no answer (it may have been blocked)"})
+        return
+
+    processing_time = time.time() - start_time
+    logger.info(f"Query streamed in {processing_time:.2f} seconds")
+    yield sse_event("done", {
+        "processing_time": f"{processing_time:.2f} seconds",
+        "time_to_first_token": None if first_token_time is None else f"{first_token_time:.2f} seconds"
+    })
@@ -0,0 +1,182 @@
+"""
+Embedding cache for the RAG chatbot.
+
+CachedEmbeddings wraps a LangChain embeddings object so identical text is only
+embedded once:
+
+- Document embeddings are kept in a persistent cache keyed by the text's hash, one
+  cache per embedding model. It is stored as a compact float16 array file plus an
+  index of text hashes (one per row), so store_index.py runs and rebuilds of the
+  vector index reuse the vectors of every chunk embedded before.
+- Query embeddings are kept in an in-memory LRU, so a question asked again (or
+  embedded again by another component) skips the model.
+
+Vectors are returned at the cache's precision whether they were cached or just
+computed, so results don't depend on what happened to be cached.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "embedding_cache"
+
+
+def text_key(text):
+    """Hash of a text used as its cache key."""
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings with a persistent document cache and a query LRU."""
+
+    def __init__(self, embeddings, cache_dir=DEFAULT_CACHE_DIR, dtype="float16", query_cache_size=1024):
+        """
+        Args:
+            embeddings: The LangChain embeddings to wrap (e.g. download_hugging_face_embeddings())
+            cache_dir: Directory of the persistent document cache (None: in memory only)
+            dtype: Storage precision of cached vectors ("float16" or "float32")
+            query_cache_size: Number of query embeddings kept in memory (0 disables it)
+        """
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", None) or type(embeddings).__name__
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        self.query_cache_size = query_cache_size
+
+        # text hash -> row of self._vectors, plus rows computed since the last save()
+        self._rows = {}
+        self._vectors = None
+        self._pending = OrderedDict()
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+
+        if cache_dir:
+            self._load()
+
+    @property
+    def _base_path(self):
+        name = re.sub(r"[^\w.-]+", "_", self.model_name)
+        return os.path.join(self.cache_dir, f"{name}.{self.dtype.name}")
+
+    def _load(self):
+        """Read the persistent cache of this model, if there is one."""
+        try:
+            vectors = np.load(f"{self._base_path}.npy")
+            with open(f"{self._base_path}.keys", 'r') as f:
+                keys = f.read().split()
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Could not read the embedding cache, starting empty: {str(e)}")
+            return
+
+        # The vectors are written before the keys, so after an interrupted save the
+        # rows past the end of the keys are ignored
+        count = min(len(keys), len(vectors))
+        self._vectors = vectors[:count]
+        self._rows = {key: row for row, key in enumerate(keys[:count])}
+
+    def _round(self, vectors):
+        """Vectors at the cache's storage precision, as float32."""
+        return np.asarray(vectors, dtype=np.float32).astype(self.dtype).astype(np.float32)
+
+    def embed_documents(self, texts):
+        """Embed texts, only running the model on the ones not cached yet."""
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = OrderedDict()
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is not None:
+                    results[i] = self._vectors[row]
+                elif key in self._pending:
+                    results[i] = self._pending[key]
+                else:
+                    missing.setdefault(key, texts[i])
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            computed = self._round(self.embeddings.embed_documents(list(missing.values())))
+            with self._lock:
+                for key, vector in zip(missing, computed):
+                    self._pending[key] = vector
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = self._pending[key]
+
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in results]
+
+    def embed_query(self, text):
+        """Embed a query, reusing the embedding of a recent identical query."""
+        if not self.query_cache_size:
+            return self.embeddings.embed_query(text)
+
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.query_hits += 1
+                return list(vector)
+            self.query_misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._queries[text] = tuple(vector)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def save(self):
+        """Add the embeddings computed since the last save to the persistent cache."""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            if not self._pending:
+                return
+            new_vectors = np.stack(list(self._pending.values())).astype(self.dtype)
+            vectors = new_vectors if self._vectors is None else np.concatenate([self._vectors, new_vectors])
+            keys = list(self._rows) + list(self._pending)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            base_path = self._base_path
+            with open(f"{base_path}.npy.tmp", 'wb') as f:
+                np.save(f, vectors)
+            os.replace(f"{base_path}.npy.tmp", f"{base_path}.npy")
+            with open(f"{base_path}.keys.tmp", 'w') as f:
+                f.write("\n".join(keys) + "\n")
+            os.replace(f"{base_path}.keys.tmp", f"{base_path}.keys")
+
+            for key in self._pending:
+                self._rows[key] = len(self._rows)
+            self._vectors = vectors
+            self._pending.clear()
+
+    def stats(self):
+        """Return hit/miss counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached": len(self._rows) + len(self._pending),
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+            }
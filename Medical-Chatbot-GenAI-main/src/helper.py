@@ -19,6 +19,16 @@ def load_pdf_file(data):
 
 
 
+#Extract Data From a single PDF File
+def load_single_pdf(path):
+    loader=PyPDFLoader(path)
+
+    documents=loader.load()
+
+    return documents
+
+
+
 #Split the Data into Text Chunks
 def text_split(extracted_data):
     text_splitter=RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
@@ -28,6 +38,9 @@ def text_split(extracted_data):
 
 
 #Download the Embeddings from HuggingFace 
-def download_hugging_face_embeddings():
-    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')  #this model return 384 dimensions
+def download_hugging_face_embeddings(batch_size=None):
+    #batch_size sets how many texts the model encodes per forward pass (library default: 32)
+    encode_kwargs={'batch_size': batch_size} if batch_size else {}
+    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2',
+                                     encode_kwargs=encode_kwargs)  #this model return 384 dimensions
     return embeddings
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+Incremental ingestion of the PDF corpus into the vector indexes.
+
+A manifest records the hash of every ingested PDF and the ids (content hashes) of its
+chunks. On the next run only new or changed PDFs are parsed and split, only chunks
+whose ids are not indexed yet are embedded, and chunks that no PDF contains any more
+are deleted, so an update costs time proportional to what changed. Identical chunks
+(within or across files) are stored once.
+
+PDFs are parsed and split in a process pool, a bounded number of files ahead of the
+consumer, and their chunks stream through a generator into the embedding model in
+large batches, so parsing, splitting and embedding overlap while only a few parsed
+files and one batch of chunk texts are waiting at a time.
+
+The local index (src/vector_index.py) holds every chunk's vector, and Pinecone is
+synced from it: new ids are upserted in bulk with the vectors already computed,
+removed ids are deleted, and the Pinecone index is only created when it does not
+exist yet.
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from src.helper import load_single_pdf, text_split
+from src.vector_index import DEFAULT_INDEX_DIR, INDEX_VERSION, LocalVectorIndex, chunk_id
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_file=MANIFEST_FILE):
+    """Load the ingestion manifest (an empty one if it is missing or unreadable)."""
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest.setdefault("pinecone", {})
+    return manifest
+
+
+def save_manifest(manifest, manifest_file=MANIFEST_FILE):
+    """Write the manifest atomically."""
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
+def split_file(path):
+    """
+    Parse and split one PDF.
+
+    Returns:
+        (path, number of pages, {chunk id: document}) with the chunks in document order
+    """
+    pages = load_single_pdf(path)
+    chunks = {}
+    for document in text_split(pages):
+        chunks.setdefault(chunk_id(document.page_content), document)
+    return path, len(pages), chunks
+
+
+def iter_split_files(paths, workers=None, window=None):
+    """
+    Yield split_file(path) for each path, in order, parsing the PDFs in a process pool.
+
+    At most `window` files are being parsed or waiting to be consumed at once, so when
+    embedding is slower than parsing the parsed chunks don't pile up in memory.
+
+    Args:
+        paths: PDF paths
+        workers: Number of parser processes (default: all cores; 1 parses in this process)
+        window: Files submitted ahead of the consumer (default: 2 * workers)
+    """
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield split_file(path)
+        return
+
+    window = window or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append(executor.submit(split_file, path))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of up to batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_local_index(index_dir):
+    """Load the local index for updating, or None if there is no usable one."""
+    try:
+        return LocalVectorIndex.load(index_dir, mmap=False)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def sync_pinecone(pc, index_name, index, previous_ids, dimension=384, batch_size=200, threads=4):
+    """
+    Bring a Pinecone index in line with the local index.
+
+    Args:
+        pc: Pinecone client
+        index_name: Name of the Pinecone index (created if it doesn't exist)
+        index: The up-to-date LocalVectorIndex
+        previous_ids: Chunk ids upserted by earlier runs
+        dimension: Vector dimension used when creating the index
+        batch_size: Vectors per upsert request
+        threads: Upsert requests in flight at once
+
+    Returns:
+        (upserted, deleted) counts
+    """
+    from pinecone import ServerlessSpec
+
+    if index_name not in pc.list_indexes().names():
+        pc.create_index(
+            name=index_name,
+            dimension=dimension,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws",
+                region="us-east-1"
+            )
+        )
+    target = pc.Index(index_name)
+
+    current = set(index.ids)
+    previous = set(previous_ids)
+
+    # Upsert the vectors already in the local index instead of embedding again;
+    # the chunk text goes in the "text" metadata field like PineconeVectorStore does
+    rows = [row for row, chunk in enumerate(index.ids) if chunk not in previous]
+
+    def upsert(batch):
+        vectors = np.asarray(index.vectors[batch]).tolist()
+        target.upsert(vectors=[
+            (index.ids[row], vector, dict(index.metadatas[row], text=index.texts[row]))
+            for row, vector in zip(batch, vectors)
+        ])
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # list() so a failed request raises here
+        list(executor.map(upsert, iter_batches(rows, batch_size)))
+
+    removed = sorted(previous - current)
+    for batch in iter_batches(removed, 1000):
+        target.delete(ids=batch)
+
+    return len(rows), len(removed)
+
+
+def ingest(data_dir, embeddings, index_dir=DEFAULT_INDEX_DIR, manifest_file=MANIFEST_FILE,
+           pc=None, index_name="medicalbot", workers=None, embed_batch_size=512,
+           upsert_batch_size=200, upsert_threads=4):
+    """
+    Update the local index (and optionally Pinecone) from the PDFs in a directory.
+
+    Args:
+        data_dir: Directory with the PDF corpus
+        embeddings: LangChain embeddings used for new chunks
+        index_dir: Local index directory
+        manifest_file: Manifest of ingested files and chunks
+        pc: Pinecone client to sync as well (None: local index only)
+        index_name: Pinecone index name
+        workers: PDF parser processes (default: all cores)
+        embed_batch_size: Chunks passed to the embedding model per call
+        upsert_batch_size: Vectors per Pinecone upsert request
+        upsert_threads: Pinecone upsert requests in flight at once
+
+    Returns:
+        Dict of counts and throughput describing what changed
+    """
+    start = time.time()
+    manifest = load_manifest(manifest_file)
+    index = load_local_index(index_dir)
+    indexed = set(index.ids) if index is not None else set()
+
+    files = {}
+    stale = {}
+    stats = {"files": 0, "files_parsed": 0, "files_removed": 0, "pages": 0, "chunks_parsed": 0}
+
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.pdf"))):
+        stats["files"] += 1
+        digest = file_hash(path)
+        previous = manifest["files"].get(path)
+
+        # Unchanged files are skipped, unless some of their chunks are missing from the index
+        if previous and previous["sha256"] == digest and indexed.issuperset(previous["chunks"]):
+            files[path] = previous
+        else:
+            stale[path] = digest
+
+    stats["files_removed"] = len(set(manifest["files"]) - set(files) - set(stale))
+
+    def new_chunks():
+        """Chunks of the stale files that aren't indexed yet, as (id, document) pairs."""
+        queued = set()
+        for path, pages, chunks in iter_split_files(list(stale), workers):
+            files[path] = {"sha256": stale[path], "chunks": list(chunks)}
+            stats["files_parsed"] += 1
+            stats["pages"] += pages
+            stats["chunks_parsed"] += len(chunks)
+            for chunk, document in chunks.items():
+                if chunk not in indexed and chunk not in queued:
+                    queued.add(chunk)
+                    yield chunk, document
+
+    # Embed in large batches while the pool keeps parsing the next files
+    parts = []
+    embed_seconds = 0.0
+    for batch in iter_batches(new_chunks(), embed_batch_size):
+        embed_start = time.time()
+        parts.append(LocalVectorIndex.from_documents([document for _, document in batch], embeddings,
+                                                     [chunk for chunk, _ in batch]))
+        embed_seconds += time.time() - embed_start
+    added = sum(len(part) for part in parts)
+
+    if index is None:
+        index = LocalVectorIndex.empty(0)
+
+    # Drop chunks no file contains any more, then append the new ones in one copy
+    seen = set()
+    for entry in files.values():
+        seen.update(entry["chunks"])
+    removed = indexed - seen
+    index.remove(removed)
+    index.extend(parts)
+    index.save(index_dir)
+
+    stats.update(chunks=len(index), chunks_added=added, chunks_removed=len(removed))
+
+    if pc is not None:
+        previous_ids = manifest["pinecone"].get(index_name, [])
+        upserted, deleted = sync_pinecone(pc, index_name, index, previous_ids,
+                                          dimension=index.dimension or 384,
+                                          batch_size=upsert_batch_size, threads=upsert_threads)
+        manifest["pinecone"][index_name] = list(index.ids)
+        stats.update(pinecone_upserted=upserted, pinecone_deleted=deleted)
+
+    manifest["files"] = dict(sorted(files.items()))
+    manifest["index_version"] = INDEX_VERSION
+    save_manifest(manifest, manifest_file)
+
+    seconds = max(time.time() - start, 1e-6)
+    stats.update(
+        seconds=round(seconds, 2),
+        pages_per_second=round(stats["pages"] / seconds, 1),
+        chunks_per_second=round(stats["chunks_parsed"] / seconds, 1),
+        embeddings_per_second=round(added / embed_seconds, 1) if embed_seconds else 0.0,
+    )
+    return stats
@@ -0,0 +1,124 @@
+"""
+Atomic publishing of artifact directories (the local vector index, the OCR formulary).
+
+An artifact path such as vector_index/ is a symlink to a versioned sibling directory
+(.vector_index.v-XXXXXXXX). A writer builds a new version in its own directory and
+switches the link to it with os.replace, which is atomic: readers resolve the link once
+and see either the old or the new version, never a half-written or missing one, and any
+number of writers can publish at once (the last one wins).
+
+Replaced versions are kept for a grace period so readers and worker processes that
+resolved the old link can finish with it, then removed by a later publish. A reader
+that still loses that race gets FileNotFoundError, which read_published retries
+against the new link.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+# Seconds a replaced version is kept before a later publish removes it
+KEEP_REPLACED_SECONDS = 3600
+
+
+def _version_prefix(path):
+    return f".{os.path.basename(os.path.abspath(path))}.v-"
+
+
+def new_version_dir(path):
+    """Create an empty directory for the next version of the artifact at path."""
+    path = os.path.abspath(path)
+    return tempfile.mkdtemp(prefix=_version_prefix(path), dir=os.path.dirname(path))
+
+
+def publish(version_dir, path, keep_seconds=KEEP_REPLACED_SECONDS):
+    """
+    Make a finished version directory the artifact at path.
+
+    Args:
+        version_dir: Directory from new_version_dir, with every file written
+        path: Artifact path (the symlink readers open)
+        keep_seconds: How long replaced versions are kept for readers still using them
+
+    Returns:
+        path
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    # mkdtemp creates the directory as 0700, other users must be able to read it
+    os.chmod(version_dir, 0o755)
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # An artifact written before it was a symlink: move it aside like a replaced version.
+        # Renaming onto an empty directory only succeeds for a directory, so this fails
+        # rather than moving the link if another writer migrated it first
+        moved = tempfile.mkdtemp(prefix=_version_prefix(path), dir=parent)
+        try:
+            os.rename(path, moved)
+            previous = moved
+        except OSError:
+            os.rmdir(moved)
+
+    link = os.path.join(parent, f".{os.path.basename(path)}.link-{os.urandom(8).hex()}")
+    os.symlink(os.path.basename(version_dir), link)
+    try:
+        os.replace(link, path)
+    except OSError:
+        os.unlink(link)
+        raise
+
+    if previous is not None and os.path.isdir(previous):
+        # Start the grace period of the version just replaced
+        try:
+            os.utime(previous)
+        except OSError:
+            pass
+    prune_versions(path, keep_seconds)
+    return path
+
+
+def prune_versions(path, keep_seconds=KEEP_REPLACED_SECONDS):
+    """Remove versions of the artifact at path that are not current and older than keep_seconds."""
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    current = os.path.realpath(path)
+    prefix = _version_prefix(path)
+    cutoff = time.time() - keep_seconds
+
+    for entry in os.scandir(parent):
+        if not entry.name.startswith(prefix) or entry.is_symlink() or not entry.is_dir():
+            continue
+        if os.path.realpath(entry.path) == current:
+            continue
+        try:
+            # New, unpublished versions are recent too, so writers never remove each other's
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def read_published(path, read, retries=3):
+    """
+    Read the current version of the artifact at path.
+
+    Args:
+        path: Artifact path
+        read: Function called with the resolved version directory; it should read
+            everything it needs from that directory only
+        retries: Times to re-resolve the link when a concurrent publish removed the
+            version being read
+
+    Returns:
+        What read returned
+
+    Raises:
+        FileNotFoundError: There is no artifact at path (or it kept disappearing)
+    """
+    for attempt in range(retries + 1):
+        try:
+            return read(os.path.realpath(path))
+        except FileNotFoundError:
+            if attempt == retries:
+                raise
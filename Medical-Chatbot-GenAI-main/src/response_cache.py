@@ -0,0 +1,260 @@
+"""
+Response cache for repeated chat questions.
+
+Answers are looked up in two tiers before the LLM is called:
+
+1. Exact: the normalized query (lowercase, no punctuation, single spaces) is a key.
+2. Semantic: the query's MiniLM embedding is compared with the cached questions, and
+   the closest one is used if its cosine similarity reaches the threshold and both
+   questions have the same signature: the same numbers (so "Dolo 650" never answers
+   "Dolo 500") and the same negations and qualifiers (with/without food, before/after
+   meals, can/can't, children/adults, ...). Sentence embeddings barely separate such
+   pairs, but for a medical question they change the answer.
+
+Entries expire after a TTL and the least recently used ones are evicted once the cache
+is full. The embedding model can be loaded in the background, and until it is ready
+only the exact tier is used.
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# Negations, including contractions with and without their apostrophe ("can't" is
+# normalized to "can t")
+_NEGATIONS = {
+    "no", "not", "never", "nor", "neither", "cannot", "t", "cant", "dont", "doesnt", "didnt",
+    "isnt", "arent", "wasnt", "werent", "shouldnt", "wont", "wouldnt", "mustnt", "havent", "hasnt",
+}
+
+# Qualifier words (and their variants) that change the answer to a medication question
+_QUALIFIERS = {
+    "with": "with", "without": "without",
+    "before": "before", "after": "after", "during": "during", "while": "during",
+    "empty": "empty", "full": "full",
+    "child": "child", "children": "child", "kid": "child", "kids": "child", "toddler": "child",
+    "baby": "infant", "babies": "infant", "infant": "infant", "infants": "infant",
+    "adult": "adult", "adults": "adult",
+    "elderly": "elderly", "senior": "elderly", "seniors": "elderly",
+    "pregnant": "pregnancy", "pregnancy": "pregnancy",
+    "breastfeeding": "breastfeeding", "nursing": "breastfeeding",
+    "morning": "morning", "night": "night", "bedtime": "night",
+    "alcohol": "alcohol", "overdose": "overdose",
+    "max": "maximum", "maximum": "maximum", "minimum": "minimum",
+    "once": "once", "twice": "twice", "daily": "daily", "weekly": "weekly",
+}
+
+
+def normalize_query(query):
+    """Lowercase a query, drop punctuation and collapse whitespace."""
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+
+def query_signature(normalized):
+    """
+    The numbers, negation and qualifiers of a normalized query.
+
+    A semantic match is only used when the cached question has the same signature.
+    """
+    words = normalized.split()
+    qualifiers = {_QUALIFIERS[word] for word in words if word in _QUALIFIERS}
+    negated = any(word in _NEGATIONS for word in words)
+    return sorted(_NUMBER.findall(normalized)), negated, frozenset(qualifiers)
+
+
+class ResponseCache:
+    """Exact and embedding-similarity cache of chat responses with TTL and LRU eviction."""
+
+    def __init__(self, embeddings=None, similarity_threshold=0.92, max_entries=1000, ttl=24 * 60 * 60):
+        """
+        Args:
+            embeddings: LangChain embeddings (e.g. download_hugging_face_embeddings());
+                None disables the semantic tier until load_embeddings_async sets one
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+            max_entries: Number of cached responses
+            ttl: Seconds a response stays valid
+        """
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # normalized query -> (response, created, slot)
+        self._entries = OrderedDict()
+        # Unit-length embeddings of the cached queries, one row per slot
+        self._vectors = None
+        self._slot_keys = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        # Embeddings computed by get() for queries that missed, reused by put()
+        self._recent_vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def load_embeddings_async(self, loader):
+        """Load the embedding model in a background thread (loader returns an embeddings object)."""
+        def load():
+            try:
+                self.embeddings = loader()
+                logger.info("Response cache embeddings loaded, semantic matching enabled")
+            except Exception as e:
+                logger.warning(f"Could not load embeddings, using exact matching only: {str(e)}")
+
+        thread = threading.Thread(target=load, name="response-cache-embeddings", daemon=True)
+        thread.start()
+        return thread
+
+    def _embed(self, normalized):
+        """Unit-length embedding of a normalized query, or None if embedding fails."""
+        try:
+            vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Could not embed query for the response cache: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, query):
+        """Return the cached response for a query, or None."""
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry[0]
+                self._remove(key)
+                self.expired += 1
+
+        vector = self._embed(key) if self.embeddings is not None else None
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        signature = query_signature(key)
+
+        with self._lock:
+            # Keep the embedding so put() doesn't compute it again
+            self._recent_vectors[key] = vector
+            while len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+
+            if self._vectors is not None and self._entries:
+                similarities = self._vectors @ vector
+                # Try the most similar questions first, skipping ones with other numbers,
+                # negation or qualifiers
+                for slot in np.argsort(-similarities)[:5]:
+                    if similarities[slot] < self.similarity_threshold:
+                        break
+                    match = self._slot_keys[slot]
+                    if match is None or query_signature(match) != signature:
+                        continue
+                    response, created, _ = self._entries[match]
+                    if now - created > self.ttl:
+                        self._remove(match)
+                        self.expired += 1
+                        continue
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return response
+
+            self.misses += 1
+        return None
+
+    def put(self, query, response):
+        """Cache a response for a query (empty responses, e.g. fully blocked ones, are skipped)."""
+        if not response or not response.strip():
+            return
+        key = normalize_query(query)
+
+        vector = None
+        if self.embeddings is not None:
+            with self._lock:
+                vector = self._recent_vectors.pop(key, None)
+            if vector is None:
+                vector = self._embed(key)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = key
+            if vector is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self._vectors[slot] = vector
+            self._entries[key] = (response, time.time(), slot)
+
+    def _remove(self, key):
+        """Drop an entry and free its slot (the lock must be held)."""
+        _, _, slot = self._entries.pop(key)
+        self._slot_keys[slot] = None
+        if self._vectors is not None:
+            self._vectors[slot] = 0.0
+        self._free_slots.append(slot)
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._recent_vectors.clear()
+
+    def stats(self):
+        """Return hit/miss counters."""
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "semantic": self.embeddings is not None,
+            }
+
+
+async def cache_stream(cache, query, chunks):
+    """
+    Pass streamed text pieces through and cache the full response once the stream ends.
+
+    Nothing is cached if the stream fails, is abandoned part way or yields no text
+    (e.g. when every chunk was blocked).
+    """
+    parts = []
+    async for text in chunks:
+        parts.append(text)
+        yield text
+    response = "".join(parts)
+    if response.strip():
+        # Embedding the query for the semantic tier is CPU work, so keep it off the event loop
+        await asyncio.to_thread(cache.put, query, response)
+
+
+async def single_chunk(text):
+    """An async stream of one text piece (used to stream a cached response)."""
+    yield text
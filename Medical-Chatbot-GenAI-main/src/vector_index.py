@@ -0,0 +1,247 @@
+"""
+Local vector index for the RAG chatbot.
+
+A NumPy cosine-similarity index kept in a directory: the unit-length chunk embeddings
+as a float32 .npy file (memory-mapped when loaded), the chunk ids, texts and metadata
+as JSON lines, and a meta.json. Chunk ids are content hashes, so re-ingesting an
+unchanged chunk (see src/ingest.py) finds it already indexed. store_index.py writes
+it and app.py can retrieve from it in-process instead of querying Pinecone, which for
+a corpus of a few PDFs takes well under a millisecond per query and works offline.
+
+The index directory is published atomically (src/publish.py): save writes a new version
+and switches the index link to it, and load reads every file from one version, so a
+reader never sees a partial or missing index while it is being rebuilt.
+"""
+import hashlib
+import json
+import os
+import shutil
+from typing import Any
+
+import numpy as np
+
+from src.publish import new_version_dir, publish, read_published
+
+try:
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+except ImportError:
+    Document = None
+    BaseRetriever = None
+
+# Bump when the index layout changes
+INDEX_VERSION = 2
+
+DEFAULT_INDEX_DIR = "vector_index"
+
+
+def chunk_id(text):
+    """Content-derived id of a chunk: identical text always gets the same id."""
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def normalize_rows(vectors):
+    """Scale each row to unit length (zero rows are left as they are)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class LocalVectorIndex:
+    """Cosine-similarity search over unit-length vectors."""
+
+    def __init__(self, vectors, texts, metadatas=None, meta=None, ids=None):
+        """
+        Args:
+            vectors: (n, dimension) array of unit-length float32 vectors
+            texts: List of n chunk texts
+            metadatas: List of n metadata dicts
+            meta: Index metadata (e.g. the embedding model name)
+            ids: List of n chunk ids (default: chunk_id of each text)
+        """
+        self.vectors = vectors
+        self.texts = list(texts)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.texts]
+        self.meta = meta or {}
+        self.ids = list(ids) if ids is not None else [chunk_id(text) for text in self.texts]
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    @classmethod
+    def empty(cls, dimension, meta=None):
+        """An index without any chunks."""
+        return cls(np.zeros((0, dimension), dtype=np.float32), [], meta=meta)
+
+    @classmethod
+    def from_documents(cls, documents, embeddings, ids=None):
+        """
+        Embed LangChain documents and index them.
+
+        Args:
+            documents: List of documents with page_content and metadata
+            embeddings: LangChain embeddings (e.g. download_hugging_face_embeddings())
+            ids: Chunk ids (default: chunk_id of each text)
+        """
+        texts = [document.page_content for document in documents]
+        metadatas = [dict(document.metadata) for document in documents]
+        vectors = normalize_rows(embeddings.embed_documents(texts)) if texts else None
+        meta = {"embedding_model": getattr(embeddings, "model_name", None)}
+        if vectors is None:
+            return cls.empty(0, meta)
+        return cls(vectors, texts, metadatas, meta, ids)
+
+    def add_documents(self, documents, embeddings, ids=None):
+        """Embed and append documents (only these are embedded; existing rows are kept)."""
+        if documents:
+            self.extend([LocalVectorIndex.from_documents(documents, embeddings, ids)])
+
+    def extend(self, parts):
+        """Append the chunks of other indexes, copying the vectors once for all of them."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return
+        vectors = [np.asarray(self.vectors)] if len(self) else []
+        self.vectors = np.concatenate(vectors + [part.vectors for part in parts])
+        for part in parts:
+            self.texts += part.texts
+            self.metadatas += part.metadatas
+            self.ids += part.ids
+        if not self.meta.get("embedding_model"):
+            self.meta["embedding_model"] = parts[0].meta.get("embedding_model")
+
+    def remove(self, ids):
+        """Drop the chunks with the given ids."""
+        ids = set(ids)
+        keep = [row for row, chunk in enumerate(self.ids) if chunk not in ids]
+        if len(keep) == len(self.ids):
+            return
+        self.vectors = np.asarray(self.vectors)[keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.ids = [self.ids[row] for row in keep]
+
+    def search(self, query_vector, k=3):
+        """
+        Find the k vectors most similar to a query vector.
+
+        Returns:
+            List of (row, cosine similarity) tuples, most similar first
+        """
+        if not len(self):
+            return []
+        query_vector = normalize_rows(query_vector)
+        scores = np.asarray(self.vectors @ query_vector)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def similarity_search(self, query, embeddings, k=3):
+        """Return the k chunks most similar to a text query as (text, metadata, score) tuples."""
+        results = self.search(embeddings.embed_query(query), k)
+        return [(self.texts[row], self.metadatas[row], score) for row, score in results]
+
+    def save(self, index_dir=DEFAULT_INDEX_DIR):
+        """Write the index to a directory (replacing any index already there)."""
+        meta = dict(self.meta, version=INDEX_VERSION, count=len(self), dimension=int(self.dimension))
+
+        # Write a new version, then switch the index link to it atomically
+        tmp_dir = new_version_dir(index_dir)
+        try:
+            np.save(os.path.join(tmp_dir, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+            with open(os.path.join(tmp_dir, "documents.jsonl"), 'w') as f:
+                for chunk, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                    f.write(json.dumps({"id": chunk, "text": text, "metadata": metadata}, default=str) + "\n")
+            with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+                json.dump(meta, f, indent=2)
+            publish(tmp_dir, index_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return index_dir
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR, mmap=True):
+        """Load an index saved by save(), memory-mapping the vectors unless mmap is False."""
+        return read_published(index_dir, lambda version_dir: cls._load_version(version_dir, mmap))
+
+    @classmethod
+    def _load_version(cls, index_dir, mmap):
+        with open(os.path.join(index_dir, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Vector index in {index_dir} has version {meta.get('version')}, "
+                             f"expected {INDEX_VERSION}; rebuild it with store_index.py")
+
+        vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode='r' if mmap else None)
+        ids, texts, metadatas = [], [], []
+        with open(os.path.join(index_dir, "documents.jsonl"), 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                texts.append(record["text"])
+                metadatas.append(record["metadata"])
+        return cls(vectors, texts, metadatas, meta, ids)
+
+
+if BaseRetriever is not None:
+    class LocalVectorRetriever(BaseRetriever):
+        """LangChain retriever backed by a LocalVectorIndex."""
+
+        index: LocalVectorIndex
+        embeddings: Any
+        k: int = 3
+
+        def _get_relevant_documents(self, query, *, run_manager=None):
+            return [
+                Document(page_content=text, metadata=dict(metadata, score=score))
+                for text, metadata, score in self.index.similarity_search(query, self.embeddings, self.k)
+            ]
+else:
+    LocalVectorRetriever = None
+
+
+def load_retriever(embeddings, backend=None, k=3, index_dir=DEFAULT_INDEX_DIR, index_name="medicalbot"):
+    """
+    Build the retriever used by the RAG chain.
+
+    Args:
+        embeddings: LangChain embeddings used to embed queries
+        backend: "local" (LocalVectorIndex), "pinecone", or None/"auto" to use the local
+            index when one exists and Pinecone otherwise (default: the RETRIEVER_BACKEND
+            environment variable)
+        k: Number of chunks to retrieve
+        index_dir: Directory of the local index
+        index_name: Pinecone index name
+
+    Raises:
+        ValueError: The local index was built with a different embedding model than
+            embeddings, so its similarity scores would be meaningless
+    """
+    backend = backend or os.environ.get('RETRIEVER_BACKEND', 'auto')
+    if backend == "auto":
+        backend = "local" if os.path.exists(os.path.join(index_dir, "meta.json")) else "pinecone"
+
+    if backend == "local":
+        if LocalVectorRetriever is None:
+            raise ImportError("langchain_core is required for LocalVectorRetriever")
+        index = LocalVectorIndex.load(index_dir)
+        index_model = index.meta.get("embedding_model")
+        query_model = getattr(embeddings, "model_name", None)
+        if index_model and query_model and index_model != query_model:
+            raise ValueError(f"Vector index in {index_dir} was built with {index_model}, but queries "
+                             f"are embedded with {query_model}; rebuild it with store_index.py")
+        return LocalVectorRetriever(index=index, embeddings=embeddings, k=k)
+
+    if backend == "pinecone":
+        from langchain_pinecone import PineconeVectorStore
+        docsearch = PineconeVectorStore.from_existing_index(index_name=index_name, embedding=embeddings)
+        return docsearch.as_retriever(search_type="similarity", search_kwargs={"k": k})
+
+    raise ValueError(f"Unknown retriever backend: {backend}")
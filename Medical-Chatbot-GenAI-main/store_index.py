@@ -1,41 +1,63 @@
-from src.helper import load_pdf_file, text_split, download_hugging_face_embeddings
-from pinecone.grpc import PineconeGRPC as Pinecone
-from pinecone import ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
+from src.helper import download_hugging_face_embeddings
+from src.embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR
+from src.ingest import ingest
+from src.vector_index import DEFAULT_INDEX_DIR
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
 import os
 
 
 load_dotenv()
 
 PINECONE_API_KEY=os.environ.get('PINECONE_API_KEY')
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
+# "local" only writes the local vector index, "pinecone" also uploads to Pinecone,
+# "auto" (the default) uploads to Pinecone when an API key is configured
+RETRIEVER_BACKEND = os.environ.get('RETRIEVER_BACKEND', 'auto')
 
-extracted_data=load_pdf_file(data='Data/')
-text_chunks=text_split(extracted_data)
-embeddings = download_hugging_face_embeddings()
+# Throughput settings: PDF parser processes (0 uses all cores), chunks per embedding
+# call, and vectors per Pinecone upsert request
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '0'))
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '512'))
+UPSERT_BATCH_SIZE = int(os.environ.get('UPSERT_BATCH_SIZE', '200'))
 
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
+def main():
+    # Chunks embedded by earlier runs come from the embedding cache instead of the model
+    embeddings = CachedEmbeddings(download_hugging_face_embeddings(batch_size=64), DEFAULT_CACHE_DIR)
 
-index_name = "medicalbot"
+    pc = None
+    if RETRIEVER_BACKEND == "pinecone" or (RETRIEVER_BACKEND == "auto" and PINECONE_API_KEY):
+        from pinecone.grpc import PineconeGRPC as Pinecone
 
+        os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
-pc.create_index(
-    name=index_name,
-    dimension=384, 
-    metric="cosine", 
-    spec=ServerlessSpec(
-        cloud="aws", 
-        region="us-east-1"
-    ) 
-) 
+        pc = Pinecone(api_key=PINECONE_API_KEY)
 
-# Embed each chunk and upsert the embeddings into your Pinecone index.
-docsearch = PineconeVectorStore.from_documents(
-    documents=text_chunks,
-    index_name=index_name,
-    embedding=embeddings, 
-)
+    index_name = "medicalbot"
+
+
+    # Only new or changed PDFs are parsed and only chunks that aren't indexed yet are
+    # embedded and upserted; chunks of removed or edited PDFs are deleted
+    try:
+        stats = ingest('Data/', embeddings, index_dir=DEFAULT_INDEX_DIR, pc=pc, index_name=index_name,
+                       workers=INGEST_WORKERS or None, embed_batch_size=EMBED_BATCH_SIZE,
+                       upsert_batch_size=UPSERT_BATCH_SIZE)
+    finally:
+        embeddings.save()
+
+    print(f"Parsed {stats['files_parsed']} of {stats['files']} PDFs "
+          f"({stats['files_removed']} removed) in {stats['seconds']} seconds")
+    print(f"Saved {stats['chunks']} chunks to {DEFAULT_INDEX_DIR}/ "
+          f"({stats['chunks_added']} added, {stats['chunks_removed']} removed)")
+    print(f"{stats['pages_per_second']} pages/sec, {stats['chunks_per_second']} chunks/sec, "
+          f"{stats['embeddings_per_second']} embeddings/sec")
+    cache_stats = embeddings.stats()
+    print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} embedded")
+    if pc is not None:
+        print(f"Pinecone index {index_name}: {stats['pinecone_upserted']} upserted, "
+              f"{stats['pinecone_deleted']} deleted")
+
+
+# The guard keeps the PDF parser processes from re-running ingestion when they import this module
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from src.chat_backend import stream_chat_events
+
+
+async def collect(chunks):
+    return [event async for event in stream_chat_events(chunks, 0.0)]
+
+
+async def pieces(*texts):
+    for text in texts:
+        yield text
+
+
+def test_stream_ends_with_done():
+    events = asyncio.run(collect(pieces("Take it ", "with food.")))
+    assert [event.split("\n")[0] for event in events] == ["event: token", "event: token", "event: done"]
+
+
+def test_stream_without_text_is_an_error():
+    # Gemini blocked every chunk, so generate_stream yielded nothing
+    events = asyncio.run(collect(pieces()))
+    assert len(events) == 1 and events[0].startswith("event: error")
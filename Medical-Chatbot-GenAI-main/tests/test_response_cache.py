@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from src.response_cache import ResponseCache, cache_stream
+
+
+class SameVector:
+    """Embeddings that map every query to the same vector, so every pair is a semantic candidate."""
+
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(SameVector(), similarity_threshold=0.92)
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Can I take ibuprofen with food?", "Can I take ibuprofen without food?"),
+    ("Should I take metformin before meals?", "Should I take metformin after meals?"),
+    ("Can I take aspirin while pregnant?", "Can't I take aspirin while pregnant?"),
+    ("Is it safe to take cetirizine at night?", "Is it not safe to take cetirizine at night?"),
+    ("What is the paracetamol dose for children?", "What is the paracetamol dose for adults?"),
+    ("How much Dolo 650 can I take?", "How much Dolo 500 can I take?"),
+])
+def test_semantic_tier_keeps_qualifiers_apart(cache, cached, asked):
+    cache.put(cached, "answer")
+    assert cache.get(asked) is None
+
+
+def test_semantic_tier_matches_same_qualifiers(cache):
+    cache.put("Can I take ibuprofen with food?", "answer")
+    assert cache.get("is it ok to take ibuprofen with food") == "answer"
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_empty_stream_is_not_cached(cache):
+    async def blocked():
+        return
+        yield
+
+    async def consume():
+        return [text async for text in cache_stream(cache, "What is Crocin?", blocked())]
+
+    assert asyncio.run(consume()) == []
+    assert cache.get("What is Crocin?") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.vector_index import LocalVectorIndex, load_retriever, normalize_rows
+
+
+class FakeEmbeddings:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+def make_index(texts, model_name="all-MiniLM-L6-v2"):
+    vectors = normalize_rows(np.eye(len(texts), 2))
+    return LocalVectorIndex(vectors, texts, meta={"embedding_model": model_name})
+
+
+def test_save_replaces_the_index_atomically(tmp_path):
+    index_dir = str(tmp_path / "vector_index")
+    make_index(["aspirin"]).save(index_dir)
+    first = os.path.realpath(index_dir)
+
+    make_index(["aspirin", "ibuprofen"]).save(index_dir)
+    assert os.path.islink(index_dir)
+    assert LocalVectorIndex.load(index_dir).texts == ["aspirin", "ibuprofen"]
+    # Readers that resolved the old version can still finish with it
+    assert LocalVectorIndex.load(first).texts == ["aspirin"]
+
+
+def test_retriever_rejects_an_index_from_another_model(tmp_path):
+    pytest.importorskip("langchain_core")
+    index_dir = str(tmp_path / "vector_index")
+    make_index(["aspirin"]).save(index_dir)
+
+    retriever = load_retriever(FakeEmbeddings("all-MiniLM-L6-v2"), backend="local", index_dir=index_dir)
+    assert [doc.page_content for doc in retriever.invoke("aspirin")] == ["aspirin"]
+    with pytest.raises(ValueError, match="rebuild"):
+        load_retriever(FakeEmbeddings("all-mpnet-base-v2"), backend="local", index_dir=index_dir)
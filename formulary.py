@@ -0,0 +1,252 @@
+"""
+Medication formulary loading and compilation.
+
+load_medication_names reads the plain list of names (indian_medications.txt, or a CSV
+with a "name" column). load_formulary compiles that source into a versioned artifact
+directory next to it - the names, their normalised forms and the MedicationMatcher
+indexes as .npy files plus a meta.json - and memory-maps it on later runs. The artifact
+is rebuilt automatically when the source file's hash or the artifact version changes.
+
+Because the arrays are memory-mapped read-only, worker processes share the same pages
+instead of each re-reading and re-indexing the source file.
+
+The artifact path is a symlink to a versioned build directory, switched atomically
+when the artifact is rebuilt (src.publish, from the chatbot package), so processes that
+compile and load the same formulary at once never see a partial or missing artifact.
+A loaded Formulary keeps using the build it resolved.
+
+The artifact also holds the files for formulary-constrained Tesseract decoding: a
+--user-words list of the words in the names, --user-patterns for their numeric parts
+(strengths such as 650 or 2.5) and a character whitelist. Their file names carry the
+source hash, so a Tesseract config pointing at them changes whenever the list does.
+Formulary.tesseract_config() returns the options to pass to an OCR backend.
+"""
+import csv
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import string
+
+import numpy as np
+
+from medication_matcher import MedicationMatcher, build_match_arrays
+from src.publish import new_version_dir, publish, read_published
+
+# Bump when the artifact layout or build_match_arrays changes
+FORMULARY_VERSION = 2
+
+DEFAULT_SOURCE = "indian_medications.txt"
+
+
+def load_medication_names(filename=DEFAULT_SOURCE):
+    """Load medication names from a text file (one per line) or a CSV file."""
+    if filename.lower().endswith(".csv"):
+        with open(filename, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = [column.strip().lower() for column in header]
+            if "name" in columns:
+                column = columns.index("name")
+            else:
+                # No header naming the column, treat the first row as data
+                column = 0
+                reader = [header] + list(reader)
+            medications = [row[column].strip() for row in reader if len(row) > column and row[column].strip()]
+        return medications
+
+    with open(filename, 'r') as f:
+        medications = [line.strip() for line in f if line.strip()]
+    return medications
+
+
+def file_hash(filename):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tesseract_user_words(names):
+    """The distinct words of the names that contain letters, for --user-words."""
+    words = {word for name in names for word in name.split() if any(c.isalpha() for c in word)}
+    return sorted(words)
+
+
+def tesseract_user_patterns(names):
+    """
+    Patterns for the words of the names that contain digits, for --user-patterns.
+
+    Digits become \\d so any strength of the same shape matches (e.g. "650" gives
+    "\\d\\d\\d" and "500mg" gives "\\d\\d\\dmg"); other characters are kept literally.
+    """
+    patterns = set()
+    for name in names:
+        for word in name.split():
+            if any(c.isdigit() for c in word):
+                patterns.add(''.join("\\d" if c.isdigit() else c.replace("\\", "\\\\") for c in word))
+    return sorted(patterns)
+
+
+def tesseract_whitelist(names):
+    """The characters used in the names, plus every digit, for tessedit_char_whitelist."""
+    chars = {c for name in names for c in name if not c.isspace()}
+    return ''.join(sorted(chars | set(string.digits)))
+
+
+def default_artifact_dir(source):
+    """Return the artifact directory used for a source file."""
+    return os.path.splitext(source)[0] + ".formulary"
+
+
+def compile_formulary(source=DEFAULT_SOURCE, artifact_dir=None):
+    """
+    Compile a medication list into an artifact directory.
+
+    Args:
+        source: Text or CSV file with medication names
+        artifact_dir: Output directory (default: the source path with a .formulary suffix)
+
+    Returns:
+        Path of the artifact (a symlink to the new build directory)
+    """
+    artifact_dir = artifact_dir or default_artifact_dir(source)
+    names = load_medication_names(source)
+    arrays = build_match_arrays(names)
+    source_sha256 = file_hash(source)
+
+    meta = {
+        "version": FORMULARY_VERSION,
+        "source": os.path.basename(source),
+        "source_sha256": source_sha256,
+        "count": len(names),
+        "arrays": sorted(arrays),
+        "tesseract": {
+            "user_words": f"{source_sha256[:16]}.user-words",
+            "user_patterns": f"{source_sha256[:16]}.user-patterns",
+            "whitelist": tesseract_whitelist(names),
+        },
+    }
+
+    # Write a new build directory, then switch the artifact link to it atomically
+    tmp_dir = new_version_dir(artifact_dir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, meta["tesseract"]["user_words"]), 'w') as f:
+            f.writelines(f"{word}\n" for word in tesseract_user_words(names))
+        with open(os.path.join(tmp_dir, meta["tesseract"]["user_patterns"]), 'w') as f:
+            f.writelines(f"{pattern}\n" for pattern in tesseract_user_patterns(names))
+        with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+            json.dump(meta, f, indent=2)
+        publish(tmp_dir, artifact_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return artifact_dir
+
+
+def read_artifact_meta(artifact_dir):
+    """Return the artifact's meta.json contents, or None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(artifact_dir, "meta.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_artifact(artifact_dir):
+    """Memory-map every array of a compiled artifact."""
+    meta = read_artifact_meta(artifact_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No compiled formulary in {artifact_dir}")
+    return {
+        name: np.load(os.path.join(artifact_dir, f"{name}.npy"), mmap_mode='r')
+        for name in meta["arrays"]
+    }
+
+
+class Formulary:
+    """A loaded formulary: the medication names and a matcher backed by the artifact."""
+
+    def __init__(self, source, artifact_dir, meta, arrays):
+        self.source = source
+        self.artifact_dir = artifact_dir
+        self.meta = meta
+        self.matcher = MedicationMatcher(arrays=arrays, artifact_dir=artifact_dir)
+
+    @property
+    def names(self):
+        return self.matcher.medications
+
+    @property
+    def source_hash(self):
+        return self.meta["source_sha256"]
+
+    def tesseract_config(self, system_dictionary=True):
+        """
+        Tesseract options that constrain decoding to this formulary.
+
+        Pass the result as constraints to ocr_backend.create_backend (or set the
+        OCR_CONSTRAIN_TO environment variable to the source file). The whitelist is
+        honoured by both engines; the user words and patterns mainly steer the legacy
+        engine and the LSTM engine of Tesseract 4.1+.
+
+        Args:
+            system_dictionary: Keep Tesseract's English word lists loaded alongside the
+                formulary words (False restricts the dictionary to the formulary)
+
+        Returns:
+            Config string such as "--user-words ... --user-patterns ... -c tessedit_char_whitelist=..."
+        """
+        files = self.meta["tesseract"]
+        options = [
+            "--user-words", shlex.quote(os.path.abspath(os.path.join(self.artifact_dir, files["user_words"]))),
+            "--user-patterns", shlex.quote(os.path.abspath(os.path.join(self.artifact_dir, files["user_patterns"]))),
+            "-c", shlex.quote(f"tessedit_char_whitelist={files['whitelist']}"),
+        ]
+        if not system_dictionary:
+            options += ["-c", "load_system_dawg=0", "-c", "load_freq_dawg=0"]
+        return ' '.join(options)
+
+    def __len__(self):
+        return len(self.matcher)
+
+
+def load_formulary(source=DEFAULT_SOURCE, artifact_dir=None, rebuild=False):
+    """
+    Load a formulary, compiling it first if the artifact is missing or stale.
+
+    Args:
+        source: Text or CSV file with medication names
+        artifact_dir: Artifact directory (default: the source path with a .formulary suffix)
+        rebuild: Always recompile the artifact
+
+    Returns:
+        A Formulary, whose artifact_dir is the build directory it was read from
+    """
+    artifact_dir = artifact_dir or default_artifact_dir(source)
+
+    def read(build_dir):
+        # Read the meta and the arrays from the same build, even if the link moves meanwhile
+        meta = read_artifact_meta(build_dir)
+        if meta is None:
+            raise FileNotFoundError(f"No compiled formulary in {build_dir}")
+        return Formulary(source, build_dir, meta, load_artifact(build_dir))
+
+    if not rebuild:
+        try:
+            formulary = read_published(artifact_dir, read)
+            if (formulary.meta.get("version") == FORMULARY_VERSION
+                    and formulary.meta.get("source_sha256") == file_hash(source)):
+                return formulary
+        except (FileNotFoundError, KeyError, ValueError):
+            pass  # Missing or unreadable, compile it
+
+    compile_formulary(source, artifact_dir)
+    # Another process may have published its own build since; it is just as fresh
+    return read_published(artifact_dir, read)
@@ -31,11 +31,50 @@ export const ChatContext = createContext<ChatContextType>({
 
 export const useChatContext = () => useContext(ChatContext);
 
+// Read server-sent events from a streaming response, calling onEvent for each one
+const readEventStream = async (
+  body: ReadableStream<Uint8Array>,
+  onEvent: (event: string, data: any) => void
+) => {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      const dataLines: string[] = [];
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith("data:")) {
+          dataLines.push(line.slice(5).trim());
+        }
+      }
+      if (dataLines.length > 0) {
+        onEvent(event, JSON.parse(dataLines.join("\n")));
+      }
+
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+};
+
 const MedicalChatbot = () => {
   const [isOpen, setIsOpen] = useState(false);
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [streamingId, setStreamingId] = useState<string | null>(null);
   const { toast } = useToast();
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLTextAreaElement>(null);
@@ -121,11 +160,13 @@ const MedicalChatbot = () => {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          Accept: "text/event-stream, application/json",
         },
         body: JSON.stringify({ 
           query: content,
           messages: messageHistory,
-          includeContext: true
+          includeContext: true,
+          stream: true
         }),
       });
 
@@ -133,16 +174,66 @@ const MedicalChatbot = () => {
         throw new Error(`Error: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      const botMessage: Message = {
-        id: Date.now().toString(),
-        content: data.response,
-        sender: "bot",
-        timestamp: new Date(),
-      };
-
-      setMessages((prev) => [...prev, botMessage]);
+      const botMessageId = Date.now().toString();
+      const contentType = response.headers.get("Content-Type") || "";
+
+      if (response.body && contentType.includes("text/event-stream")) {
+        // Show the answer as it is generated instead of waiting for all of it
+        let started = false;
+        await readEventStream(response.body, (event, data) => {
+          if (event === "token") {
+            if (!started) {
+              started = true;
+              setStreamingId(botMessageId);
+              setMessages((prev) => [
+                ...prev,
+                {
+                  id: botMessageId,
+                  content: data.text,
+                  sender: "bot",
+                  timestamp: new Date(),
+                },
+              ]);
+            } else {
+              setMessages((prev) =>
+                prev.map((msg) =>
+                  msg.id === botMessageId ? { ...msg, content: msg.content + data.text } : msg
+                )
+              );
+            }
+          } else if (event === "done") {
+            console.info(
+              `Assistant responded in ${data.processing_time} (first token after ${data.time_to_first_token})`
+            );
+            if (!started) {
+              // The stream finished without any text, don't leave the question unanswered
+              setMessages((prev) => [
+                ...prev,
+                {
+                  id: botMessageId,
+                  content: "Sorry, I couldn't generate a response. Please try rephrasing your question.",
+                  sender: "bot",
+                  timestamp: new Date(),
+                },
+              ]);
+            }
+          } else if (event === "error") {
+            throw new Error(data.details || data.error);
+          }
+        });
+      } else {
+        // Servers without streaming support answer with a single JSON response
+        const data = await response.json();
+        
+        const botMessage: Message = {
+          id: botMessageId,
+          content: data.response,
+          sender: "bot",
+          timestamp: new Date(),
+        };
+
+        setMessages((prev) => [...prev, botMessage]);
+      }
     } catch (error) {
       console.error("Error fetching response:", error);
       toast({
@@ -163,6 +254,7 @@ const MedicalChatbot = () => {
       ]);
     } finally {
       setIsLoading(false);
+      setStreamingId(null);
     }
   };
 
@@ -259,7 +351,7 @@ const MedicalChatbot = () => {
                   </div>
                 </div>
               ))}
-              {isLoading && (
+              {isLoading && !streamingId && (
                 <div className="flex justify-start">
                   <div className="max-w-[85%] rounded-lg p-3 bg-muted">
                     <div className="flex items-center">
@@ -0,0 +1,271 @@
+"""
+Seeded batch generator for synthetic medication-label images.
+
+Labels are rendered straight into a preallocated (count, height, width) uint8 stack at
+the final 800x200 resolution, with the gradient background broadcast from one
+precomputed row and uint8 noise drawn directly. All randomness comes from a seeded
+numpy Generator: the style of every label is drawn up front and each label gets its own
+noise seed, so the same seed gives the same images no matter how many threads render
+them (OpenCV releases the GIL while drawing, blurring and rotating).
+
+write_corpus saves a reusable evaluation set: the images as .npy shards (memory-mapped
+when read back by iter_corpus) and a manifest.jsonl with the ground-truth text and
+rendering parameters of every image.
+
+Usage:
+    python label_generator.py --count 100000 --seed 0 --output label_corpus --workers 8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from formulary import DEFAULT_SOURCE, load_medication_names
+
+LABEL_HEIGHT, LABEL_WIDTH = 200, 800
+
+# Labels used to be drawn at 1000x300 and resized to 800x200; font sizes are scaled to match
+FONT_SCALE_FACTOR = LABEL_WIDTH / 1000
+
+FONTS = [
+    cv2.FONT_HERSHEY_SIMPLEX,
+    cv2.FONT_HERSHEY_PLAIN,
+    cv2.FONT_HERSHEY_DUPLEX,
+    cv2.FONT_HERSHEY_COMPLEX
+]
+
+BACKGROUNDS = ["plain", "noise", "gradient"]
+
+# Bump when the corpus layout changes
+CORPUS_VERSION = 1
+
+# Subtle left-to-right gradient from 255 to 236, shared by every gradient label
+_GRADIENT_ROW = (255 - (20 * np.arange(LABEL_WIDTH) // LABEL_WIDTH)).astype(np.uint8)
+
+
+def uniform_noise(rng, shape, high):
+    """uint8 noise in [0, high) drawn from random bytes (no intermediate float arrays)."""
+    noise = np.frombuffer(rng.bytes(int(np.prod(shape))), dtype=np.uint8).reshape(shape)
+    return ((noise.astype(np.uint16) * high) >> 8).astype(np.uint8)
+
+
+def sample_label_params(rng, count):
+    """
+    Draw the rendering parameters of count labels.
+
+    Args:
+        rng: numpy Generator
+        count: Number of labels
+
+    Returns:
+        List of parameter dicts (font_scale, thickness, noise_level, blur_factor,
+        rotation, background, font, seed)
+    """
+    font_scale = rng.uniform(1.2, 2.0, count)
+    thickness = rng.integers(1, 4, count)
+    noise_level = rng.uniform(0.01, 0.1, count)
+    blur_factor = rng.uniform(0.2, 0.8, count)
+    rotation = np.where(rng.random(count) > 0.7, rng.uniform(-10, 10, count), 0.0)
+    background = rng.integers(0, len(BACKGROUNDS), count)
+    font = rng.integers(0, len(FONTS), count)
+    seeds = rng.integers(0, 2 ** 63, count)
+
+    return [{
+        "font_scale": float(font_scale[i]),
+        "thickness": int(thickness[i]),
+        "noise_level": float(noise_level[i]),
+        "blur_factor": float(blur_factor[i]),
+        "rotation": float(rotation[i]),
+        "background": BACKGROUNDS[background[i]],
+        "font": int(font[i]),
+        "seed": int(seeds[i]),
+    } for i in range(count)]
+
+
+def render_label(out, text, params):
+    """
+    Render one label into a (height, width) uint8 array.
+
+    Args:
+        out: Array to draw into (e.g. one slice of a preallocated stack)
+        text: Label text
+        params: Parameters from sample_label_params
+    """
+    rng = np.random.default_rng(params["seed"])
+
+    # Create background texture
+    if params["background"] == "gradient":
+        out[:] = _GRADIENT_ROW[:out.shape[1]]
+    else:
+        out.fill(255)
+        if params["background"] == "noise":
+            cv2.add(out, uniform_noise(rng, out.shape, 30), dst=out)
+
+    # Make sure text is thick enough to be readable, and center it
+    font = FONTS[params["font"]]
+    font_scale = params["font_scale"] * FONT_SCALE_FACTOR
+    thickness = max(params["thickness"], 2)
+    text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
+    text_x = (out.shape[1] - text_size[0]) // 2
+    text_y = (out.shape[0] + text_size[1]) // 2
+    cv2.putText(out, text, (text_x, text_y), font, font_scale, 0, thickness)
+
+    rotation = max(min(params["rotation"], 10), -10)
+    if rotation != 0:
+        center = (out.shape[1] // 2, out.shape[0] // 2)
+        rotation_matrix = cv2.getRotationMatrix2D(center, rotation, 1.0)
+        out[:] = cv2.warpAffine(out, rotation_matrix, (out.shape[1], out.shape[0]))
+
+    # Add noise (capped for better OCR)
+    noise_max = int(255 * min(params["noise_level"], 0.05))
+    if noise_max > 0:
+        cv2.add(out, uniform_noise(rng, out.shape, noise_max), dst=out)
+
+    # Add blur (capped; kernels of size 1 are skipped since they don't change the image)
+    blur_size = int(3 * min(params["blur_factor"], 0.3)) * 2 + 1
+    if blur_size > 1:
+        cv2.GaussianBlur(out, (blur_size, blur_size), 0, dst=out)
+
+    return out
+
+
+def generate_labels(texts, seed=None, params=None, workers=1):
+    """
+    Render a batch of labels.
+
+    Args:
+        texts: Label texts
+        seed: Seed or numpy Generator for the label parameters (ignored if params is given)
+        params: Parameters from sample_label_params, one per text
+        workers: Rendering threads (None uses all cores)
+
+    Returns:
+        (images, params): a (len(texts), 200, 800) uint8 stack and the parameters used
+    """
+    if params is None:
+        params = sample_label_params(np.random.default_rng(seed), len(texts))
+    images = np.empty((len(texts), LABEL_HEIGHT, LABEL_WIDTH), dtype=np.uint8)
+
+    workers = min(workers or os.cpu_count() or 1, len(texts))
+    if workers <= 1:
+        for i, text in enumerate(texts):
+            render_label(images[i], text, params[i])
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda i: render_label(images[i], texts[i], params[i]), range(len(texts))))
+
+    return images, params
+
+
+def write_corpus(output_dir, medication_names, count, seed=0, workers=None, shard_size=1000):
+    """
+    Generate a labelled evaluation corpus on disk.
+
+    Args:
+        output_dir: Corpus directory (replaced if it exists)
+        medication_names: Names to draw the label texts from
+        count: Number of images (names repeat once count exceeds the number of names)
+        seed: Seed for the texts and rendering parameters
+        workers: Rendering threads (None uses all cores)
+        shard_size: Images per .npy shard (bounds the memory used while writing)
+
+    Returns:
+        Path of the corpus directory
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(medication_names), count, replace=count > len(medication_names))
+    texts = [medication_names[i] for i in picks]
+    params = sample_label_params(rng, count)
+
+    # Write into a temporary directory first so readers never see a partial corpus
+    parent = os.path.dirname(os.path.abspath(output_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".label-corpus-", dir=parent)
+    try:
+        shards = []
+        with open(os.path.join(tmp_dir, "manifest.jsonl"), 'w') as manifest:
+            for start in range(0, count, shard_size):
+                end = min(start + shard_size, count)
+                images, _ = generate_labels(texts[start:end], params=params[start:end], workers=workers)
+                shard = f"images-{len(shards):05d}.npy"
+                np.save(os.path.join(tmp_dir, shard), images)
+                shards.append(shard)
+                for i in range(start, end):
+                    manifest.write(json.dumps({"index": i, "shard": shard, "row": i - start,
+                                               "text": texts[i], "params": params[i]}) + "\n")
+
+        with open(os.path.join(tmp_dir, "corpus.json"), 'w') as f:
+            json.dump({
+                "version": CORPUS_VERSION,
+                "seed": seed,
+                "count": count,
+                "height": LABEL_HEIGHT,
+                "width": LABEL_WIDTH,
+                "shards": shards,
+            }, f, indent=2)
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.rename(tmp_dir, output_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return output_dir
+
+
+def read_corpus_meta(corpus_dir):
+    """Return a corpus's corpus.json contents (raises ValueError for another corpus version)."""
+    with open(os.path.join(corpus_dir, "corpus.json"), 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != CORPUS_VERSION:
+        raise ValueError(f"Corpus in {corpus_dir} has version {meta.get('version')}, "
+                         f"expected {CORPUS_VERSION}; regenerate it with label_generator.py")
+    return meta
+
+
+def iter_corpus(corpus_dir, limit=None):
+    """
+    Yield (text, image, params) for the images of a corpus written by write_corpus.
+
+    The shards are memory-mapped, so only the images being used are read from disk.
+    """
+    read_corpus_meta(corpus_dir)
+    shards = {}
+    with open(os.path.join(corpus_dir, "manifest.jsonl"), 'r') as f:
+        for n, line in enumerate(f):
+            if limit is not None and n >= limit:
+                break
+            record = json.loads(line)
+            shard = shards.get(record["shard"])
+            if shard is None:
+                # Only keep the current shard mapped
+                shards = {record["shard"]: np.load(os.path.join(corpus_dir, record["shard"]), mmap_mode='r')}
+                shard = shards[record["shard"]]
+            yield record["text"], np.array(shard[record["row"]]), record["params"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic medication-label corpus")
+    parser.add_argument("--count", type=int, default=10000, help="Number of images")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="label_corpus", help="Corpus directory")
+    parser.add_argument("--formulary", default=DEFAULT_SOURCE,
+                        help="Medication list to draw the label texts from")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Rendering threads (0 uses all cores)")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Images per shard file")
+    args = parser.parse_args()
+
+    names = load_medication_names(args.formulary)
+    write_corpus(args.output, names, args.count, seed=args.seed, workers=args.workers or None,
+                 shard_size=args.shard_size)
+    print(f"Wrote {args.count} labels to {args.output}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+Indexed medication name matching for OCR dictionary correction.
+
+medication_dictionary_correction in ocr_medication_test.py scores every candidate
+against every medication with four fuzzy scorers. MedicationMatcher prepares the
+dictionary once and returns exactly the same results while scoring far fewer pairs:
+
+- the dictionary is lowercased and normalised once, when the matcher is built
+- a prefix index (the sorted names, searched like a flattened trie) finds the
+  medications that start with a candidate
+- a token inverted index finds medications sharing a whole word with a candidate
+  (the only way token_set_ratio can reach 100)
+- character count tables give an upper bound on each fuzzy score, so medications
+  that cannot beat the best score found so far are never scored
+
+Only the remaining shortlist goes through the fuzzywuzzy scorers, in dictionary order,
+so ties are broken exactly like the original loop.
+
+For bulk work (every word of a prescription page, or every label of a batch) the
+score_matrix / MedicationMatcher.score_batch functions score all queries against the
+whole formulary in one vectorized call, using rapidfuzz's cdist when it is installed.
+"""
+import hashlib
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+import ocr_metrics
+
+try:
+    from rapidfuzz import fuzz as rf_fuzz
+    from rapidfuzz import process as rf_process
+    from rapidfuzz import utils as rf_utils
+except ImportError:  # rapidfuzz is optional, score_matrix falls back to fuzzywuzzy
+    rf_process = None
+
+# Words that are never used as correction candidates on their own
+COMMON_WORDS = ['a', 'an', 'the', 'and', 'or', 'in', 'on', 'at', 'to', 'for', 'of', 'with']
+
+# Slack added to score bounds to absorb floating point rounding
+_BOUND_EPSILON = 1e-6
+
+
+# Scorers used by dictionary correction
+CORRECTION_SCORERS = ("token_sort", "partial", "token_set")
+
+# fuzzywuzzy scorers by name; token scorers run full_process on their inputs
+_FUZZYWUZZY_SCORERS = {
+    "token_sort": fuzz.token_sort_ratio,
+    "partial": fuzz.partial_ratio,
+    "token_set": fuzz.token_set_ratio,
+    "wratio": fuzz.WRatio,
+}
+
+
+def _rapidfuzz_scorer(name):
+    """Return the rapidfuzz scorer and processor that mirror a fuzzywuzzy scorer."""
+    return {
+        "token_sort": (rf_fuzz.token_sort_ratio, rf_utils.default_process),
+        "partial": (rf_fuzz.partial_ratio, str.lower),
+        "token_set": (rf_fuzz.token_set_ratio, rf_utils.default_process),
+        "wratio": (rf_fuzz.WRatio, rf_utils.default_process),
+    }[name]
+
+
+def score_matrix(queries, choices, scorers=CORRECTION_SCORERS, workers=1):
+    """
+    Score every query against every choice in one call.
+
+    Args:
+        queries: List of strings (e.g. all words on a page)
+        choices: List of strings (e.g. the formulary)
+        scorers: Scorer names from "token_sort", "partial", "token_set", "wratio";
+            the result is the best score over all of them
+        workers: Threads used by rapidfuzz (-1 uses all cores)
+
+    Returns:
+        float32 array of shape (len(queries), len(choices)) with scores from 0 to 100
+    """
+    scores = np.zeros((len(queries), len(choices)), dtype=np.float32)
+    if not len(queries) or not len(choices):
+        return scores
+
+    for name in scorers:
+        if rf_process is not None:
+            scorer, processor = _rapidfuzz_scorer(name)
+            result = rf_process.cdist(queries, choices, scorer=scorer, processor=processor,
+                                      dtype=np.float32, workers=workers)
+        else:
+            scorer = _FUZZYWUZZY_SCORERS[name]
+            result = np.array([[scorer(query, choice) for choice in choices] for query in queries],
+                              dtype=np.float32)
+        np.maximum(scores, result, out=scores)
+
+    return scores
+
+
+def best_matches(queries, choices, scorers=("wratio",), workers=1):
+    """
+    Find the best choice for every query with one score_matrix call.
+
+    Returns:
+        List of (choice, score) tuples; ties go to the earliest choice like process.extractOne
+    """
+    if not len(choices):
+        return [(None, 0) for _ in queries]
+
+    scores = score_matrix(queries, choices, scorers=scorers, workers=workers)
+    best = scores.argmax(axis=1)
+    return [(choices[j], int(round(float(scores[i, j])))) for i, j in enumerate(best)]
+
+
+def correction_candidates(text):
+    """
+    Build the candidate strings checked against the dictionary for an OCR result.
+
+    Returns the full text and its words (without short and common words) followed by
+    their character 2-grams and 3-grams, or an empty list if nothing is left.
+    """
+    # Check both the whole text and individual words
+    text_parts = text.split()
+    candidates = [text] + text_parts
+
+    # Remove very short and common words (like 'a', 'the', etc.)
+    candidates = [c for c in candidates if len(c) > 2 and c.lower() not in COMMON_WORDS]
+    if not candidates:
+        return []
+
+    # Create character n-grams (2-grams and 3-grams) for more robust matching
+    n_grams = []
+    for candidate in candidates:
+        if len(candidate) >= 3:
+            # Generate 2-grams
+            for i in range(len(candidate) - 1):
+                n_grams.append(candidate[i:i+2])
+            # Generate 3-grams
+            for i in range(len(candidate) - 2):
+                n_grams.append(candidate[i:i+3])
+
+    # Add unique n-grams to candidates
+    candidates.extend(list(set(n_grams)))
+    return candidates
+
+
+def _sorted_tokens(processed):
+    return " ".join(sorted(processed.split()))
+
+
+def _sorted_token_set(processed):
+    return " ".join(sorted(set(processed.split())))
+
+
+def names_fingerprint(medication_list):
+    """SHA-256 of a medication list, identifying the dictionary in cache keys."""
+    return hashlib.sha256("\n".join(medication_list).encode()).hexdigest()
+
+
+def _count_table(strings, alphabet):
+    """Count every alphabet character in each string."""
+    counts = np.zeros((len(strings), len(alphabet)), dtype=np.int16)
+    for row, s in enumerate(strings):
+        for char in s:
+            counts[row, alphabet[char]] += 1
+    return counts
+
+
+def build_match_arrays(medication_list):
+    """
+    Precompute everything MedicationMatcher needs as a dict of numpy arrays.
+
+    Keeping the index in flat arrays (rather than Python dicts and lists) lets
+    formulary.py save it as memory-mappable .npy files that forked workers share.
+    """
+    medications = list(medication_list)
+
+    # Normalised forms used by the individual scorers
+    lowered = [med.lower() for med in medications]
+    processed = [utils.full_process(med, force_ascii=True) for med in lowered]
+    token_sorted = [_sorted_tokens(p) for p in processed]
+    token_sets = [_sorted_token_set(p) for p in processed]
+
+    # Character alphabet shared by all count tables
+    alphabet = sorted(set("".join(lowered + token_sorted)))
+    columns = {char: i for i, char in enumerate(alphabet)}
+
+    # Token inverted index in CSR form: token_ids[token_offsets[k]:token_offsets[k + 1]]
+    # lists the medications containing token_keys[k]
+    token_index = {}
+    for i, p in enumerate(processed):
+        for token in set(p.split()):
+            token_index.setdefault(token, []).append(i)
+    token_keys = sorted(token_index)
+    token_offsets = np.zeros(len(token_keys) + 1, dtype=np.int64)
+    token_offsets[1:] = np.cumsum([len(token_index[token]) for token in token_keys])
+    token_ids = [i for token in token_keys for i in token_index[token]]
+
+    # Prefix index: the lowercased names in sorted order work like a flattened trie,
+    # every prefix maps to one contiguous range found by binary search
+    prefix_order = np.argsort(np.array(lowered, dtype=str), kind="stable")
+
+    def str_array(strings):
+        # Fixed-width unicode arrays need at least one character of width
+        return np.array(strings, dtype=f"U{max([len(x) for x in strings] + [1])}")
+
+    return {
+        "names": str_array(medications),
+        "lowered": str_array(lowered),
+        "token_sorted": str_array(token_sorted),
+        "token_sets": str_array(token_sets),
+        "lengths": np.array([len(med) for med in medications], dtype=np.int32),
+        "alphabet": str_array(alphabet),
+        "lowered_counts": _count_table(lowered, columns),
+        "sorted_counts": _count_table(token_sorted, columns),
+        "set_counts": _count_table(token_sets, columns),
+        "lowered_lengths": np.array([len(x) for x in lowered], dtype=np.int32),
+        "sorted_lengths": np.array([len(x) for x in token_sorted], dtype=np.int32),
+        "set_lengths": np.array([len(x) for x in token_sets], dtype=np.int32),
+        "token_keys": str_array(token_keys),
+        "token_offsets": token_offsets,
+        "token_ids": np.array(token_ids, dtype=np.int64),
+        "prefix_order": prefix_order.astype(np.int64),
+        "prefix_keys": str_array([lowered[i] for i in prefix_order]),
+    }
+
+
+class MedicationMatcher:
+    """A medication dictionary prepared for fast, exact dictionary correction."""
+
+    def __init__(self, medication_list=None, arrays=None, artifact_dir=None):
+        """
+        Args:
+            medication_list: List of known medication names
+            arrays: Precomputed arrays from build_match_arrays (used instead of the list)
+            artifact_dir: Compiled formulary directory the arrays were loaded from;
+                pickled matchers reload from it instead of copying the arrays
+        """
+        if arrays is None:
+            arrays = build_match_arrays(medication_list)
+        self._set_arrays(arrays)
+        self.artifact_dir = artifact_dir
+
+    def _set_arrays(self, arrays):
+        self.arrays = arrays
+        self.medications = arrays["names"].tolist()
+        self.medication_set = set(self.medications)
+        self.lowered = arrays["lowered"].tolist()
+        self.lengths = arrays["lengths"]
+        self.alphabet = {char: i for i, char in enumerate(arrays["alphabet"].tolist())}
+
+        self.lowered_counts = arrays["lowered_counts"]
+        self.sorted_counts = arrays["sorted_counts"]
+        self.set_counts = arrays["set_counts"]
+        self._fingerprint = None
+        self.lowered_lengths = arrays["lowered_lengths"].astype(np.float64)
+        self.sorted_lengths = arrays["sorted_lengths"].astype(np.float64)
+        self.set_lengths = arrays["set_lengths"].astype(np.float64)
+
+    def __getstate__(self):
+        if self.artifact_dir:
+            # Workers map the compiled artifact themselves instead of receiving a copy
+            return {"artifact_dir": self.artifact_dir}
+        return {"arrays": self.arrays, "artifact_dir": None}
+
+    def __setstate__(self, state):
+        arrays = state.get("arrays")
+        if arrays is None:
+            from formulary import load_artifact
+            arrays = load_artifact(state["artifact_dir"])
+        self._set_arrays(arrays)
+        self.artifact_dir = state["artifact_dir"]
+
+    def __len__(self):
+        return len(self.medications)
+
+    @property
+    def fingerprint(self):
+        """SHA-256 of the medication names (see names_fingerprint)."""
+        if self._fingerprint is None:
+            self._fingerprint = names_fingerprint(self.medications)
+        return self._fingerprint
+
+    def token_matches(self, token):
+        """Return the indices of medications whose processed name contains token."""
+        keys = self.arrays["token_keys"]
+        k = int(np.searchsorted(keys, token))
+        if k == len(keys) or keys[k] != token:
+            return None
+        offsets = self.arrays["token_offsets"]
+        return self.arrays["token_ids"][offsets[k]:offsets[k + 1]]
+
+    def prefix_matches(self, prefix):
+        """Return the indices of medications whose lowercased name starts with prefix."""
+        keys = self.arrays["prefix_keys"]
+        lo = np.searchsorted(keys, prefix, side="left")
+        hi = np.searchsorted(keys, prefix + "\U0010ffff", side="left")
+        return self.arrays["prefix_order"][lo:hi]
+
+    def _intersections(self, s, counts):
+        """Size of the character multiset intersection between s and every table row."""
+        vector = {}
+        for char in s:
+            col = self.alphabet.get(char)
+            if col is not None:
+                vector[col] = vector.get(col, 0) + 1
+        if not vector:
+            return np.zeros(len(self.medications))
+
+        cols = np.fromiter(vector.keys(), dtype=np.int64)
+        values = np.fromiter(vector.values(), dtype=np.int16)
+        return np.minimum(counts[:, cols], values).sum(axis=1).astype(np.float64)
+
+    def score_bounds(self, candidate):
+        """
+        Upper bound of the best score any medication can give a candidate.
+
+        Every fuzzy ratio is 2*M / (len1 + len2) where M is at most the shared character
+        count, so the bounds only need the count tables. partial_ratio compares windows of
+        the longer string, which bounds it by 2*I / (n + I) with n the shorter length.
+        """
+        lowered = candidate.lower()
+        processed = utils.full_process(lowered, force_ascii=True)
+        sorted_form = _sorted_tokens(processed)
+        set_form = _sorted_token_set(processed)
+
+        # partial_ratio on the lowercased strings
+        shared = self._intersections(lowered, self.lowered_counts)
+        shorter = np.minimum(len(lowered), self.lowered_lengths)
+        bounds = np.divide(2 * shared, shorter + shared, out=np.zeros_like(shared), where=shared > 0)
+
+        # token_sort_ratio on the sorted processed strings
+        if sorted_form:
+            shared = self._intersections(sorted_form, self.sorted_counts)
+            np.maximum(bounds, 2 * shared / (len(sorted_form) + self.sorted_lengths), out=bounds)
+        else:
+            # Two empty strings count as equal
+            bounds[self.sorted_lengths == 0] = 1.0
+
+        # token_set_ratio: without a shared token it is a plain ratio of the token sets
+        if set_form:
+            shared = self._intersections(set_form, self.set_counts)
+            np.maximum(bounds, 2 * shared / (len(set_form) + self.set_lengths), out=bounds)
+            for token in set(processed.split()):
+                ids = self.token_matches(token)
+                if ids is not None:
+                    bounds[ids] = 1.0
+
+        bounds = bounds * 100 + 0.5 + _BOUND_EPSILON
+
+        # Exact prefix score for names starting with the candidate
+        if len(candidate) >= 3:
+            ids = self.prefix_matches(lowered)
+            if len(ids):
+                bounds[ids] = np.maximum(bounds[ids], len(candidate) / self.lengths[ids] * 100)
+
+        return bounds
+
+    def best_match(self, text):
+        """
+        Find the best dictionary match for an OCR result.
+
+        Returns:
+            Tuple of (medication, score), or (None, 0) if there are no candidates
+        """
+        best_match = None
+        best_score = 0
+        scored = 0
+
+        for candidate in correction_candidates(text):
+            # Skip very short candidates
+            if len(candidate) < 2:
+                continue
+
+            lowered = candidate.lower()
+            bounds = self.score_bounds(candidate)
+
+            for i in np.flatnonzero(bounds > best_score):
+                if bounds[i] <= best_score:
+                    continue
+                scored += 1
+
+                med = self.medications[i]
+                med_lower = self.lowered[i]
+                score = max(
+                    # 1. Token sort ratio (handles word order differences)
+                    fuzz.token_sort_ratio(lowered, med_lower),
+                    # 2. Partial ratio (substring matching)
+                    fuzz.partial_ratio(lowered, med_lower),
+                    # 3. Token set ratio (handles extra words)
+                    fuzz.token_set_ratio(lowered, med_lower)
+                )
+                # 4. Simple starts-with matching for prefix matching
+                if med_lower.startswith(lowered) and len(candidate) >= 3:
+                    score = max(score, (len(candidate) / len(med)) * 100)
+
+                if score > best_score:
+                    best_score = score
+                    best_match = med
+
+            # Nothing can beat a perfect score
+            if best_score >= 100:
+                break
+
+        # Three fuzzy scorers per medication that could still win
+        ocr_metrics.incr("fuzzy_comparisons", 3 * scored)
+        return best_match, best_score
+
+    def score_batch(self, queries, scorers=CORRECTION_SCORERS, workers=1):
+        """
+        Score queries against the whole dictionary in one vectorized call.
+
+        Queries are compared case-insensitively like best_match; see score_matrix.
+        """
+        return score_matrix([query.lower() for query in queries], self.lowered,
+                            scorers=scorers, workers=workers)
+
+    def correct_batch(self, texts, threshold=60, workers=1, chunk_size=1024):
+        """
+        Correct many OCR results with bulk scoring instead of per-candidate loops.
+
+        Uses the same candidates, scorers, prefix rule and tie-breaking as correct(),
+        but scores every candidate of the batch through score_batch. When rapidfuzz is
+        installed its scores can differ from fuzzywuzzy's by a point or two.
+
+        Args:
+            texts: List of OCR results
+            threshold: Minimum similarity threshold (default 60%)
+            workers: Threads used by rapidfuzz (-1 uses all cores)
+            chunk_size: Maximum candidates scored per call, to bound memory use
+
+        Returns:
+            List of corrected texts in the same order as texts
+        """
+        results = list(texts)
+
+        # Collect the candidates of every text that needs correcting
+        groups = []
+        for i, text in enumerate(texts):
+            if not text or len(text) < 2 or text in self.medication_set:
+                continue
+            candidates = [c for c in correction_candidates(text) if len(c) >= 2]
+            if candidates:
+                groups.append((i, candidates))
+
+        # Score the groups in chunks of roughly chunk_size candidates
+        start = 0
+        while start < len(groups):
+            end = start + 1
+            size = len(groups[start][1])
+            while end < len(groups) and size + len(groups[end][1]) <= chunk_size:
+                size += len(groups[end][1])
+                end += 1
+
+            chunk = groups[start:end]
+            flat = [candidate for _, candidates in chunk for candidate in candidates]
+            scores = self.score_batch(flat, workers=workers)
+            ocr_metrics.incr("fuzzy_comparisons", len(CORRECTION_SCORERS) * len(flat) * len(self.medications))
+
+            # Prefix matching for candidates of at least 3 characters
+            for row, candidate in enumerate(flat):
+                if len(candidate) >= 3:
+                    ids = self.prefix_matches(candidate.lower())
+                    if len(ids):
+                        prefix_scores = len(candidate) / self.lengths[ids] * 100
+                        scores[row, ids] = np.maximum(scores[row, ids], prefix_scores)
+
+            row = 0
+            for i, candidates in chunk:
+                block = scores[row:row + len(candidates)]
+                row += len(candidates)
+
+                # argmax over the flattened block gives the first candidate, then the
+                # first medication, reaching the best score - the same order as correct()
+                position = int(block.argmax())
+                best_score = float(block.flat[position])
+                if best_score > 0 and best_score >= threshold:
+                    results[i] = self.medications[position % len(self.medications)]
+
+            start = end
+
+        return results
+
+    def correct(self, text, threshold=60):
+        """
+        Correct OCR text using the dictionary; same contract as medication_dictionary_correction.
+
+        Returns:
+            Corrected text if a good match is found, otherwise original text
+        """
+        return self.correct_with_score(text, threshold)[0]
+
+    def correct_with_score(self, text, threshold=60):
+        """
+        Like correct(), but also return how well the text matched the dictionary.
+
+        Returns:
+            Tuple of (corrected text, score): the score is 100 for an exact dictionary
+            entry, the best fuzzy score otherwise, and 0 for texts too short to match
+        """
+        if not text or len(text) < 2:
+            return text, 0
+
+        # If exact match found, return immediately
+        if text in self.medication_set:
+            return text, 100
+
+        best_match, best_score = self.best_match(text)
+
+        # If we found a good match above threshold, return it
+        if best_match and best_score >= threshold:
+            return best_match, best_score
+
+        # Otherwise return original text
+        return text, best_score
@@ -0,0 +1,291 @@
+"""
+OCR backends used by the OCR scripts.
+
+The default backend calls pytesseract, which starts a new tesseract process for every
+call, reloads the traineddata and writes the image to a temporary PNG. When tesserocr
+is installed, the pooled backend keeps warm Tesseract API handles in memory and passes
+numpy arrays to them directly, with no temporary file.
+
+Select the backend with the OCR_BACKEND environment variable ("auto", "tesserocr" or
+"subprocess") or by passing one explicitly to extract_text_from_image / detect_text.
+
+Either backend can decode in a formulary-constrained mode: its constraints (Tesseract
+options from Formulary.tesseract_config - user words, user patterns and a character
+whitelist) are added to every config it runs. It is off by default; pass constraints to
+create_backend, or set OCR_CONSTRAIN_TO to a medication list so every default backend,
+including those of worker processes, uses that formulary. The list is compiled once, by
+the process that starts the workers (see export_constraints), and the workers inherit
+the resulting config string in OCR_CONSTRAINTS.
+"""
+import os
+import queue
+import shlex
+import threading
+
+import cv2
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr is optional, fall back to the subprocess backend
+    tesserocr = None
+
+
+def parse_tesseract_config(config):
+    """
+    Split a pytesseract config string into its engine mode, page segmentation mode and variables.
+
+    Args:
+        config: A string such as '--oem 1 --psm 7 -c tessedit_char_whitelist=ABC'
+
+    Returns:
+        Tuple of (oem, psm, variables) where oem/psm are ints (None if not given)
+        and variables is a tuple of (name, value) pairs
+    """
+    oem, psm = None, None
+    variables = []
+
+    args = shlex.split(config or '')
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('--oem', '--psm', '-c', '--user-words', '--user-patterns') and i + 1 < len(args):
+            value = args[i + 1]
+            if arg == '--oem':
+                oem = int(value)
+            elif arg == '--psm':
+                psm = int(value)
+            elif arg == '--user-words':
+                variables.append(('user_words_file', value))
+            elif arg == '--user-patterns':
+                variables.append(('user_patterns_file', value))
+            elif '=' in value:
+                variables.append(tuple(value.split('=', 1)))
+            i += 2
+        else:
+            i += 1
+
+    return oem, psm, tuple(sorted(variables))
+
+
+def constrain_config(config, constraints):
+    """Add constraint options (e.g. Formulary.tesseract_config()) to a Tesseract config."""
+    if not constraints:
+        return config
+    return f"{config} {constraints}" if config else constraints
+
+
+class SubprocessBackend:
+    """Runs every call through the tesseract binary via pytesseract."""
+
+    name = "subprocess"
+
+    def __init__(self, constraints=None):
+        self.constraints = constraints
+
+    def image_to_string(self, img, config=''):
+        return pytesseract.image_to_string(img, config=constrain_config(config, self.constraints))
+
+    def image_to_data(self, img, config=''):
+        """Recognise the words in an image, returning a list of (word, confidence 0-100) pairs."""
+        data = pytesseract.image_to_data(img, config=constrain_config(config, self.constraints),
+                                         output_type=pytesseract.Output.DICT)
+        return [(word, float(conf)) for word, conf in zip(data["text"], data["conf"])
+                if word.strip() and float(conf) >= 0]
+
+    def close(self):
+        pass
+
+
+class TesserocrPoolBackend:
+    """
+    Keeps a pool of initialised tesserocr API handles per engine configuration.
+
+    Handles are created on demand up to pool_size per (oem, variables) combination and
+    reused across calls, so the language model is only loaded once per handle. The pool
+    is thread-safe; each process (e.g. each worker of a process pool) builds its own.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, pool_size=None, lang='eng', tessdata_path=None, constraints=None):
+        if tesserocr is None:
+            raise ImportError("tesserocr is not installed; use the subprocess backend instead")
+
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self.lang = lang
+        self.tessdata_path = tessdata_path
+        self.constraints = constraints
+        self._pools = {}
+        self._created = {}
+        self._all_handles = []
+        # Handles that were in use when close() ran; ended when they are released
+        self._retired = set()
+        self._lock = threading.Lock()
+
+    def _new_handle(self, oem, variables):
+        api = tesserocr.PyTessBaseAPI(init=False)
+        kwargs = {"lang": self.lang, "oem": oem, "variables": dict(variables)}
+        if self.tessdata_path:
+            kwargs["path"] = self.tessdata_path
+        api.InitFull(**kwargs)
+        return api
+
+    def _acquire(self, key):
+        with self._lock:
+            pool = self._pools.setdefault(key, queue.LifoQueue())
+            try:
+                return pool.get_nowait()
+            except queue.Empty:
+                pass
+
+            if self._created.get(key, 0) < self.pool_size:
+                self._created[key] = self._created.get(key, 0) + 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            api = self._new_handle(*key)
+            with self._lock:
+                self._all_handles.append(api)
+            return api
+
+        # Every handle for this configuration is busy, wait for one to come back
+        return pool.get()
+
+    def _release(self, key, api):
+        api.Clear()
+        with self._lock:
+            if api in self._retired:
+                self._retired.discard(api)
+                api.End()
+            else:
+                self._pools[key].put(api)
+
+    def image_to_string(self, img, config=''):
+        return self._recognize(img, config, lambda api: api.GetUTF8Text())
+
+    def image_to_data(self, img, config=''):
+        """Recognise the words in an image, returning a list of (word, confidence 0-100) pairs."""
+        def words(api):
+            api.Recognize()
+            return [(word, float(conf)) for word, conf in api.MapWordConfidences() if word.strip()]
+        return self._recognize(img, config, words)
+
+    def _recognize(self, img, config, read):
+        """Set the image on a pooled handle configured for config and return read(handle)."""
+        # The user words and patterns files become init-time variables of the handle
+        oem, psm, variables = parse_tesseract_config(constrain_config(config, self.constraints))
+        key = (tesserocr.OEM.DEFAULT if oem is None else oem, variables)
+
+        img = np.ascontiguousarray(img)
+        if img.ndim == 3:
+            # tesserocr expects RGB, images from OpenCV are BGR
+            img = np.ascontiguousarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        if img.dtype != np.uint8:
+            img = img.astype(np.uint8)
+
+        height, width = img.shape[:2]
+        bytes_per_pixel = 1 if img.ndim == 2 else img.shape[2]
+
+        api = self._acquire(key)
+        try:
+            api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+            api.SetImageBytes(img.tobytes(), width, height, bytes_per_pixel, img.strides[0])
+            return read(api)
+        finally:
+            self._release(key, api)
+
+    def close(self):
+        """End the idle handles; handles still in use are ended when their call finishes."""
+        with self._lock:
+            idle = set()
+            for pool in self._pools.values():
+                while True:
+                    try:
+                        idle.add(pool.get_nowait())
+                    except queue.Empty:
+                        break
+            for api in idle:
+                api.End()
+            self._retired.update(api for api in self._all_handles if api not in idle)
+            self._all_handles = []
+            self._pools = {}
+            self._created = {}
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def export_constraints():
+    """
+    Resolve the constraints named by the environment, for this process and its children.
+
+    OCR_CONSTRAINTS holds a Tesseract config string as returned by
+    Formulary.tesseract_config. When only OCR_CONSTRAIN_TO (a medication list) is set,
+    the list is loaded (compiling it if needed) and the config is exported as
+    OCR_CONSTRAINTS, so worker processes started afterwards reuse it instead of each
+    loading the formulary. Call it before starting a process pool.
+
+    Returns:
+        The constraints, or None if decoding is unconstrained
+    """
+    constraints = os.environ.get("OCR_CONSTRAINTS")
+    if constraints is None and os.environ.get("OCR_CONSTRAIN_TO"):
+        from formulary import load_formulary
+        constraints = load_formulary(os.environ["OCR_CONSTRAIN_TO"]).tesseract_config()
+        os.environ["OCR_CONSTRAINTS"] = constraints
+    return constraints or None
+
+
+def create_backend(name=None, constraints=None, **kwargs):
+    """
+    Create an OCR backend by name.
+
+    Args:
+        name: "tesserocr", "subprocess" or "auto" (tesserocr if installed);
+            defaults to the OCR_BACKEND environment variable, then "auto"
+        constraints: Tesseract options added to every call for formulary-constrained
+            decoding (see Formulary.tesseract_config); defaults to those named by the
+            OCR_CONSTRAINTS or OCR_CONSTRAIN_TO environment variables (see export_constraints)
+        **kwargs: Passed to the backend constructor
+
+    Returns:
+        An object with image_to_string(img, config), image_to_data(img, config) and
+        close() methods
+    """
+    name = (name or os.environ.get("OCR_BACKEND", "auto")).lower()
+
+    if constraints is None:
+        constraints = export_constraints()
+
+    if name == "auto":
+        name = "tesserocr" if tesserocr is not None else "subprocess"
+
+    if name == "tesserocr":
+        return TesserocrPoolBackend(constraints=constraints, **kwargs)
+    if name == "subprocess":
+        return SubprocessBackend(constraints=constraints)
+
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+
+def get_backend():
+    """Return the process-wide default backend, creating it on first use."""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = create_backend()
+        return _default_backend
+
+
+def set_backend(backend):
+    """Replace the process-wide default backend, closing the previous one."""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is not None and _default_backend is not backend:
+            _default_backend.close()
+        _default_backend = backend
@@ -0,0 +1,484 @@
+"""
+Performance benchmark for the OCR medication pipeline.
+
+Runs each stage on a fixed, seeded corpus of synthetic labels and reports latency
+percentiles, throughput, Tesseract call counts and peak memory, so changes that make
+the scanner slower show up before they ship. Each stage's peak_rss_mb is the peak
+resident memory while that stage ran: on Linux the kernel's peak counter is reset after
+every stage; elsewhere it is the process peak so far (meta "peak_rss_per_stage" says
+which).
+
+- generation: rendering labels with label_generator
+- preprocess/<variant>: each preprocessing variant (plus deskew and the full stack)
+- tesseract/<config>: each Tesseract config on the Otsu variant
+- correction/<size>: dictionary correction of OCR-like misspellings against formularies
+  of several sizes (the real list padded with seeded synthetic names)
+- end_to_end/<mode>: extract_text_from_image plus dictionary correction (basic and
+  enhanced), and cascade_extract with the share of images each tier answered
+
+Stages that need Tesseract are skipped (and marked as such) when it isn't installed.
+Results are written as JSON; --compare checks them against a saved baseline and exits
+with status 1 if any stage got slower, or used more memory, than the tolerance allows.
+
+Usage:
+    python ocr_benchmark.py --samples 200 --output baseline.json
+    python ocr_benchmark.py --samples 200 --output current.json --compare baseline.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import ocr_metrics
+from formulary import DEFAULT_SOURCE, load_formulary, load_medication_names
+from label_generator import LABEL_HEIGHT, LABEL_WIDTH, iter_corpus, render_label, sample_label_params
+from medication_matcher import MedicationMatcher
+from ocr_backend import create_backend, get_backend
+from ocr_medication_test import OCR_CONFIGS, cascade_extract, evaluate_similarity, extract_text_from_image
+from ocr_preprocessing import VARIANT_NAMES, build_variant, build_variants, deskew
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Bump when stage names or result fields change
+BENCHMARK_VERSION = 2
+
+FORMULARY_SIZES = [162, 5000, 50000]
+
+STAGES = ["generation", "preprocess", "tesseract", "correction", "end_to_end"]
+
+# Characters Tesseract commonly confuses, used to misspell the correction inputs
+OCR_CONFUSIONS = {"o": "0", "O": "0", "l": "1", "i": "1", "I": "l", "e": "c", "a": "o",
+                  "m": "rn", "n": "m", "S": "5", "B": "8", "g": "q"}
+
+
+def reset_peak_rss():
+    """Restart the peak RSS measurement of this process (Linux); False where that's unsupported."""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size in MB since the last reset_peak_rss (None if unknown).
+
+    Without /proc this is ru_maxrss, the peak of the whole process so far.
+    """
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies, wall_time, **extra):
+    """
+    Summarize per-item latencies.
+
+    Args:
+        latencies: Seconds per item
+        wall_time: Seconds for all items
+        **extra: Additional fields (e.g. tesseract_calls)
+
+    Returns:
+        Dict with count, p50_ms, p95_ms, mean_ms, items_per_sec and peak_rss_mb (the
+        peak since the previous summarize call, which then starts a new measurement)
+    """
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    result = {
+        "count": int(len(latencies)),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+        "mean_ms": round(float(latencies.mean()), 3) if len(latencies) else None,
+        "items_per_sec": round(len(latencies) / wall_time, 2) if wall_time > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra)
+    reset_peak_rss()
+    return result
+
+
+def time_each(fn, items, warmup=1):
+    """
+    Call fn on every item, returning (per-item seconds, total seconds, results).
+
+    The first warmup items are run once beforehand (untimed) so lazy initialization
+    and cold caches don't land in the measurements.
+    """
+    for item in items[:warmup]:
+        fn(item)
+    latencies = []
+    results = []
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        results.append(fn(item))
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - start, results
+
+
+class CountingBackend:
+    """OCR backend wrapper that counts calls and empty results."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.constraints = getattr(backend, "constraints", None)
+        self.calls = 0
+        self.empty = 0
+
+    def image_to_string(self, img, config=''):
+        self.calls += 1
+        text = self.backend.image_to_string(img, config=config)
+        if not text.strip():
+            self.empty += 1
+        return text
+
+    def image_to_data(self, img, config=''):
+        self.calls += 1
+        words = self.backend.image_to_data(img, config=config)
+        if not words:
+            self.empty += 1
+        return words
+
+    def reset(self):
+        self.calls = 0
+        self.empty = 0
+
+    def close(self):
+        pass
+
+
+def tesseract_available(backend):
+    """Whether the backend can run OCR here (Tesseract installed and working)."""
+    try:
+        backend.image_to_string(np.full((32, 32), 255, dtype=np.uint8))
+        return True
+    except Exception:
+        return False
+
+
+def synthetic_formulary(names, size, seed=0):
+    """
+    A formulary of exactly size names: the real names first, then seeded made-up ones.
+
+    Args:
+        names: Real medication names
+        size: Number of names wanted
+        seed: Seed for the synthetic names
+    """
+    if size <= len(names):
+        return list(names[:size])
+
+    rng = np.random.default_rng(seed)
+    syllables = ["ab", "ac", "al", "am", "an", "ar", "ce", "ci", "da", "de", "dol", "en", "fen",
+                 "gli", "im", "ka", "lo", "lin", "max", "mox", "na", "ol", "pan", "pra", "ri",
+                 "ro", "sar", "tan", "ti", "tor", "va", "vir", "xa", "zo", "zol"]
+    strengths = ["", " 5", " 10", " 20", " 40", " 100", " 250", " 500", " 650", " 1000"]
+
+    result = list(names)
+    seen = set(result)
+    while len(result) < size:
+        parts = rng.choice(syllables, rng.integers(2, 5))
+        name = "".join(parts).capitalize() + strengths[rng.integers(len(strengths))]
+        if name not in seen:
+            seen.add(name)
+            result.append(name)
+    return result
+
+
+def misspell(text, rng, edits=2):
+    """Apply a few OCR-like character confusions, deletions and duplications to a text."""
+    chars = list(text)
+    for _ in range(edits):
+        if not chars:
+            break
+        i = int(rng.integers(len(chars)))
+        op = rng.integers(3)
+        if op == 0 and chars[i] in OCR_CONFUSIONS:
+            chars[i] = OCR_CONFUSIONS[chars[i]]
+        elif op == 1 and len(chars) > 3:
+            del chars[i]
+        else:
+            chars.insert(i, chars[i])
+    return "".join(chars)
+
+
+def load_samples(names, samples, seed=0, corpus=None):
+    """
+    The benchmark corpus: (text, image) pairs from a saved corpus or generated from the seed.
+
+    Returns:
+        (samples, generation stage result or None when read from a corpus)
+    """
+    if corpus:
+        return [(text, img) for text, img, _ in iter_corpus(corpus, limit=samples)], None
+
+    rng = np.random.default_rng(seed)
+    texts = [names[i] for i in rng.choice(len(names), samples, replace=samples > len(names))]
+    params = sample_label_params(rng, samples)
+    images = np.empty((samples, LABEL_HEIGHT, LABEL_WIDTH), dtype=np.uint8)
+    latencies, wall_time, _ = time_each(lambda i: render_label(images[i], texts[i], params[i]),
+                                        range(samples))
+    return list(zip(texts, images)), summarize(latencies, wall_time)
+
+
+def bench_preprocessing(images):
+    results = {}
+    latencies, wall_time, deskewed = time_each(deskew, images)
+    results["preprocess/deskew"] = summarize(latencies, wall_time)
+
+    latencies, wall_time, _ = time_each(build_variants, deskewed)
+    results["preprocess/all_variants"] = summarize(latencies, wall_time)
+
+    for name in VARIANT_NAMES:
+        latencies, wall_time, _ = time_each(lambda img: build_variant(img, name), deskewed)
+        results[f"preprocess/{name}"] = summarize(latencies, wall_time)
+    return results
+
+
+def bench_tesseract(images, backend):
+    results = {}
+    otsu_images = [build_variant(deskew(img), "otsu") for img in images]
+    for config in OCR_CONFIGS:
+        backend.reset()
+        latencies, wall_time, _ = time_each(lambda img: backend.image_to_string(img, config=config),
+                                            otsu_images)
+        results[f"tesseract/{config}"] = summarize(latencies, wall_time, tesseract_calls=backend.calls,
+                                                   empty_results=backend.empty)
+    return results
+
+
+def bench_correction(names, texts, sizes=FORMULARY_SIZES, seed=0):
+    results = {}
+    rng = np.random.default_rng(seed)
+    queries = [misspell(text, rng) for text in texts]
+    for size in sizes:
+        formulary = synthetic_formulary(names, size, seed)
+
+        start = time.perf_counter()
+        matcher = MedicationMatcher(formulary)
+        build_time = time.perf_counter() - start
+
+        # Warm up outside the collector so the counters only cover the timed queries
+        matcher.correct(queries[0])
+        with ocr_metrics.collect() as metrics:
+            latencies, wall_time, corrected = time_each(matcher.correct, queries, warmup=0)
+        accuracy = sum(c == t for c, t in zip(corrected, texts)) / len(texts)
+        comparisons = metrics.counter_totals().get("fuzzy_comparisons", 0)
+        results[f"correction/{size}"] = summarize(latencies, wall_time,
+                                                  index_build_ms=round(build_time * 1000, 1),
+                                                  accuracy=round(accuracy, 4),
+                                                  fuzzy_comparisons_per_query=round(comparisons / len(queries), 1))
+    return results
+
+
+def bench_end_to_end(samples, names, backend):
+    results = {}
+    matcher = MedicationMatcher(names)
+    modes = {
+        "basic": lambda img: matcher.correct(extract_text_from_image(img, enhanced=False, backend=backend)),
+        "enhanced": lambda img: matcher.correct(extract_text_from_image(img, enhanced=True, backend=backend)),
+        "cascade": lambda img: cascade_extract(img, matcher, backend=backend)["text"],
+    }
+    for mode, extract in modes.items():
+        def run(sample):
+            return extract(sample[1])
+
+        # Stage timers and counters from inside extract_text_from_image and the matcher,
+        # collected after the warm-up image so they only cover the timed images
+        run(samples[0])
+        backend.reset()
+        with ocr_metrics.collect() as metrics:
+            latencies, wall_time, extracted = time_each(run, samples, warmup=0)
+        accuracy = sum(evaluate_similarity(text, out) for (text, _), out in zip(samples, extracted)) / len(samples)
+        results[f"end_to_end/{mode}"] = summarize(latencies, wall_time,
+                                                  tesseract_calls=backend.calls,
+                                                  tesseract_calls_per_image=round(backend.calls / len(samples), 2),
+                                                  empty_results=backend.empty,
+                                                  accuracy=round(accuracy, 2),
+                                                  metrics=metrics.snapshot())
+        if mode == "cascade":
+            # Share of the images answered by each tier
+            results["end_to_end/cascade"]["tiers"] = {
+                counter["labels"]["tier"]: counter["value"]
+                for counter in results["end_to_end/cascade"]["metrics"]["counters"]
+                if counter["name"] == "cascade_tier"
+            }
+    return results
+
+
+def run_benchmark(samples=100, seed=0, stages=STAGES, corpus=None, formulary=DEFAULT_SOURCE,
+                  formulary_sizes=FORMULARY_SIZES, backend=None):
+    """
+    Run the benchmark stages.
+
+    Args:
+        samples: Number of labels
+        seed: Seed for the labels and synthetic formularies
+        stages: Stage groups to run (see STAGES)
+        corpus: Directory written by label_generator.write_corpus to use instead of
+            generating labels
+        formulary: Medication list
+        formulary_sizes: Formulary sizes for the correction stage
+        backend: OCR backend (default: the process-wide backend)
+
+    Returns:
+        Dict with "meta", "stages" (name -> summary) and "skipped" (name -> reason)
+    """
+    names = load_medication_names(formulary)
+    backend = CountingBackend(backend or get_backend())
+    peak_rss_per_stage = reset_peak_rss()
+
+    report = {
+        "version": BENCHMARK_VERSION,
+        "meta": {
+            "samples": samples,
+            "seed": seed,
+            "corpus": corpus,
+            "backend": backend.name,
+            "constrained": bool(backend.constraints),
+            "peak_rss_per_stage": peak_rss_per_stage,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": {},
+        "skipped": {},
+    }
+
+    corpus_samples, generation = load_samples(names, samples, seed, corpus)
+    images = [img for _, img in corpus_samples]
+    if "generation" in stages and generation is not None:
+        report["stages"]["generation"] = generation
+
+    if "preprocess" in stages:
+        report["stages"].update(bench_preprocessing(images))
+
+    if "correction" in stages:
+        report["stages"].update(bench_correction(names, [text for text, _ in corpus_samples],
+                                                 formulary_sizes, seed))
+
+    ocr_stages = [stage for stage in ("tesseract", "end_to_end") if stage in stages]
+    if ocr_stages and not tesseract_available(backend.backend):
+        for stage in ocr_stages:
+            report["skipped"][stage] = "Tesseract is not available"
+        ocr_stages = []
+    if "tesseract" in ocr_stages:
+        report["stages"].update(bench_tesseract(images, backend))
+    if "end_to_end" in ocr_stages:
+        report["stages"].update(bench_end_to_end(corpus_samples, names, backend))
+
+    return report
+
+
+def compare_reports(current, baseline, tolerance=0.10, min_delta_ms=0.05):
+    """
+    Find the stages that got slower than a baseline.
+
+    A stage regresses when its p50 or p95 latency grew, or its throughput dropped, by
+    more than the tolerance (a fraction). Latency changes below min_delta_ms are
+    treated as timer noise. When both reports measured peak memory per stage (meta
+    "peak_rss_per_stage"), a peak_rss_mb growth beyond the tolerance regresses too.
+
+    Returns:
+        List of regression dicts (stage, metric, baseline, current, change)
+    """
+    # (metric, higher is worse, smallest change that counts)
+    metrics = [("p50_ms", True, min_delta_ms), ("p95_ms", True, min_delta_ms),
+               ("items_per_sec", False, 0)]
+    if (current.get("meta", {}).get("peak_rss_per_stage")
+            and baseline.get("meta", {}).get("peak_rss_per_stage")):
+        metrics.append(("peak_rss_mb", True, 0))
+
+    regressions = []
+    for stage, result in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        for metric, higher_is_worse, min_delta in metrics:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if higher_is_worse and new - old < min_delta:
+                continue
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append({"stage": stage, "metric": metric, "baseline": old,
+                                    "current": new, "change": round(change, 4)})
+    return regressions
+
+
+def print_report(report):
+    print(f"{'stage':<34}{'p50 ms':>10}{'p95 ms':>10}{'items/s':>10}{'RSS MB':>9}")
+    for stage, result in report["stages"].items():
+        print(f"{stage:<34}{str(result['p50_ms']):>10}{str(result['p95_ms']):>10}"
+              f"{str(result['items_per_sec']):>10}{str(result['peak_rss_mb']):>9}")
+    for stage, reason in report["skipped"].items():
+        print(f"{stage:<34}skipped: {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR medication pipeline")
+    parser.add_argument("--samples", type=int, default=100, help="Number of labels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--corpus", help="Corpus directory from label_generator.py to use")
+    parser.add_argument("--formulary", default=DEFAULT_SOURCE, help="Medication list")
+    parser.add_argument("--formulary-sizes", type=int, nargs="+", default=FORMULARY_SIZES)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed slowdown (or memory growth) as a fraction before a stage "
+                             "counts as a regression")
+    parser.add_argument("--constrained", action="store_true",
+                        help="Decode against the formulary's words and characters only")
+    args = parser.parse_args()
+
+    backend = None
+    if args.constrained:
+        backend = create_backend(constraints=load_formulary(args.formulary).tesseract_config())
+
+    report = run_benchmark(args.samples, args.seed, args.stages, args.corpus, args.formulary,
+                           args.formulary_sizes, backend=backend)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("samples") != report["meta"]["samples"]:
+            print("Warning: the baseline was run with a different number of samples")
+        if baseline.get("meta", {}).get("constrained", False) != report["meta"]["constrained"]:
+            print("Warning: the baseline was run with a different decoding mode (--constrained)")
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for r in regressions:
+                print(f"- {r['stage']} {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
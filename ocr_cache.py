@@ -0,0 +1,196 @@
+"""
+Content-addressed cache for OCR and dictionary correction results.
+
+Keys are built from a hash of the input image (or text) plus the pipeline parameters,
+so rescanning the same label returns the stored result instead of running Tesseract
+again. Entries live in an in-memory LRU and, optionally, in an on-disk tier that is
+kept under a size limit by evicting the least recently used files.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def exact_image_hash(img):
+    """SHA-256 of the image's shape, dtype and pixel data."""
+    img = np.ascontiguousarray(img)
+    digest = hashlib.sha256()
+    digest.update(f"{img.shape}|{img.dtype}".encode())
+    digest.update(img.data)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """An in-memory LRU with an optional size-bounded disk tier."""
+
+    def __init__(self, max_entries=1024, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Number of results kept in memory
+            disk_dir: Directory for the on-disk tier (None keeps the cache in memory only)
+            disk_max_bytes: Size limit of the on-disk tier
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes get their own lock and in-memory tier; the disk tier is shared
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_memory"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def image_key(self, img, **params):
+        """
+        Build a cache key from an image and the parameters used to process it.
+
+        Images are keyed by their exact pixels: labels that only differ in a few
+        characters (Pan 20 / Pan 40) look alike to any coarse image hash.
+        """
+        return self._key("image", exact_image_hash(img), params)
+
+    def text_key(self, text, **params):
+        """Build a cache key from a text and the parameters used to process it."""
+        return self._key("text", hashlib.sha256(text.encode()).hexdigest(), params)
+
+    def _key(self, kind, content_hash, params):
+        param_json = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{kind}|{content_hash}|{param_json}".encode()).hexdigest()
+
+    def get(self, key, default=None):
+        """Return a cached value, checking memory first and then the disk tier."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            self._memory_put(key, value)
+            return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store a JSON-serialisable value in memory and on disk."""
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+            # Refresh the modification time so eviction treats it as recently used
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = json.dumps(value)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.disk_max_bytes
+
+        if over_limit:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        """Yield (path, size, mtime) for every file in the disk tier."""
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the tier is under 90% of its limit."""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        """Empty the in-memory tier (the disk tier is left alone)."""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        """Return hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._memory),
+            }
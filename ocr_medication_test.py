@@ -3,29 +3,60 @@ import numpy as np
 import pytesseract
 import os
 import random
+import logging
+import threading
+import time
 from fuzzywuzzy import fuzz
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 from pathlib import Path
+from collections import Counter, OrderedDict
+from ocr_backend import export_constraints, get_backend
+from medication_matcher import MedicationMatcher, correction_candidates, names_fingerprint
+from formulary import load_formulary
+from ocr_preprocessing import (VARIANT_NAMES, build_variant, build_variants, crop_regions, deskew,
+                               find_text_regions, normalize_resolution)
+from ocr_parallel import ocr_in_order, ocr_serial, resolve_workers
+from label_generator import generate_labels, uniform_noise
+from concurrent.futures import ProcessPoolExecutor
+import ocr_metrics
+
+logger = logging.getLogger(__name__)
 
 # Path to tesseract executable
 # Uncomment and set this if pytesseract can't find your Tesseract installation
 # pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'  # Linux
-pytesseract.pytesseract.tesseract_cmd = r'/opt/homebrew/bin/tesseract'  # macOS
+# Only where it exists, so headless Linux runs (e.g. the OCR server) use the one on PATH
+if os.path.exists('/opt/homebrew/bin/tesseract'):
+    pytesseract.pytesseract.tesseract_cmd = r'/opt/homebrew/bin/tesseract'  # macOS
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Windows
 
-def load_medication_names(filename):
-    """Load medication names from a file."""
-    with open(filename, 'r') as f:
-        medications = [line.strip() for line in f if line.strip()]
-    return medications
+# Tesseract configurations tried for every preprocessing variant
+OCR_CONFIGS = [
+    '--oem 3 --psm 6',  # Assume a single uniform block of text
+    '--oem 3 --psm 7',  # Treat the image as a single line of text
+    '--oem 3 --psm 8',  # Treat the image as a single word
+    '--oem 1 --psm 7',  # LSTM only, single line
+    '--oem 1 --psm 8'   # LSTM only, single word
+]
+
+# Single variant and config read by the fast tier of cascade_extract
+CASCADE_VARIANT = "otsu"
+CASCADE_CONFIG = OCR_CONFIGS[0]
 
 def create_image_with_text(text, font_scale=1.5, thickness=2, noise_level=0.05, blur_factor=0.5, 
-                         font=None, rotation=0, background_type="plain"):
-    """Create an image with the given text with various styles."""
+                         font=None, rotation=0, background_type="plain", rng=None):
+    """
+    Create an image with the given text with various styles.
+
+    Random choices (font, noise) come from rng, a numpy Generator (default: a fresh one).
+    For many images, label_generator.generate_labels renders a whole batch faster.
+    """
+    rng = np.random.default_rng(rng)
+
     # Create a larger image for better resolution
     height, width = 300, 1000
-    img = np.ones((height, width), dtype=np.uint8) * 255
+    img = np.full((height, width), 255, dtype=np.uint8)
     
     # Select font
     if font is None:
@@ -36,18 +67,15 @@ def create_image_with_text(text, font_scale=1.5, thickness=2, noise_level=0.05,
             cv2.FONT_HERSHEY_DUPLEX,
             cv2.FONT_HERSHEY_COMPLEX
         ]
-        font = random.choice(fonts)
+        font = fonts[rng.integers(len(fonts))]
     
     # Create background texture
     if background_type == "noise":
         # Add background noise (less noise for better OCR)
-        noise = np.random.rand(*img.shape) * 30
-        img = cv2.add(img, noise.astype(np.uint8))
+        img = cv2.add(img, uniform_noise(rng, img.shape, 30))
     elif background_type == "gradient":
-        # Create a subtle gradient background
-        for i in range(img.shape[1]):
-            value = 255 - int(20 * i / img.shape[1])
-            img[:, i] = value
+        # Create a subtle gradient background (one row broadcast over all rows)
+        img[:] = (255 - 20 * np.arange(img.shape[1]) // img.shape[1]).astype(np.uint8)
     
     # Make sure text is thick enough to be readable
     if thickness < 2:
@@ -82,8 +110,9 @@ def create_image_with_text(text, font_scale=1.5, thickness=2, noise_level=0.05,
     # Add random noise (reduce noise level for better OCR)
     if noise_level > 0:
         noise_level = min(noise_level, 0.05)  # Cap noise level
-        noise = np.random.rand(*img.shape) * 255 * noise_level
-        img = cv2.add(img, noise.astype(np.uint8))
+        noise_max = int(255 * noise_level)
+        if noise_max > 0:
+            img = cv2.add(img, uniform_noise(rng, img.shape, noise_max))
     
     # Add blur (reduce blur for better OCR)
     if blur_factor > 0:
@@ -96,152 +125,295 @@ def create_image_with_text(text, font_scale=1.5, thickness=2, noise_level=0.05,
     
     return img
 
-def extract_text_from_image(img, enhanced=True):
-    """Extract text from an image using pytesseract with enhanced preprocessing."""
-    if enhanced:
-        # Make a copy of the image for processing
-        processed_img = img.copy()
+def clean_ocr_text(text):
+    """Clean raw OCR output, returning an empty string if nothing useful is left."""
+    # Basic cleaning: remove non-alphanumeric except spaces
+    cleaned = ''.join(c if c.isalnum() or c.isspace() else ' ' for c in text)
+    # Remove extra whitespace
+    cleaned = ' '.join(cleaned.split())
+    # Only keep results with at least 2 chars
+    return cleaned if len(cleaned) > 1 else ""
+
+def select_best_result(cleaned_results):
+    """Pick the final OCR result from the cleaned results of all variants."""
+    if not cleaned_results:
+        # If no text was found with any method
+        return ""
+    
+    # Count occurrences of each result
+    result_counts = Counter(cleaned_results)
+    
+    # If there's a clear winner by frequency (appears more than once), use it
+    most_common_results = result_counts.most_common(2)
+    if len(most_common_results) > 1 and most_common_results[0][1] > most_common_results[1][1]:
+        return most_common_results[0][0]
+    
+    # Otherwise, use the longest result that's not excessively long
+    # (Sometimes OCR produces very long garbage strings)
+    reasonable_results = [r for r in cleaned_results if len(r) <= 30]
+    if reasonable_results:
+        return max(reasonable_results, key=len)
+    
+    # If all results are too long, use the shortest one
+    return min(cleaned_results, key=len)
+
+def extract_text_from_image(img, enhanced=True, scheduler=None, backend=None, workers=1, cache=None,
+                            crop=False, normalize=False, deskewed=False):
+    """
+    Extract text from an image using pytesseract with enhanced preprocessing.
+    
+    Args:
+        img: Grayscale image as a numpy array
+        enhanced: Run the full variant x config sweep instead of a single threshold
+        scheduler: Optional VariantScheduler that orders the sweep by past wins and
+            stops it once the results agree (default runs every combination)
+        backend: OCR backend from ocr_backend (defaults to the process-wide backend)
+        workers: Number of processes to spread the sweep over (1 runs serially, None
+            uses all cores); worker processes use their own default backend
+        cache: Optional OCRCache; repeat scans of the same image return the stored text
+        crop: Crop the (deskewed) image to the region containing text before building
+            the variants, so Tesseract only sees the text band
+        normalize: Rescale the image so its text has the size Tesseract reads best
+            before any other preprocessing (useful for camera photos and tiny crops)
+        deskewed: The image is already deskewed (and cropped, if wanted), e.g. by
+            cascade_extract, so the enhanced sweep builds its variants from it directly
         
+    Returns:
+        The extracted text, or an empty string if nothing was recognised
+
+    Raises:
+        pytesseract.TesseractNotFoundError: The tesseract binary could not be run
+    """
+    if backend is None:
+        backend = get_backend()
+    
+    if cache is not None:
+        key = cache.image_key(
+            img, stage="ocr", enhanced=enhanced, backend=backend.name, crop=crop,
+            normalize=normalize, constraints=getattr(backend, "constraints", None),
+            early_exit=None if scheduler is None else [scheduler.consensus, scheduler.confidence],
+            **({"deskewed": True} if deskewed else {})
+        )
+        text = cache.get(key)
+        ocr_metrics.incr("cache_hits" if text is not None else "cache_misses", stage="ocr")
+        if text is None:
+            text = extract_text_from_image(img, enhanced=enhanced, scheduler=scheduler,
+                                           backend=backend, workers=workers, crop=crop,
+                                           normalize=normalize, deskewed=deskewed)
+            cache.put(key, text)
+        return text
+    
+    if normalize:
+        with ocr_metrics.timer("normalize"):
+            img, _ = normalize_resolution(img)
+    
+    if enhanced and deskewed:
+        processed_img = img
+    elif enhanced:
         # ENHANCEMENT 1: Deskewing to handle rotation - using a safer approach
-        try:
-            # Only attempt deskewing if there's enough black pixels
-            nonzero = cv2.countNonZero(cv2.threshold(processed_img, 200, 255, cv2.THRESH_BINARY_INV)[1])
-            if nonzero > 100:  # Only attempt if we have enough foreground pixels
-                # Find all contours in the image
-                contours, _ = cv2.findContours(
-                    cv2.threshold(processed_img, 200, 255, cv2.THRESH_BINARY_INV)[1],
-                    cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE
-                )
-                
-                # Find the largest contour by area
-                if contours:
-                    largest_contour = max(contours, key=cv2.contourArea)
-                    if cv2.contourArea(largest_contour) > 100:  # Only use substantial contours
-                        # Get the minimum area rectangle
-                        rect = cv2.minAreaRect(largest_contour)
-                        angle = rect[-1]
-                        
-                        # Adjust angle for correct rotation
-                        if angle < -45:
-                            angle = -(90 + angle)
-                        else:
-                            angle = -angle
-                        
-                        # Only rotate if angle is significant but not extreme
-                        if 0.5 < abs(angle) < 20:
-                            (h, w) = processed_img.shape[:2]
-                            center = (w // 2, h // 2)
-                            M = cv2.getRotationMatrix2D(center, angle, 1.0)
-                            processed_img = cv2.warpAffine(processed_img, M, (w, h), 
-                                                        flags=cv2.INTER_CUBIC, 
-                                                        borderMode=cv2.BORDER_REPLICATE)
-        except Exception as e:
-            # If deskewing fails, just continue with original image
-            print(f"Deskewing failed: {e}")
-            pass
-        
-        # ENHANCEMENT 2: Apply multiple preprocessing techniques
-        results = []
-        
-        # Create preprocessing variants
-        preprocessing_variants = []
-        
-        # Method 1: Adaptive thresholding with different block sizes
-        for block_size in [7, 11, 15]:
-            binary_adaptive = cv2.adaptiveThreshold(
-                processed_img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                cv2.THRESH_BINARY, block_size, 2
-            )
-            # Clean noise with morphological operations
-            kernel = np.ones((1, 1), np.uint8)
-            binary_adaptive = cv2.morphologyEx(binary_adaptive, cv2.MORPH_OPEN, kernel)
-            preprocessing_variants.append(binary_adaptive)
-        
-        # Method 2: Otsu's thresholding
-        _, binary_otsu = cv2.threshold(processed_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        preprocessing_variants.append(binary_otsu)
-        
-        # Method 3: CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced_contrast = clahe.apply(processed_img)
-        _, binary_enhanced = cv2.threshold(enhanced_contrast, 150, 255, cv2.THRESH_BINARY)
-        preprocessing_variants.append(binary_enhanced)
-        
-        # Method 4: Regular thresholding with different values
-        for thresh_val in [120, 150, 180]:
-            _, binary_simple = cv2.threshold(processed_img, thresh_val, 255, cv2.THRESH_BINARY)
-            preprocessing_variants.append(binary_simple)
+        with ocr_metrics.timer("deskew"):
+            processed_img, contours = deskew(img, return_contours=True)
+    
+    if enhanced:
+        # Crop to the text band, reusing the contours found while deskewing
+        if crop and not deskewed:
+            with ocr_metrics.timer("crop"):
+                boxes = find_text_regions(processed_img, contours=contours)
+                if boxes:
+                    processed_img = crop_regions(processed_img, boxes)[0]
         
-        # Method 5: Original image with no processing
-        preprocessing_variants.append(processed_img)
+        # ENHANCEMENT 2: Apply multiple preprocessing techniques, written into one stacked array
+        with ocr_metrics.timer("build_variants"):
+            variant_stack = build_variants(processed_img)
         
         # ENHANCEMENT 3: Try different Tesseract configurations
-        configs = [
-            '--oem 3 --psm 6',  # Assume a single uniform block of text
-            '--oem 3 --psm 7',  # Treat the image as a single line of text
-            '--oem 3 --psm 8',  # Treat the image as a single word
-            '--oem 1 --psm 7',  # LSTM only, single line
-            '--oem 1 --psm 8'   # LSTM only, single word
-        ]
+        variant_images = dict(zip(VARIANT_NAMES, variant_stack))
+        pairs = [(name, config) for name in VARIANT_NAMES for config in OCR_CONFIGS]
         
-        # Try all combinations of preprocessing and configs
-        for img_variant in preprocessing_variants:
-            for config in configs:
-                try:
-                    text = pytesseract.image_to_string(img_variant, config=config).strip()
-                    if text:
-                        results.append(text)
-                except Exception:
-                    # If OCR fails for a specific variant, just continue
-                    continue
+        # Run the historically best combinations first so we can stop early
+        if scheduler is not None:
+            pairs = scheduler.order(pairs)
         
-        # If we have no results, try basic OCR on original image
-        if not results:
-            try:
-                text = pytesseract.image_to_string(img).strip()
-                if text:
-                    results.append(text)
-            except Exception:
-                pass
+        # Run the OCR, in a process pool when more than one worker is requested
+        tasks = ((variant_images[variant_name], config) for variant_name, config in pairs)
+        if workers == 1:
+            ocr_outputs = ocr_serial(tasks, backend)
+        else:
+            ocr_outputs = ocr_in_order(tasks, workers)
         
-        # ENHANCEMENT 4: Post-processing to clean up text
+        # ENHANCEMENT 4: Post-processing to clean up text as results come in
+        found_text = False
         cleaned_results = []
-        for text in results:
-            # Basic cleaning: remove non-alphanumeric except spaces
-            cleaned = ''.join(c if c.isalnum() or c.isspace() else ' ' for c in text)
-            # Remove extra whitespace
-            cleaned = ' '.join(cleaned.split())
-            if cleaned and len(cleaned) > 1:  # Only keep results with at least 2 chars
+        outputs = []
+        # Per-pair timings are the time spent waiting for each result (the OCR call
+        # itself when running serially); only measured when metrics are being collected
+        metrics = ocr_metrics.current_collector()
+        sweep_start = pair_start = time.perf_counter() if metrics is not None else None
+        for pair, text in zip(pairs, ocr_outputs):
+            if metrics is not None:
+                now = time.perf_counter()
+                metrics.observe("ocr_pair", now - pair_start, variant=pair[0], config=pair[1])
+                metrics.incr("tesseract_calls")
+                pair_start = now
+            
+            if isinstance(text, pytesseract.TesseractNotFoundError):
+                # No Tesseract at all: fail the scan rather than return an empty result
+                ocr_outputs.close()
+                raise text
+            if isinstance(text, Exception):
+                # If OCR fails for a specific variant, log it and continue
+                logger.warning(f"OCR failed for {pair[0]} with '{pair[1]}': {str(text)}")
+                ocr_metrics.incr("ocr_errors", variant=pair[0], config=pair[1])
+                continue
+            
+            text = text.strip()
+            if not text:
+                ocr_metrics.incr("empty_results", variant=pair[0], config=pair[1])
+            found_text = found_text or bool(text)
+            cleaned = clean_ocr_text(text)
+            if cleaned:
                 cleaned_results.append(cleaned)
+                outputs.append((pair, cleaned))
+                
+                if scheduler is not None and scheduler.should_stop(cleaned_results):
+                    break
+        # Cancel any OCR still queued after an early exit
+        ocr_outputs.close()
+        if metrics is not None:
+            metrics.observe("ocr_sweep", time.perf_counter() - sweep_start)
+        
+        # If we have no results, try basic OCR on original image
+        if not found_text:
+            ocr_metrics.incr("fallback_ocr")
+            ocr_metrics.incr("tesseract_calls")
+            try:
+                with ocr_metrics.timer("ocr_fallback"):
+                    text = backend.image_to_string(img).strip()
+                cleaned = clean_ocr_text(text)
+                if cleaned:
+                    cleaned_results.append(cleaned)
+            except pytesseract.TesseractNotFoundError:
+                raise
+            except Exception as e:
+                logger.warning(f"Fallback OCR failed: {str(e)}")
+                ocr_metrics.incr("ocr_errors", variant="fallback", config="")
         
         # If we have results, select the best one
-        if cleaned_results:
-            # Count occurrences of each result
-            from collections import Counter
-            result_counts = Counter(cleaned_results)
-            
-            # If there's a clear winner by frequency (appears more than once), use it
-            most_common_results = result_counts.most_common(2)
-            if len(most_common_results) > 1 and most_common_results[0][1] > most_common_results[1][1]:
-                return most_common_results[0][0]
-            
-            # Otherwise, use the longest result that's not excessively long
-            # (Sometimes OCR produces very long garbage strings)
-            reasonable_results = [r for r in cleaned_results if len(r) <= 30]
-            if reasonable_results:
-                return max(reasonable_results, key=len)
-            
-            # If all results are too long, use the shortest one
-            return min(cleaned_results, key=len)
-            
-        # If no text was found with any method
-        return ""
+        best_result = select_best_result(cleaned_results)
+        if scheduler is not None:
+            scheduler.record(outputs, best_result)
+        return best_result
     else:
+        if crop:
+            boxes = find_text_regions(img)
+            if boxes:
+                img = crop_regions(img, boxes)[0]
+        
         # Simple binary threshold (original method)
         _, binary_img = cv2.threshold(img, 150, 255, cv2.THRESH_BINARY)
-        text = pytesseract.image_to_string(binary_img).strip()
+        ocr_metrics.incr("tesseract_calls")
+        with ocr_metrics.timer("ocr_basic"):
+            text = backend.image_to_string(binary_img).strip()
+        if not text:
+            ocr_metrics.incr("empty_results", variant="basic", config="")
         return text
 
+# Matchers built by cascade_extract for plain name lists, by names_fingerprint
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+def _cached_matcher(medication_list, max_matchers=4):
+    """Return medication_list if it is a MedicationMatcher, else a matcher indexed once per list."""
+    if isinstance(medication_list, MedicationMatcher):
+        return medication_list
+    fingerprint = names_fingerprint(medication_list)
+    with _matchers_lock:
+        matcher = _matchers.get(fingerprint)
+        if matcher is not None:
+            _matchers.move_to_end(fingerprint)
+            return matcher
+    matcher = MedicationMatcher(medication_list)
+    with _matchers_lock:
+        _matchers[fingerprint] = matcher
+        while len(_matchers) > max_matchers:
+            _matchers.popitem(last=False)
+    return matcher
+
+def cascade_extract(img, medication_list, min_confidence=80, min_match_score=90, threshold=60,
+                    scheduler=None, backend=None, workers=1, cache=None, crop=False, normalize=False):
+    """
+    Extract and correct a medication name, only running the full variant sweep when needed.
+    
+    The fast tier reads one Otsu-binarised copy of the deskewed image with a single
+    Tesseract call and keeps the result when every word was recognised with at least
+    min_confidence and the text matches the dictionary with at least min_match_score
+    (an exact entry scores 100). Anything less escalates to the enhanced sweep of
+    extract_text_from_image, whose result is then corrected as usual.
+    
+    Args:
+        img: Grayscale image as a numpy array
+        medication_list: List of known medication names, or a prebuilt MedicationMatcher
+            (lists are indexed on first use and the matcher is reused for the same list)
+        min_confidence: Lowest Tesseract word confidence (0-100) the fast tier accepts
+        min_match_score: Lowest dictionary match score the fast tier accepts
+        threshold: Minimum similarity threshold for the dictionary correction
+        scheduler, backend, workers, cache, crop, normalize: As for extract_text_from_image
+        
+    Returns:
+        Dict with the corrected "text", the uncorrected "raw_text", the "tier" that
+        answered ("fast" or "sweep"), the fast tier's word "confidence" and the
+        "match_score" of the returned text
+    """
+    if backend is None:
+        backend = get_backend()
+    matcher = _cached_matcher(medication_list)
+    
+    if normalize:
+        with ocr_metrics.timer("normalize"):
+            img, _ = normalize_resolution(img)
+    
+    with ocr_metrics.timer("cascade_fast"):
+        processed_img, contours = deskew(img, return_contours=True)
+        if crop:
+            boxes = find_text_regions(processed_img, contours=contours)
+            if boxes:
+                processed_img = crop_regions(processed_img, boxes)[0]
+        variant = build_variant(processed_img, CASCADE_VARIANT)
+        
+        ocr_metrics.incr("tesseract_calls")
+        try:
+            words = backend.image_to_data(variant, CASCADE_CONFIG)
+        except pytesseract.TesseractNotFoundError:
+            raise
+        except Exception as e:
+            logger.warning(f"Fast OCR failed: {str(e)}")
+            ocr_metrics.incr("ocr_errors", variant=CASCADE_VARIANT, config=CASCADE_CONFIG)
+            words = []
+        
+        raw_text = clean_ocr_text(" ".join(word for word, _ in words))
+        confidence = min((conf for _, conf in words), default=0.0)
+        text, match_score = matcher.correct_with_score(raw_text, threshold)
+    
+    if raw_text and confidence >= min_confidence and match_score >= min_match_score:
+        tier = "fast"
+    else:
+        tier = "sweep"
+        # Reuse the deskewed (and cropped) image of the fast tier
+        raw_text = extract_text_from_image(processed_img, enhanced=True, scheduler=scheduler,
+                                           backend=backend, workers=workers, cache=cache,
+                                           deskewed=True)
+        with ocr_metrics.timer("correction"):
+            text, match_score = matcher.correct_with_score(raw_text, threshold)
+    
+    ocr_metrics.incr("cascade_tier", tier=tier)
+    return {
+        "text": text,
+        "raw_text": raw_text,
+        "tier": tier,
+        "confidence": confidence,
+        "match_score": match_score
+    }
+
 def evaluate_similarity(original, extracted):
     """Evaluate the similarity between original and extracted text."""
     if not extracted:
@@ -251,8 +423,76 @@ def evaluate_similarity(original, extracted):
     similarity = fuzz.token_sort_ratio(original.lower(), extracted.lower())
     return similarity
 
-def run_ocr_test(medication_names, num_samples=10, output_dir="ocr_test_results", save_images=True, use_enhanced=True, use_dictionary_correction=True):
-    """Run OCR test on a sample of medication names with various styles."""
+# Shared state for run_ocr_test's sample evaluation (set once per worker process)
+_test_context = {}
+
+def _init_test_context(matcher, use_enhanced, use_dictionary_correction, scheduler, cache, crop):
+    """Set up the state used by _evaluate_sample in this process."""
+    _test_context.update(
+        matcher=matcher,
+        use_enhanced=use_enhanced,
+        use_dictionary_correction=use_dictionary_correction,
+        scheduler=scheduler,
+        cache=cache,
+        crop=crop
+    )
+
+def _evaluate_sample(sample):
+    """Run OCR and dictionary correction on one generated test image."""
+    med_name, img, params = sample
+    
+    tier = None
+    if _test_context["use_enhanced"] == "cascade":
+        # Cheap single read first, the full sweep only when it isn't confident
+        cascade = cascade_extract(img, _test_context["matcher"], scheduler=_test_context["scheduler"],
+                                  cache=_test_context["cache"], crop=_test_context["crop"])
+        tier = cascade["tier"]
+        raw_ocr_result = cascade["raw_text"]
+        extracted_text = cascade["text"] if _test_context["use_dictionary_correction"] else raw_ocr_result
+    else:
+        # Extract text using OCR
+        extracted_text = extract_text_from_image(img, enhanced=_test_context["use_enhanced"],
+                                                 scheduler=_test_context["scheduler"],
+                                                 cache=_test_context["cache"],
+                                                 crop=_test_context["crop"])
+        
+        # Record raw OCR result before correction
+        raw_ocr_result = extracted_text
+        
+        # Apply dictionary-based correction if enabled
+        if _test_context["use_dictionary_correction"] and extracted_text:
+            extracted_text = medication_dictionary_correction(extracted_text, _test_context["matcher"],
+                                                              cache=_test_context["cache"])
+    raw_similarity = evaluate_similarity(med_name, raw_ocr_result)
+    
+    # Evaluate similarity with the final text
+    similarity = evaluate_similarity(med_name, extracted_text)
+    
+    return {
+        "original": med_name,
+        "extracted": extracted_text,
+        "raw_ocr": raw_ocr_result,
+        "raw_similarity": raw_similarity,
+        "similarity": similarity,
+        "correction_applied": (raw_ocr_result != extracted_text),
+        "tier": tier,
+        "params": params
+    }
+
+def run_ocr_test(medication_names, num_samples=10, output_dir="ocr_test_results", save_images=True, use_enhanced=True, use_dictionary_correction=True,
+                 scheduler=None, workers=1, matcher=None, cache=None, crop=False, seed=None):
+    """
+    Run OCR test on a sample of medication names with various styles.
+    
+    Pass a VariantScheduler as scheduler to use early-exit consensus for the enhanced OCR sweep,
+    and a prebuilt MedicationMatcher (e.g. Formulary.matcher) to skip indexing the names again.
+    An OCRCache as cache skips OCR and correction for images and texts seen before, and
+    crop=True crops each image to its text region before OCR. use_enhanced="cascade" reads
+    each image with cascade_extract and records the tier that answered in the results.
+    With workers > 1 (or None for all cores) the images are processed in a process pool;
+    results keep the sample order, but scheduler win counts are only updated when workers=1.
+    The same seed always samples the same names and renders the same images.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
@@ -260,68 +500,35 @@ def run_ocr_test(medication_names, num_samples=10, output_dir="ocr_test_results"
     if num_samples > len(medication_names):
         num_samples = len(medication_names)
     
-    sampled_medications = random.sample(medication_names, num_samples)
-    
-    results = []
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(medication_names), num_samples, replace=False)
+    sampled_medications = [medication_names[i] for i in picks]
     
-    for i, med_name in enumerate(tqdm(sampled_medications, desc="Testing OCR")):
-        # Randomize parameters for more realistic testing
-        font_scale = random.uniform(1.2, 2.0)
-        thickness = random.randint(1, 3)
-        noise_level = random.uniform(0.01, 0.1)
-        blur_factor = random.uniform(0.2, 0.8)
-        rotation = random.uniform(-10, 10) if random.random() > 0.7 else 0
-        
-        # Randomly select background type
-        background_type = random.choice(["plain", "noise", "gradient"])
-        
-        # Create an image with the medication name
-        img = create_image_with_text(
-            med_name, 
-            font_scale=font_scale, 
-            thickness=thickness, 
-            noise_level=noise_level, 
-            blur_factor=blur_factor,
-            rotation=rotation,
-            background_type=background_type
-        )
-        
-        # Extract text using OCR
-        extracted_text = extract_text_from_image(img, enhanced=use_enhanced)
-        
-        # Record raw OCR result before correction
-        raw_ocr_result = extracted_text
-        raw_similarity = evaluate_similarity(med_name, raw_ocr_result)
-        
-        # Apply dictionary-based correction if enabled
-        if use_dictionary_correction and extracted_text:
-            extracted_text = medication_dictionary_correction(extracted_text, medication_names)
-        
-        # Evaluate similarity with the final text
-        similarity = evaluate_similarity(med_name, extracted_text)
+    # Generate all test images first so the random parameters don't depend on worker count
+    images, params = generate_labels(sampled_medications, seed=rng, workers=workers)
+    samples = []
+    for i, med_name in enumerate(sampled_medications):
+        img = images[i]
+        samples.append((med_name, img, params[i]))
         
-        results.append({
-            "original": med_name,
-            "extracted": extracted_text,
-            "raw_ocr": raw_ocr_result,
-            "raw_similarity": raw_similarity,
-            "similarity": similarity,
-            "correction_applied": (raw_ocr_result != extracted_text),
-            "params": {
-                "font_scale": font_scale,
-                "thickness": thickness,
-                "noise_level": noise_level,
-                "blur_factor": blur_factor,
-                "rotation": rotation,
-                "background": background_type
-            }
-        })
-        
-        # Save the image and results
+        # Save the image
         if save_images:
             img_filename = f"{i}_{med_name.replace(' ', '_')}.png"
             cv2.imwrite(os.path.join(output_dir, img_filename), img)
     
+    # Build the dictionary index once for all samples
+    if matcher is None and (use_dictionary_correction or use_enhanced == "cascade"):
+        matcher = MedicationMatcher(medication_names)
+    context = (matcher, use_enhanced, use_dictionary_correction, scheduler, cache, crop)
+    if workers == 1:
+        _init_test_context(*context)
+        results = [_evaluate_sample(sample) for sample in tqdm(samples, desc="Testing OCR")]
+    else:
+        export_constraints()
+        with ProcessPoolExecutor(max_workers=resolve_workers(workers), initializer=_init_test_context,
+                                 initargs=context) as executor:
+            results = list(tqdm(executor.map(_evaluate_sample, samples), total=len(samples), desc="Testing OCR"))
+    
     return results
 
 def display_results(results):
@@ -394,6 +601,13 @@ def display_results(results):
             avg = stats["total_sim"] / stats["count"]
             print(f"  - {rotation_type}: {avg:.2f}% ({stats['count']} samples)")
     
+    # Which cascade tier answered (cascade runs only)
+    tier_counts = Counter(result["tier"] for result in results if result.get("tier"))
+    if tier_counts:
+        print("\nCascade Tiers:")
+        for tier, count in tier_counts.most_common():
+            print(f"  - {tier}: {count}/{len(results)} ({count / len(results) * 100:.1f}%)")
+    
     print("\nDetailed Results:")
     print("-" * 50)
     
@@ -461,18 +675,37 @@ def display_results(results):
     
     print(f"\nPerformance charts saved to 'ocr_test_results/ocr_performance.png'")
 
-def medication_dictionary_correction(text, medication_list, threshold=60):
+def medication_dictionary_correction(text, medication_list, threshold=60, cache=None):
     """
     Correct OCR text using a dictionary of known medications with advanced matching.
     
     Args:
         text: The OCR extracted text
-        medication_list: List of known medication names
+        medication_list: List of known medication names, or a prebuilt MedicationMatcher
+            (same results, but only scores the medications that can still win)
         threshold: Minimum similarity threshold (default 60%)
+        cache: Optional OCRCache keyed on the text, threshold and dictionary contents
         
     Returns:
         Corrected text if a good match is found, otherwise original text
     """
+    if cache is not None and text:
+        if isinstance(medication_list, MedicationMatcher):
+            fingerprint = medication_list.fingerprint
+        else:
+            fingerprint = names_fingerprint(medication_list)
+        key = cache.text_key(text, stage="correction", threshold=threshold, dictionary=fingerprint)
+        corrected = cache.get(key)
+        ocr_metrics.incr("cache_hits" if corrected is not None else "cache_misses", stage="correction")
+        if corrected is None:
+            corrected = medication_dictionary_correction(text, medication_list, threshold)
+            cache.put(key, corrected)
+        return corrected
+    
+    if isinstance(medication_list, MedicationMatcher):
+        with ocr_metrics.timer("correction"):
+            return medication_list.correct(text, threshold)
+    
     if not text or len(text) < 2:
         return text
     
@@ -484,31 +717,15 @@ def medication_dictionary_correction(text, medication_list, threshold=60):
     best_match = None
     best_score = 0
     
-    # Check both the whole text and individual words
-    text_parts = text.split()
-    candidates = [text] + text_parts  # Check both full text and individual words
-    
-    # Remove very short and common words (like 'a', 'the', etc.)
-    common_words = ['a', 'an', 'the', 'and', 'or', 'in', 'on', 'at', 'to', 'for', 'of', 'with']
-    candidates = [c for c in candidates if len(c) > 2 and c.lower() not in common_words]
+    # Check the full text, individual words and their character n-grams
+    candidates = correction_candidates(text)
     
     # If no candidates after filtering, return original text
     if not candidates:
         return text
-        
-    # Create character n-grams (2-grams and 3-grams) for more robust matching
-    n_grams = []
-    for candidate in candidates:
-        if len(candidate) >= 3:
-            # Generate 2-grams
-            for i in range(len(candidate) - 1):
-                n_grams.append(candidate[i:i+2])
-            # Generate 3-grams
-            for i in range(len(candidate) - 2):
-                n_grams.append(candidate[i:i+3])
     
-    # Add unique n-grams to candidates
-    candidates.extend(list(set(n_grams)))
+    # Three fuzzy scorers per candidate and medication
+    ocr_metrics.incr("fuzzy_comparisons", 3 * len(medication_list) * sum(len(c) >= 2 for c in candidates))
     
     # For each candidate, try different fuzzy matching algorithms
     for candidate in candidates:
@@ -553,9 +770,12 @@ def main():
     # Test parameters
     medication_file = "indian_medications.txt"
     num_samples = 50
+    # Same seed for every configuration, so they are compared on the same images
+    seed = 0
     
-    # Load medication names
-    medication_names = load_medication_names(medication_file)
+    # Load medication names (compiled and indexed once, then memory-mapped)
+    formulary = load_formulary(medication_file)
+    medication_names = formulary.names
     print(f"Loaded {len(medication_names)} medication names")
     
     # Run tests with different configurations to compare performance
@@ -567,6 +787,7 @@ def main():
         medication_names, 
         num_samples, 
         output_dir="ocr_test_basic",
+        seed=seed,
         use_enhanced=False,
         use_dictionary_correction=False
     )
@@ -577,6 +798,7 @@ def main():
         medication_names, 
         num_samples, 
         output_dir="ocr_test_enhanced",
+        seed=seed,
         use_enhanced=True,
         use_dictionary_correction=False
     )
@@ -587,8 +809,10 @@ def main():
         medication_names, 
         num_samples, 
         output_dir="ocr_test_full",
+        seed=seed,
         use_enhanced=True,
-        use_dictionary_correction=True
+        use_dictionary_correction=True,
+        matcher=formulary.matcher
     )
     
     # Display results for each test
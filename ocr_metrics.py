@@ -0,0 +1,216 @@
+"""
+Stage timers and counters for the OCR path.
+
+Code on the hot path reports what it does through the module-level functions (timer,
+incr, observe); they go to the MetricsCollector installed in the current context by
+collect(), and do nothing when there isn't one, so instrumentation costs one context
+variable lookup when metrics are off. The collector is context-local (contextvars), so
+concurrent requests, threads started with a copied context, and asyncio tasks each
+report into the collector that was active where they started.
+
+Counters used by the OCR scripts:
+    tesseract_calls, empty_results, ocr_errors, fuzzy_comparisons,
+    cache_hits, cache_misses
+
+Timers are named by stage (deskew, build_variants, ocr_sweep, correction, ...), and
+per variant/config pair timings carry labels. A collector's snapshot() is plain JSON;
+to_prometheus() renders one in the Prometheus text format for a /metrics endpoint.
+
+Usage:
+    with ocr_metrics.collect() as metrics:
+        extract_text_from_image(img)
+    print(metrics.snapshot())
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+_current = contextvars.ContextVar("ocr_metrics_collector", default=None)
+
+# Returned by timer() when no collector is active
+_NOOP = contextlib.nullcontext()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+class MetricsCollector:
+    """Thread-safe counters and timers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        # key -> [count, total seconds, max seconds]
+        self.timers = {}
+
+    def incr(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def timer(self, name, **labels):
+        """Context manager that records the time spent inside it."""
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """
+        Return the metrics as a JSON-serializable dict.
+
+        Returns:
+            {"counters": [{"name", "labels", "value"}],
+             "timers": [{"name", "labels", "count", "total_ms", "mean_ms", "max_ms"}]}
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            timers = [{"name": name, "labels": dict(labels), "count": count,
+                       "total_ms": round(total * 1000, 3), "mean_ms": round(total / count * 1000, 3),
+                       "max_ms": round(longest * 1000, 3)}
+                      for (name, labels), (count, total, longest) in sorted(self.timers.items())]
+        return {"counters": counters, "timers": timers}
+
+    def counter_totals(self):
+        """Counter values summed over their labels, by name."""
+        with self._lock:
+            totals = {}
+            for (name, _), value in self.counters.items():
+                totals[name] = totals.get(name, 0) + value
+            return totals
+
+    def merge(self, snapshot):
+        """Add a snapshot (e.g. one returned by a worker process) to this collector."""
+        with self._lock:
+            for counter in snapshot["counters"]:
+                key = _key(counter["name"], counter["labels"])
+                self.counters[key] = self.counters.get(key, 0) + counter["value"]
+            for timer in snapshot["timers"]:
+                key = _key(timer["name"], timer["labels"])
+                count, total, longest = timer["count"], timer["total_ms"] / 1000, timer["max_ms"] / 1000
+                current = self.timers.get(key)
+                if current is None:
+                    self.timers[key] = [count, total, longest]
+                else:
+                    current[0] += count
+                    current[1] += total
+                    current[2] = max(current[2], longest)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+class _Timer:
+    __slots__ = ("collector", "name", "labels", "start")
+
+    def __init__(self, collector, name, labels):
+        self.collector = collector
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.collector.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+@contextlib.contextmanager
+def collect(collector=None):
+    """
+    Report the metrics of the code inside the block to a collector.
+
+    Args:
+        collector: MetricsCollector to use (default: a new one)
+
+    Yields:
+        The collector
+    """
+    collector = collector if collector is not None else MetricsCollector()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+def current_collector():
+    """The collector active in this context, or None when metrics are off."""
+    return _current.get()
+
+
+def incr(name, value=1, **labels):
+    collector = _current.get()
+    if collector is not None:
+        collector.incr(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    collector = _current.get()
+    if collector is not None:
+        collector.observe(name, seconds, **labels)
+
+
+def timer(name, **labels):
+    """Time a block into the active collector (a no-op when there is none)."""
+    collector = _current.get()
+    if collector is None:
+        return _NOOP
+    return _Timer(collector, name, labels)
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name in sorted(labels):
+        value = str(labels[name]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def to_prometheus(snapshot, prefix="ocr_"):
+    """
+    Render a snapshot in the Prometheus text exposition format.
+
+    Counters become <prefix><name>_total, timers a <prefix><name>_seconds summary
+    (_count and _sum) plus a <prefix><name>_seconds_max gauge.
+    """
+    counters = {}
+    for counter in snapshot["counters"]:
+        metric = f"{prefix}{counter['name']}_total"
+        counters.setdefault(metric, []).append(
+            f"{metric}{_prometheus_labels(counter['labels'])} {counter['value']}")
+
+    summaries = {}
+    maxima = {}
+    for timer in snapshot["timers"]:
+        metric = f"{prefix}{timer['name']}_seconds"
+        labels = _prometheus_labels(timer["labels"])
+        summaries.setdefault(metric, []).extend([
+            f"{metric}_count{labels} {timer['count']}",
+            f"{metric}_sum{labels} {timer['total_ms'] / 1000:.6f}",
+        ])
+        maxima.setdefault(f"{metric}_max", []).append(f"{metric}_max{labels} {timer['max_ms'] / 1000:.6f}")
+
+    lines = []
+    for kind, metrics in (("counter", counters), ("summary", summaries), ("gauge", maxima)):
+        for metric, samples in metrics.items():
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,111 @@
+"""
+Process-pool helpers for running OCR work on several cores.
+
+Results are always returned in submission order, so parallel runs produce the same
+output as serial ones. Each worker process uses its own default OCR backend.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from ocr_backend import export_constraints, get_backend
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def resolve_workers(workers):
+    """Turn a workers= argument into a process count (None or 0 means all cores)."""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def get_executor(workers):
+    """Return a shared process pool with the given number of workers."""
+    workers = resolve_workers(workers)
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            # Compile any OCR_CONSTRAIN_TO formulary here, not in every worker
+            export_constraints()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            _executors[workers] = executor
+        return executor
+
+
+def shutdown_executors():
+    """Shut down every shared process pool."""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
+
+
+atexit.register(shutdown_executors)
+
+
+def parallel_map(fn, items, workers=1, chunksize=1):
+    """
+    Map fn over items, in a process pool when workers > 1.
+
+    Args:
+        fn: A picklable (module-level) function
+        items: Iterable of arguments
+        workers: Number of processes (1 runs in the current process, None uses all cores)
+        chunksize: Items sent to a worker at a time
+
+    Returns:
+        List of results in the same order as items
+    """
+    if workers == 1:
+        return [fn(item) for item in items]
+    return list(get_executor(workers).map(fn, items, chunksize=chunksize))
+
+
+def ocr_image(args):
+    """Worker task: run one (image, config) pair through the worker's default backend."""
+    img, config = args
+    return get_backend().image_to_string(img, config=config)
+
+
+def ocr_serial(tasks, backend):
+    """Run (image, config) OCR tasks in this process, yielding results like ocr_in_order."""
+    for img, config in tasks:
+        try:
+            yield backend.image_to_string(img, config=config)
+        except Exception as e:
+            yield e
+
+
+def ocr_in_order(tasks, workers, window=None):
+    """
+    Run (image, config) OCR tasks in a process pool and yield the results in order.
+
+    At most `window` tasks are in flight at once, so a caller that stops iterating
+    early (e.g. once the OCR results agree) does not pay for the remaining tasks.
+    Tasks that raise yield the exception object instead of a string.
+    """
+    executor = get_executor(workers)
+    window = window or resolve_workers(workers) * 2
+
+    tasks = iter(tasks)
+    pending = []
+    try:
+        for task in tasks:
+            pending.append(executor.submit(ocr_image, task))
+            if len(pending) >= window:
+                yield _result_or_exception(pending.pop(0))
+        while pending:
+            yield _result_or_exception(pending.pop(0))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _result_or_exception(future):
+    try:
+        return future.result()
+    except Exception as e:
+        return e
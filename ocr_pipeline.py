@@ -0,0 +1,288 @@
+"""
+Headless streaming OCR pipeline for large batches of prescription images.
+
+Image paths come from a generator, and decoding, preprocessing, OCR and medication
+matching run as separate stages connected by bounded queues, so at most a fixed number
+of images are in memory at once no matter how many files there are. Results are
+written in input order as JSON lines, and a small checkpoint file records how far the
+output got, so an interrupted run resumes where it stopped instead of starting over.
+
+Usage:
+    python ocr_pipeline.py archive/ results.jsonl --threads 8
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from itertools import islice
+
+import cv2
+
+from formulary import DEFAULT_SOURCE, load_formulary
+from ocr_backend import get_backend
+from ocr_parallel import resolve_workers
+from ocr_preprocessing import find_text_regions
+from ocr_test import detect_text, match_medications, preprocess_loaded_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def iter_image_paths(root, extensions=IMAGE_EXTENSIONS):
+    """
+    Yield the image files under root, recursively and in a stable (sorted) order.
+
+    The order matters for resuming: a checkpoint stores how many paths were done.
+    """
+    entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from iter_image_paths(entry.path, extensions)
+        elif entry.name.lower().endswith(extensions):
+            yield entry.path
+
+
+class _Stage:
+    """A pool of threads applying fn to items from one queue and putting results on the next."""
+
+    def __init__(self, name, fn, inbox, outbox, threads=1):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.busy_seconds = 0.0
+        self._remaining = threads
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f"ocr-{name}-{i}", daemon=True)
+                         for i in range(threads)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # Let the other threads of this stage see it too; the last one passes it on
+                self.inbox.put(_DONE)
+                with self._lock:
+                    self._remaining -= 1
+                    last = self._remaining == 0
+                if last:
+                    self.outbox.put(_DONE)
+                return
+
+            seq, path, payload, error = item
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    payload = self.fn(payload)
+                except Exception as e:
+                    payload, error = None, f"{self.name}: {e}"
+                with self._lock:
+                    self.busy_seconds += time.perf_counter() - start
+            self.outbox.put((seq, path, payload, error))
+
+
+def _load_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(checkpoint_file, count, last_path, offset):
+    tmp_file = f"{checkpoint_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"count": count, "last_path": last_path, "offset": offset}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def run_pipeline(paths, output_file, known_medications, checkpoint_file=None, resume=True,
+                 ocr_threads=None, max_in_flight=32, checkpoint_every=100,
+                 normalize=True, crop=False, progress_every=0):
+    """
+    OCR a stream of images and write one JSON line per image.
+
+    Args:
+        paths: Iterable of image paths (e.g. iter_image_paths(root)); must be in the
+            same order on every run for resuming to work
+        output_file: JSONL file the results are written to
+        known_medications: List of medication names to match against
+        checkpoint_file: Progress file (default: output_file + ".checkpoint")
+        resume: Continue from the checkpoint if there is one (otherwise start over)
+        ocr_threads: Number of OCR threads (None uses all cores)
+        max_in_flight: Maximum number of images between reading and writing at once
+        checkpoint_every: Save the checkpoint after this many results
+        normalize: Rescale images by text size before preprocessing
+        crop: Only run OCR on the detected text lines
+        progress_every: Print a progress line after this many results (0 disables)
+
+    Returns:
+        Dict with counts, elapsed time and per-stage busy time
+
+    Raises:
+        Whatever iterating paths raised (e.g. OSError for an unreadable directory),
+        after the results of the paths read before it are written and checkpointed
+    """
+    checkpoint_file = checkpoint_file or f"{output_file}.checkpoint"
+    ocr_threads = resolve_workers(ocr_threads)
+    paths = iter(paths)
+
+    # Skip what an earlier run already wrote, and drop anything written after its last checkpoint
+    done = 0
+    checkpoint = _load_checkpoint(checkpoint_file) if resume else None
+    if checkpoint and os.path.exists(output_file):
+        done = checkpoint["count"]
+        skipped = list(islice(paths, done - 1, done)) if done else []
+        if done and (not skipped or skipped[0] != checkpoint["last_path"]):
+            raise ValueError(f"Input paths no longer match checkpoint {checkpoint_file}; "
+                             "rerun without resuming")
+        with open(output_file, 'r+b') as f:
+            f.truncate(checkpoint["offset"])
+        mode = 'a'
+    else:
+        mode = 'w'
+
+    # Load the OCR backend once before the threads start using it
+    get_backend()
+
+    def decode(path):
+        img = cv2.imread(path)
+        if img is None:
+            raise ValueError("could not read image")
+        return img
+
+    def preprocess(img):
+        _, processed_img, _ = preprocess_loaded_image(img, normalize=normalize)
+        return processed_img
+
+    def ocr(processed_img):
+        regions = find_text_regions(processed_img, mask=processed_img, split_lines=True) if crop else None
+        return detect_text(processed_img, regions=regions)
+
+    def match(text):
+        return text, match_medications(text, known_medications)
+
+    # Queues between stages; the in-flight limit keeps them (and the reorder buffer) bounded
+    queues = [queue.Queue() for _ in range(5)]
+    stages = [
+        _Stage("decode", decode, queues[0], queues[1], threads=2),
+        _Stage("preprocess", preprocess, queues[1], queues[2], threads=max(1, ocr_threads // 2)),
+        _Stage("ocr", ocr, queues[2], queues[3], threads=ocr_threads),
+        _Stage("match", match, queues[3], queues[4], threads=1),
+    ]
+    for stage in stages:
+        stage.start()
+
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    # An exception from the paths iterator, re-raised once the results before it are written
+    producer_error = []
+
+    def produce():
+        try:
+            for seq, path in enumerate(paths, start=done):
+                in_flight.acquire()
+                queues[0].put((seq, path, path, None))
+        except Exception as e:
+            producer_error.append(e)
+        finally:
+            queues[0].put(_DONE)
+
+    producer = threading.Thread(target=produce, name="ocr-paths", daemon=True)
+    producer.start()
+
+    stats = {"processed": 0, "errors": 0, "resumed_from": done}
+    start = time.perf_counter()
+    pending = {}
+    next_seq = done
+
+    with open(output_file, mode) as out:
+        last_path = None
+        while True:
+            item = queues[4].get()
+            if item is _DONE:
+                break
+            pending[item[0]] = item
+
+            # Write results in input order so the checkpoint is a simple count
+            while next_seq in pending:
+                _, path, payload, error = pending.pop(next_seq)
+                if error is None:
+                    text, matches = payload
+                    record = {
+                        "path": path,
+                        "text": text,
+                        "matches": [{"detected": detected, "medication": medication, "score": score}
+                                    for detected, medication, score in matches],
+                    }
+                else:
+                    record = {"path": path, "error": error}
+                    stats["errors"] += 1
+                out.write(json.dumps(record) + "\n")
+
+                next_seq += 1
+                last_path = path
+                stats["processed"] += 1
+                in_flight.release()
+
+                if stats["processed"] % checkpoint_every == 0:
+                    out.flush()
+                    _save_checkpoint(checkpoint_file, next_seq, last_path, out.tell())
+                if progress_every and stats["processed"] % progress_every == 0:
+                    rate = stats["processed"] / (time.perf_counter() - start)
+                    print(f"{next_seq} images done ({rate:.1f} images/sec)")
+
+        out.flush()
+        if last_path is not None:
+            # Only counts what was written, so after a failed run a rerun resumes from here
+            _save_checkpoint(checkpoint_file, next_seq, last_path, out.tell())
+
+    if producer_error:
+        raise producer_error[0]
+
+    stats["elapsed"] = time.perf_counter() - start
+    stats["images_per_sec"] = stats["processed"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    stats["busy_seconds"] = {stage.name: stage.busy_seconds for stage in stages}
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR a directory of prescription images into a JSONL file")
+    parser.add_argument("input_dir", help="Directory with prescription images (searched recursively)")
+    parser.add_argument("output", help="JSONL file to write the results to")
+    parser.add_argument("--formulary", default=DEFAULT_SOURCE,
+                        help="Medication list to match against")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Number of OCR threads (0 uses all cores)")
+    parser.add_argument("--max-in-flight", type=int, default=32,
+                        help="Maximum number of images in memory at once")
+    parser.add_argument("--crop", action="store_true",
+                        help="Only run OCR on the detected text lines")
+    parser.add_argument("--no-normalize", action="store_true",
+                        help="Skip rescaling images by text size")
+    args = parser.parse_args()
+
+    known_medications = load_formulary(args.formulary).names
+    stats = run_pipeline(iter_image_paths(args.input_dir), args.output, known_medications,
+                         checkpoint_file=args.checkpoint, resume=not args.restart,
+                         ocr_threads=args.threads, max_in_flight=args.max_in_flight,
+                         normalize=not args.no_normalize, crop=args.crop, progress_every=100)
+
+    print(f"Processed {stats['processed']} images ({stats['errors']} errors) "
+          f"in {stats['elapsed']:.1f}s, {stats['images_per_sec']:.1f} images/sec")
+    if stats["resumed_from"]:
+        print(f"Resumed after {stats['resumed_from']} images from an earlier run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Image preprocessing for the enhanced OCR path.
+
+build_variants produces every preprocessing variant used by extract_text_from_image
+with OpenCV's own thresholding written straight into a single preallocated (variants,
+height, width) uint8 stack instead of separate allocations.
+
+find_text_regions crops images down to the boxes that contain text before OCR, since
+Tesseract's run time grows with the number of pixels it has to look at.
+
+normalize_resolution rescales an image so its text has the height Tesseract reads
+best, which shrinks full-size phone photos before any other preprocessing runs on them
+and enlarges small crops.
+"""
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+import ocr_metrics
+
+logger = logging.getLogger(__name__)
+
+# Order of the variants in the stack returned by build_variants
+ADAPTIVE_BLOCK_SIZES = [7, 11, 15]
+FIXED_THRESHOLDS = [120, 150, 180]
+VARIANT_NAMES = (
+    [f"adaptive_{block_size}" for block_size in ADAPTIVE_BLOCK_SIZES]
+    + ["otsu", "clahe"]
+    + [f"threshold_{thresh_val}" for thresh_val in FIXED_THRESHOLDS]
+    + ["original"]
+)
+
+# Tesseract is most accurate when lowercase letters are roughly 20-30 pixels tall; the
+# text height measured by estimate_text_height is the capital/ascender height, which is
+# about 1.4 times the x-height in common fonts (1.35 in the Hershey fonts of the labels)
+TARGET_TEXT_HEIGHT = 28
+
+# Normalized images are never larger than this along their longest side
+MAX_SIDE = 3500
+
+# CLAHE objects keep internal buffers, so each thread gets its own
+_local = threading.local()
+
+
+def _get_clahe():
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe
+
+
+def apply_threshold(img, thresh_val, out=None):
+    """Binary threshold: 255 where the image is above thresh_val, 0 elsewhere."""
+    return cv2.threshold(img, int(thresh_val), 255, cv2.THRESH_BINARY, dst=out)[1]
+
+
+def otsu_binarize(img, out=None):
+    """Binary threshold at the Otsu threshold of the image."""
+    return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=out)[1]
+
+
+def text_mask(img, thresh_val=200):
+    """Mask of dark (text) pixels: 255 where the image is at or below thresh_val."""
+    return cv2.threshold(img, int(thresh_val), 255, cv2.THRESH_BINARY_INV)[1]
+
+
+def deskew(img, return_contours=False):
+    """
+    Rotate the image so the largest text contour is level.
+
+    Args:
+        img: Grayscale uint8 image
+        return_contours: Also return the text contours found on the way, so callers
+            can reuse them (e.g. for find_text_regions)
+
+    Returns:
+        The (possibly) rotated image; the input is returned unchanged when there is
+        too little foreground or the angle is negligible or extreme. With
+        return_contours, a (image, contours) tuple where contours is None if the image
+        was rotated or no contours were computed
+    """
+    contours = None
+    rotated = None
+    try:
+        # Only attempt deskewing if there's enough black pixels
+        foreground = text_mask(img)
+        if cv2.countNonZero(foreground) > 100:  # Only attempt if we have enough foreground pixels
+            # Find all contours in the image
+            contours, _ = cv2.findContours(foreground, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+            # Find the largest contour by area
+            if contours:
+                largest_contour = max(contours, key=cv2.contourArea)
+                if cv2.contourArea(largest_contour) > 100:  # Only use substantial contours
+                    # Get the minimum area rectangle
+                    rect = cv2.minAreaRect(largest_contour)
+                    angle = rect[-1]
+
+                    # Adjust angle for correct rotation
+                    if angle < -45:
+                        angle = -(90 + angle)
+                    else:
+                        angle = -angle
+
+                    # Only rotate if angle is significant but not extreme
+                    if 0.5 < abs(angle) < 20:
+                        (h, w) = img.shape[:2]
+                        center = (w // 2, h // 2)
+                        M = cv2.getRotationMatrix2D(center, angle, 1.0)
+                        rotated = cv2.warpAffine(img, M, (w, h),
+                                                 flags=cv2.INTER_CUBIC,
+                                                 borderMode=cv2.BORDER_REPLICATE)
+    except Exception as e:
+        # If deskewing fails, log it and continue with the original image
+        logger.warning(f"Deskewing failed: {str(e)}")
+        ocr_metrics.incr("ocr_errors", variant="deskew", config="")
+
+    if rotated is not None:
+        return (rotated, None) if return_contours else rotated
+    return (img, contours) if return_contours else img
+
+
+def _pad_box(x0, y0, x1, y1, padding, width, height):
+    """Pad a box given by its corners and return it as (x, y, w, h) clipped to the image."""
+    x0, y0 = max(0, x0 - padding), max(0, y0 - padding)
+    x1, y1 = min(width, x1 + padding), min(height, y1 + padding)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def find_text_regions(img, mask=None, contours=None, padding=10, min_area=20, split_lines=False):
+    """
+    Find the boxes that contain text, so only those pixels are sent to Tesseract.
+
+    Args:
+        img: Grayscale image (only its size is used when mask or contours are given)
+        mask: Foreground mask with text as non-zero pixels (default: text_mask(img))
+        contours: Contours already found on the mask, e.g. by deskew(return_contours=True)
+        padding: Margin added around each box (Tesseract needs some background border)
+        min_area: Bounding boxes smaller than this many pixels are treated as noise
+        split_lines: Return one box per text line instead of a single box around all text
+
+    Returns:
+        List of (x, y, w, h) boxes, top to bottom; empty if no text was found
+    """
+    height, width = img.shape[:2]
+
+    if contours is None:
+        if mask is None:
+            mask = text_mask(img)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = [cv2.boundingRect(contour) for contour in contours]
+    boxes = [box for box in boxes if box[2] * box[3] >= min_area]
+    if not boxes:
+        return []
+
+    if not split_lines:
+        x0 = min(x for x, _, _, _ in boxes)
+        y0 = min(y for _, y, _, _ in boxes)
+        x1 = max(x + w for x, _, w, _ in boxes)
+        y1 = max(y + h for _, y, _, h in boxes)
+        return [_pad_box(x0, y0, x1, y1, padding, width, height)]
+
+    # Group boxes that overlap vertically into lines
+    lines = []
+    for x, y, w, h in sorted(boxes, key=lambda box: box[1]):
+        if lines and y < lines[-1][3]:
+            line = lines[-1]
+            line[0], line[2], line[3] = min(line[0], x), max(line[2], x + w), max(line[3], y + h)
+        else:
+            lines.append([x, y, x + w, y + h])
+
+    return [_pad_box(x0, y0, x1, y1, padding, width, height) for x0, y0, x1, y1 in lines]
+
+
+def crop_regions(img, boxes):
+    """Return the image regions for (x, y, w, h) boxes (views, not copies)."""
+    return [img[y:y + h, x:x + w] for x, y, w, h in boxes]
+
+
+def estimate_text_height(img, max_side=1600):
+    """
+    Estimate the capital/ascender height of the text in an image, in pixels.
+
+    The estimate is the 90th percentile height of character-like connected components,
+    found on a copy downscaled to at most max_side pixels so it stays cheap on large
+    photos. The median would be the x-height for mostly lowercase names but the cap
+    height for capitals and digits; the upper percentile lands on the tall glyphs
+    (capitals, digits, ascenders, descenders) that nearly every label contains.
+
+    Args:
+        img: Grayscale or BGR uint8 image with dark text on a light background
+        max_side: Longest side of the copy used for the estimate
+
+    Returns:
+        The estimated text height in pixels of img, or None if too few characters were found
+    """
+    height, width = img.shape[:2]
+    work_scale = min(1.0, max_side / max(height, width))
+    if work_scale < 1.0:
+        img = cv2.resize(img, None, fx=work_scale, fy=work_scale, interpolation=cv2.INTER_AREA)
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    _, mask = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    stats = stats[1:]  # Skip the background component
+
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    areas = stats[:, cv2.CC_STAT_AREA]
+
+    # Keep components shaped like characters: not specks, not lines or page borders
+    keep = ((heights >= 3) & (heights < img.shape[0] * 0.25)
+            & (widths < heights * 4) & (heights < widths * 8)
+            & (areas >= widths * heights * 0.1))
+    if np.count_nonzero(keep) < 5:
+        return None
+
+    return float(np.percentile(heights[keep], 90)) / work_scale
+
+
+def normalize_resolution(img, target_text_height=TARGET_TEXT_HEIGHT, max_side=MAX_SIDE,
+                         max_scale=4.0, tolerance=0.15):
+    """
+    Rescale an image so its text has roughly the target height.
+
+    Args:
+        img: Grayscale or BGR uint8 image
+        target_text_height: Wanted capital/ascender height in pixels (see estimate_text_height)
+        max_side: Upper limit for the longest side of the result (also applied when
+            no text could be measured)
+        max_scale: Upper limit for upscaling
+        tolerance: Relative scale change below which the image is left alone
+
+    Returns:
+        (image, scale) tuple; divide coordinates in the returned image by scale (see
+        scale_boxes) to map them back onto the input
+    """
+    height, width = img.shape[:2]
+    text_height = estimate_text_height(img)
+
+    side_scale = max_side / max(height, width)
+    scale = target_text_height / text_height if text_height else 1.0
+    scale = min(scale, max_scale, side_scale)
+
+    # A small change is skipped, unless the image is larger than max_side
+    if abs(scale - 1.0) < tolerance and side_scale >= 1.0:
+        return img, 1.0
+
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    resized = cv2.resize(img, None, fx=scale, fy=scale, interpolation=interpolation)
+    return resized, scale
+
+
+def scale_boxes(boxes, scale):
+    """Map (x, y, w, h) boxes from a normalize_resolution result back onto the original image."""
+    return [tuple(int(round(value / scale)) for value in box) for box in boxes]
+
+
+def build_variants(img, out=None):
+    """
+    Build every preprocessing variant of a grayscale image.
+
+    Args:
+        img: Grayscale uint8 image
+        out: Optional preallocated (len(VARIANT_NAMES), height, width) uint8 array to reuse
+
+    Returns:
+        uint8 array of shape (len(VARIANT_NAMES), height, width), one variant per
+        entry of VARIANT_NAMES
+    """
+    img = np.ascontiguousarray(img)
+    if out is None:
+        out = np.empty((len(VARIANT_NAMES),) + img.shape, dtype=np.uint8)
+
+    slot = 0
+
+    # Method 1: Adaptive thresholding with different block sizes
+    # (Gaussian-weighted, so these can't share an integral image)
+    for block_size in ADAPTIVE_BLOCK_SIZES:
+        cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                              cv2.THRESH_BINARY, block_size, 2, dst=out[slot])
+        slot += 1
+
+    # Method 2: Otsu's thresholding
+    otsu_binarize(img, out=out[slot])
+    slot += 1
+
+    # Method 3: CLAHE (Contrast Limited Adaptive Histogram Equalization)
+    _get_clahe().apply(img, dst=out[slot])
+    apply_threshold(out[slot], 150, out=out[slot])
+    slot += 1
+
+    # Method 4: Regular thresholding with different values
+    for thresh_val in FIXED_THRESHOLDS:
+        apply_threshold(img, thresh_val, out=out[slot])
+        slot += 1
+
+    # Method 5: Original image with no processing
+    out[slot] = img
+
+    return out
+
+
+def build_variant(img, name, out=None):
+    """
+    Build a single preprocessing variant (the same pixels as its entry in build_variants).
+
+    Args:
+        img: Grayscale uint8 image
+        name: One of VARIANT_NAMES
+        out: Optional preallocated uint8 array of the image's shape
+
+    Returns:
+        uint8 array with the variant
+    """
+    img = np.ascontiguousarray(img)
+    if out is None:
+        out = np.empty_like(img)
+
+    kind, _, value = name.partition("_")
+    if kind == "adaptive":
+        cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                              cv2.THRESH_BINARY, int(value), 2, dst=out)
+    elif kind == "otsu":
+        otsu_binarize(img, out=out)
+    elif kind == "clahe":
+        _get_clahe().apply(img, dst=out)
+        apply_threshold(out, 150, out=out)
+    elif kind == "threshold":
+        apply_threshold(img, int(value), out=out)
+    elif kind == "original":
+        out[:] = img
+    else:
+        raise ValueError(f"Unknown preprocessing variant: {name}")
+
+    return out
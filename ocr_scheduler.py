@@ -0,0 +1,110 @@
+"""
+Early-exit scheduling for the enhanced OCR sweep.
+
+The enhanced path in ocr_medication_test.extract_text_from_image tries every
+preprocessing variant with every Tesseract configuration. Most of the time the
+first few combinations already agree, so this scheduler runs the historically
+best (variant, config) pairs first and stops the sweep once enough of them agree.
+The Counter-based vote in extract_text_from_image still picks the final answer.
+"""
+import json
+import os
+import threading
+from collections import Counter
+
+
+class VariantScheduler:
+    """Orders (variant, config) pairs by past wins and decides when to stop early."""
+
+    def __init__(self, consensus=3, confidence=0.6, stats_file=None):
+        """
+        Args:
+            consensus: Number of identical cleaned results needed before stopping
+                (None disables early exit, so the full sweep always runs)
+            confidence: Minimum share of the results so far held by the leading text
+            stats_file: Optional JSON file used to load and save the win counts
+        """
+        self.consensus = consensus
+        self.confidence = confidence
+        self.stats_file = stats_file
+        self.wins = Counter()
+        self.runs = 0
+        self._lock = threading.Lock()
+
+        if stats_file and os.path.exists(stats_file):
+            self.load(stats_file)
+
+    def __getstate__(self):
+        # Locks can't be pickled, so worker processes get a fresh one
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def order(self, pairs):
+        """Return the pairs sorted by win count, keeping the original order for ties."""
+        with self._lock:
+            wins = dict(self.wins)
+        return sorted(pairs, key=lambda pair: -wins.get(pair, 0))
+
+    def should_stop(self, results):
+        """Check whether the cleaned results collected so far are a settled vote."""
+        if self.consensus is None or not results:
+            return False
+
+        most_common = Counter(results).most_common(2)
+        top_count = most_common[0][1]
+        if top_count < self.consensus:
+            return False
+
+        # The final vote needs a strict winner, otherwise it falls back to length
+        if len(most_common) > 1 and most_common[1][1] == top_count:
+            return False
+
+        return top_count / len(results) >= self.confidence
+
+    def record(self, outputs, winner):
+        """
+        Credit every pair whose output matched the chosen result.
+
+        Args:
+            outputs: List of ((variant, config), cleaned_text) tuples from one sweep
+            winner: The text returned by the final vote
+        """
+        if not winner:
+            return
+
+        with self._lock:
+            self.runs += 1
+            for pair, text in outputs:
+                if text == winner:
+                    self.wins[pair] += 1
+
+    def load(self, filename):
+        """Load win counts saved by save()."""
+        with open(filename, 'r') as f:
+            data = json.load(f)
+
+        with self._lock:
+            self.runs = data.get("runs", 0)
+            self.wins = Counter({
+                tuple(key.split("|", 1)): count for key, count in data.get("wins", {}).items()
+            })
+
+    def save(self, filename=None):
+        """Save win counts so the ordering survives restarts."""
+        filename = filename or self.stats_file
+        if not filename:
+            return
+
+        with self._lock:
+            data = {
+                "runs": self.runs,
+                "wins": {f"{variant}|{config}": count for (variant, config), count in self.wins.items()}
+            }
+
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=2)
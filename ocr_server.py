@@ -0,0 +1,346 @@
+"""
+Async OCR and medication recognition server.
+
+Uploads are handled by an asyncio (Quart) front end and passed to a micro-batching
+dispatcher: concurrent scans that arrive within a few milliseconds of each other are
+grouped into one batch and sent to a worker process, which decodes the images, runs
+the enhanced extract_text_from_image sweep and corrects all the results with one bulk
+MedicationMatcher.correct_batch call. Each worker runs one batch at a time, so the pool
+stays busy while the event loop keeps accepting requests.
+
+The queue in front of the workers is bounded: when it is full new scans are rejected
+with 503 (and a Retry-After header) instead of piling up, and every scan has a timeout
+after which it gets 504.
+
+Every batch is run with an ocr_metrics collector in the worker and its stage timers and
+counters are merged into the server's totals, served by GET /metrics in the Prometheus
+text format (or as JSON with ?format=json). The totals belong to one server process, so
+run it as a single process (serve.py does) and let its pool use the cores; with several
+server processes each would report only its own requests.
+
+Usage:
+    python ocr_server.py --port 5002 --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+import ocr_metrics
+from formulary import DEFAULT_SOURCE, load_formulary
+from ocr_backend import export_constraints
+from ocr_medication_test import extract_text_from_image
+from ocr_parallel import resolve_workers
+from ocr_scheduler import VariantScheduler
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ServerBusy(Exception):
+    """Raised when the dispatcher queue is full."""
+
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(formulary_source):
+    """Load the formulary and an early-exit scheduler in a worker process."""
+    _worker["matcher"] = load_formulary(formulary_source).matcher
+    _worker["scheduler"] = VariantScheduler()
+
+
+def recognize_batch(blobs):
+    """
+    Worker task: OCR and correct a batch of encoded images.
+
+    Args:
+        blobs: List of encoded image files (PNG, JPEG, ...) as bytes
+
+    Returns:
+        (results, metrics): result dicts in the same order, with "text" (corrected) and
+        "raw_text", or "error" for images that could not be decoded; and the batch's
+        ocr_metrics snapshot
+    """
+    results = []
+    raw_texts = []
+    with ocr_metrics.collect() as metrics:
+        for blob in blobs:
+            with ocr_metrics.timer("decode"):
+                img = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                metrics.incr("decode_errors")
+                results.append({"error": "Could not decode image"})
+                continue
+            with ocr_metrics.timer("extract"):
+                raw_text = extract_text_from_image(img, scheduler=_worker["scheduler"], normalize=True)
+            results.append({"raw_text": raw_text})
+            raw_texts.append(raw_text)
+
+        # Correct the whole batch in one bulk scoring call
+        with ocr_metrics.timer("correction_batch"):
+            corrected = iter(_worker["matcher"].correct_batch(raw_texts))
+        for result in results:
+            if "raw_text" in result:
+                result["text"] = next(corrected)
+    return results, metrics.snapshot()
+
+
+class BatchDispatcher:
+    """Groups concurrent requests into batches and runs them on a process pool."""
+
+    def __init__(self, executor, max_batch_size=8, max_wait=0.01, max_queue=64, max_batches=1,
+                 metrics=None):
+        """
+        Args:
+            executor: ProcessPoolExecutor the batches run on
+            max_batch_size: Largest number of images in one batch
+            max_wait: Seconds to wait for more requests after the first one of a batch
+            max_queue: Requests allowed to wait for a worker before new ones are rejected
+            max_batches: Batches running at once (normally the number of workers)
+            metrics: MetricsCollector the workers' batch metrics are merged into
+        """
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_batches = max_batches
+        self.metrics = metrics if metrics is not None else ocr_metrics.MetricsCollector()
+
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+        self._queue = None
+        self._slots = None
+        self._task = None
+        # The event loop only keeps weak references to tasks, so running batches are held here
+        self._batch_tasks = set()
+
+    def start(self):
+        """Start the dispatch loop (must be called from the running event loop)."""
+        self._queue = asyncio.Queue(self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the dispatch loop and cancel the batches still running."""
+        tasks = list(self._batch_tasks)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, blob, timeout):
+        """
+        Queue an image and wait for its result.
+
+        Raises:
+            ServerBusy: The queue is full
+            asyncio.TimeoutError: No result within timeout seconds
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((blob, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ServerBusy()
+
+        try:
+            # wait_for cancels the future on timeout, so the batch skips this request
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def _run(self):
+        while True:
+            # Only form a batch once a worker is free, so it includes everything queued meanwhile
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+
+            deadline = asyncio.get_running_loop().time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip requests that timed out while waiting
+            batch = [(blob, future) for blob, future in batch if not future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results, metrics = await loop.run_in_executor(self.executor, recognize_batch,
+                                                          [blob for blob, _ in batch])
+            self.metrics.merge(metrics)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            # Shutting down: don't leave the requests of this batch waiting
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Batch failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batches += 1
+            self.images += len(batch)
+            self._slots.release()
+
+    def stats(self):
+        """Return dispatcher counters."""
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "average_batch_size": self.images / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "counters": self.metrics.counter_totals(),
+        }
+
+
+def create_app(formulary_source=DEFAULT_SOURCE, workers=None, max_batch_size=8, max_wait=0.01,
+               max_queue=64, timeout=30.0):
+    """
+    Build the OCR server app.
+
+    Args:
+        formulary_source: Medication list used for correction
+        workers: Number of worker processes (None uses all cores)
+        max_batch_size: Largest number of images OCR'd in one batch
+        max_wait: Seconds a batch waits for more requests before it is dispatched
+        max_queue: Requests allowed to wait for a worker before new ones get 503
+        timeout: Seconds before a scan gives up with 504
+    """
+    workers = resolve_workers(workers)
+
+    app = Quart(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+    app = cors(app, allow_origin="*", allow_methods=["GET", "POST", "OPTIONS"],
+               allow_headers=["Content-Type", "Authorization"])
+
+    state = {}
+
+    @app.before_serving
+    async def startup():
+        # Compile the formulary (and any OCR_CONSTRAIN_TO list) once here so the workers
+        # only memory-map it
+        load_formulary(formulary_source)
+        export_constraints()
+        state["executor"] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(formulary_source,))
+        state["dispatcher"] = BatchDispatcher(state["executor"], max_batch_size=max_batch_size,
+                                              max_wait=max_wait, max_queue=max_queue,
+                                              max_batches=workers)
+        state["dispatcher"].start()
+        logger.info(f"OCR server ready with {workers} workers")
+
+    @app.after_serving
+    async def shutdown():
+        await state["dispatcher"].stop()
+        state["executor"].shutdown(wait=False, cancel_futures=True)
+
+    @app.route('/')
+    async def home():
+        return jsonify({"status": "OCR API is running", "dispatcher": state["dispatcher"].stats()})
+
+    @app.route('/metrics')
+    async def metrics():
+        snapshot = state["dispatcher"].metrics.snapshot()
+        if request.args.get("format") == "json":
+            return jsonify(snapshot)
+        return Response(ocr_metrics.to_prometheus(snapshot), mimetype="text/plain; version=0.0.4")
+
+    @app.route('/api/ocr', methods=['POST'])
+    async def ocr():
+        start_time = time.time()
+
+        # Accept a multipart upload ("image" field) or the raw image as the request body
+        files = await request.files
+        if "image" in files:
+            blob = files["image"].read()
+        else:
+            blob = await request.get_data()
+        if not blob:
+            return jsonify({"error": "Missing image in request"}), 400
+
+        try:
+            result = await state["dispatcher"].submit(blob, timeout)
+        except ServerBusy:
+            response = jsonify({"error": "Server busy, please retry"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        except asyncio.TimeoutError:
+            return jsonify({"error": "OCR timed out"}), 504
+        except Exception as e:
+            logger.error(f"Error processing scan: {str(e)}")
+            return jsonify({"error": "Failed to process image", "details": str(e)}), 500
+
+        if "error" in result:
+            return jsonify(result), 400
+
+        processing_time = time.time() - start_time
+        logger.info(f"Scan processed in {processing_time:.2f} seconds")
+        result["processing_time"] = f"{processing_time:.2f} seconds"
+        return jsonify(result)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OCR and medication recognition server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5002)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Number of OCR worker processes (0 uses all cores)")
+    parser.add_argument("--formulary", default=DEFAULT_SOURCE,
+                        help="Medication list used for correction")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="Largest number of images OCR'd in one batch")
+    parser.add_argument("--batch-wait", type=float, default=0.01,
+                        help="Seconds to wait for more scans before dispatching a batch")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="Scans allowed to wait for a worker before new ones get 503")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Seconds before a scan gives up with 504")
+    args = parser.parse_args()
+
+    app = create_app(args.formulary, workers=args.workers, max_batch_size=args.batch_size,
+                     max_wait=args.batch_wait, max_queue=args.max_queue, timeout=args.timeout)
+    logger.info(f"Starting OCR API server on port {args.port}")
+    app.run(host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
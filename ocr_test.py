@@ -1,23 +1,51 @@
 import os
+import argparse
 import cv2
 import numpy as np
 import pytesseract
-from fuzzywuzzy import process
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from ocr_backend import export_constraints, get_backend
+from ocr_parallel import resolve_workers
+from medication_matcher import best_matches
+from formulary import load_formulary
+from ocr_preprocessing import crop_regions, find_text_regions, normalize_resolution
+import ocr_metrics
 
-# Set Tesseract path
-pytesseract.pytesseract.tesseract_cmd = r'/opt/homebrew/bin/tesseract'  # macOS
+# Set Tesseract path (only where it exists, so headless Linux runs use the one on PATH)
+if os.path.exists('/opt/homebrew/bin/tesseract'):
+    pytesseract.pytesseract.tesseract_cmd = r'/opt/homebrew/bin/tesseract'  # macOS
 
-# Load the known medication names
-def load_medication_names(file_path='indian_medications.txt'):
-    with open(file_path, 'r') as f:
-        return [line.strip() for line in f.readlines() if line.strip()]
-
-def preprocess_image(image_path):
-    """Preprocess the image for better OCR results"""
+def preprocess_image(image_path, normalize=True, return_scale=False):
+    """
+    Preprocess the image for better OCR results
+    
+    With normalize, the image is first rescaled so its text has the size Tesseract
+    reads best (see normalize_resolution); the returned images are at that resolution.
+    With return_scale, the scale factor is returned as a third value so boxes can be
+    mapped back onto the original image with scale_boxes.
+    """
     # Read the image
     img = cv2.imread(image_path)
     
+    img, erosion, scale = preprocess_loaded_image(img, normalize=normalize)
+    
+    if return_scale:
+        return img, erosion, scale
+    return img, erosion
+
+def preprocess_loaded_image(img, normalize=True):
+    """
+    Preprocess an already decoded BGR image (see preprocess_image)
+    
+    Returns:
+        (image, processed image, scale) tuple
+    """
+    # Bring the text to a standard size before anything else runs on the full image
+    scale = 1.0
+    if normalize:
+        img, scale = normalize_resolution(img)
+    
     # Convert to grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
@@ -29,31 +57,53 @@ def preprocess_image(image_path):
     dilation = cv2.dilate(thresh, kernel, iterations=1)
     erosion = cv2.erode(dilation, kernel, iterations=1)
     
-    return img, erosion
+    return img, erosion, scale
 
-def detect_text(processed_img):
-    """Extract text using pytesseract OCR"""
+def detect_text(processed_img, backend=None, regions=None):
+    """
+    Extract text using Tesseract OCR (the default backend unless one is given)
+    
+    If regions (boxes from find_text_regions) are given, only those parts of the
+    image are read, one after the other, and their text is joined line by line.
+    """
+    if backend is None:
+        backend = get_backend()
     config = r'--oem 3 --psm 6'
-    text = pytesseract.image_to_string(processed_img, config=config)
+    if regions:
+        crops = crop_regions(processed_img, regions)
+        ocr_metrics.incr("tesseract_calls", len(crops))
+        with ocr_metrics.timer("detect_text"):
+            texts = [backend.image_to_string(region, config=config).strip() for region in crops]
+        ocr_metrics.incr("empty_results", sum(not text for text in texts), variant="region", config=config)
+        return '\n'.join(text for text in texts if text)
+    ocr_metrics.incr("tesseract_calls")
+    with ocr_metrics.timer("detect_text"):
+        text = backend.image_to_string(processed_img, config=config)
+    if not text.strip():
+        ocr_metrics.incr("empty_results", variant="page", config=config)
     return text
 
 def match_medications(text, known_medications, threshold=80):
     """Match detected text with known medication names"""
-    # Split the text into words
+    # Split the text into words, skipping very short words
     words = [word.strip() for word in text.split()]
+    words = [word for word in words if len(word) > 3]
     
+    # Score every word against every medication in one bulk call
     matches = []
-    for word in words:
-        if len(word) > 3:  # Skip very short words
-            # Find the best match
-            best_match, score = process.extractOne(word, known_medications)
-            if score >= threshold:
-                matches.append((word, best_match, score))
+    for word, (best_match, score) in zip(words, best_matches(words, known_medications)):
+        if score >= threshold:
+            matches.append((word, best_match, score))
     
     return matches
 
-def visualize_results(original_img, text, matches):
-    """Visualize the OCR results"""
+def visualize_results(original_img, text, matches, output_path='ocr_results.png', show=True):
+    """
+    Visualize the OCR results
+    
+    The figure is saved to output_path and, with show, displayed (which blocks until
+    the window is closed). It is closed afterwards so batch runs don't accumulate figures.
+    """
     plt.figure(figsize=(15, 10))
     
     # Display the original image
@@ -73,14 +123,65 @@ def visualize_results(original_img, text, matches):
     plt.axis('off')
     
     plt.tight_layout()
-    plt.savefig('ocr_results.png')
-    plt.show()
+    plt.savefig(output_path)
+    if show:
+        plt.show()
+    plt.close()
+
+# Settings used by process_prescription in this process
+_worker_settings = {"known_medications": [], "crop": False}
+
+def _init_worker(known_medications, crop=False):
+    """Set the medication list and options used by process_prescription in a worker process."""
+    _worker_settings.update(known_medications=known_medications, crop=crop)
 
-def main():
-    # Load known medication names
-    known_medications = load_medication_names()
+def process_prescription(image_path):
+    """Run preprocessing, OCR and medication matching on one prescription image."""
+    _, processed_img = preprocess_image(image_path)
+    
+    # Only read the text lines instead of the whole photo
+    regions = None
+    if _worker_settings["crop"]:
+        regions = find_text_regions(processed_img, mask=processed_img, split_lines=True)
+    
+    text = detect_text(processed_img, regions=regions)
+    matches = match_medications(text, _worker_settings["known_medications"])
+    return text, matches
+
+def process_prescriptions(image_paths, known_medications, workers=1, crop=False):
+    """
+    Process a batch of prescription images, in a process pool when workers > 1.
+    
+    Args:
+        image_paths: List of image file paths
+        known_medications: List of known medication names
+        workers: Number of processes (1 runs serially, None uses all cores)
+        crop: Run OCR on the detected text lines only
+        
+    Returns:
+        List of (text, matches) tuples in the same order as image_paths
+    """
+    if workers == 1:
+        _init_worker(known_medications, crop)
+        return [process_prescription(path) for path in image_paths]
+    
+    export_constraints()
+    with ProcessPoolExecutor(max_workers=resolve_workers(workers), initializer=_init_worker,
+                             initargs=(known_medications, crop)) as executor:
+        return list(executor.map(process_prescription, image_paths))
+
+def main(workers=1, crop=False, show=False, constrained=False):
+    # Load known medication names from the compiled formulary
+    formulary = load_formulary()
+    known_medications = formulary.names
     print(f"Loaded {len(known_medications)} known medication names")
     
+    # Constrain Tesseract to the formulary's words and characters (the config of the
+    # formulary loaded above is set in the environment, so the default backend of every
+    # worker process picks it up without loading the formulary again)
+    if constrained:
+        os.environ["OCR_CONSTRAINTS"] = formulary.tesseract_config()
+    
     # Process images from test_images folder
     test_dir = 'test_images'
     if not os.path.exists(test_dir):
@@ -94,26 +195,31 @@ def main():
         print(f"No images found in {test_dir}. Please add some prescription images.")
         return
     
-    for image_file in image_files:
+    image_paths = [os.path.join(test_dir, image_file) for image_file in image_files]
+    results = process_prescriptions(image_paths, known_medications, workers=workers, crop=crop)
+    
+    for image_file, image_path, (text, matches) in zip(image_files, image_paths, results):
         print(f"\nProcessing {image_file}...")
-        image_path = os.path.join(test_dir, image_file)
-        
-        # Preprocess the image
-        original_img, processed_img = preprocess_image(image_path)
-        
-        # Detect text
-        text = detect_text(processed_img)
         print("Extracted text:")
         print(text)
         
-        # Match medications
-        matches = match_medications(text, known_medications)
         print("\nMatched medications:")
         for match in matches:
             print(f"Detected: {match[0]} → Matched: {match[1]} (Score: {match[2]})")
         
-        # Visualize results
-        visualize_results(original_img, text, matches)
+        # Visualize results, one figure per image
+        output_path = f"ocr_results_{os.path.splitext(image_file)[0]}.png"
+        visualize_results(cv2.imread(image_path), text, matches, output_path=output_path, show=show)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Detect medication names in prescription images")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to use (0 uses all cores)")
+    parser.add_argument("--crop", action="store_true",
+                        help="Only run OCR on the detected text lines")
+    parser.add_argument("--show", action="store_true",
+                        help="Display each result figure (blocks until the window is closed)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="Decode against the formulary's words and characters only")
+    args = parser.parse_args()
+    main(workers=args.workers, crop=args.crop, show=args.show, constrained=args.constrained)
@@ -0,0 +1,72 @@
+"""
+Production ASGI entry point for the Python services.
+
+Runs an app under uvicorn with several worker processes and concurrency limits,
+instead of the single-process development servers started by app.run(debug=True).
+
+The OCR server is the exception: it already spreads OCR over a process pool with one
+worker per core, so it runs in a single uvicorn worker (more would start one pool, one
+dispatcher queue and one set of /metrics totals per worker, i.e. N x N OCR processes).
+The pool size is create_app's workers argument (--workers when running ocr_server.py).
+Workers of the chat apps share nothing either: each loads its own MiniLM model and has
+its own response cache.
+
+Usage:
+    python serve.py app_api:app --port 5001 --workers 4
+    python serve.py app:app --app-dir Medical-Chatbot-GenAI-main --port 8080 --workers 4
+    python serve.py ocr_server:create_app --factory --port 5002
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an ASGI app (module:attribute) with uvicorn")
+    parser.add_argument("app", help="App to serve, e.g. app_api:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Number of worker processes (0 uses all cores; always 1 for ocr_server)")
+    parser.add_argument("--app-dir", default=".",
+                        help="Directory to import the app from")
+    parser.add_argument("--factory", action="store_true",
+                        help="Treat the app as a factory function that returns the app")
+    parser.add_argument("--limit-concurrency", type=int, default=1000,
+                        help="Connections per worker before new requests get 503")
+    parser.add_argument("--llm-concurrency", type=int, default=0,
+                        help="Gemini calls in flight per worker (0: no limit; sets CHAT_MAX_CONCURRENCY)")
+    parser.add_argument("--backlog", type=int, default=2048,
+                        help="Pending connections the socket queues before refusing new ones")
+    parser.add_argument("--keep-alive", type=int, default=30,
+                        help="Seconds an idle keep-alive connection stays open")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    if args.app.split(":")[0] == "ocr_server":
+        # One uvicorn worker; the OCR process pool inside it uses every core
+        if args.workers > 1:
+            parser.error("ocr_server runs in a single worker (its OCR process pool uses every core)")
+        workers = 1
+
+    # Read by the chat apps when each worker imports them
+    if args.llm_concurrency:
+        os.environ["CHAT_MAX_CONCURRENCY"] = str(args.llm_concurrency)
+
+    uvicorn.run(
+        args.app,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        app_dir=args.app_dir,
+        factory=args.factory,
+        limit_concurrency=args.limit_concurrency,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import stat
+from concurrent.futures import ProcessPoolExecutor
+
+from formulary import load_formulary
+
+
+def rebuild_and_count(source):
+    return len(load_formulary(source, rebuild=True))
+
+
+def test_concurrent_rebuilds_publish_whole_artifacts(tmp_path):
+    source = str(tmp_path / "medications.txt")
+    shutil.copy("indian_medications.txt", source)
+    # An artifact from before the artifact path was a symlink
+    os.makedirs(tmp_path / "medications.formulary")
+
+    with ProcessPoolExecutor(8) as executor:
+        counts = list(executor.map(rebuild_and_count, [source] * 32))
+
+    formulary = load_formulary(source)
+    assert counts == [len(formulary)] * 32
+    assert os.path.islink(tmp_path / "medications.formulary")
+    assert stat.S_IMODE(os.stat(formulary.artifact_dir).st_mode) == 0o755
+
+
+def test_edited_list_is_recompiled(tmp_path):
+    source = tmp_path / "medications.txt"
+    source.write_text("Aspirin\n")
+    first = load_formulary(str(source))
+
+    source.write_text("Aspirin\nParacetamol 650\n")
+    second = load_formulary(str(source))
+
+    assert second.names == ["Aspirin", "Paracetamol 650"]
+    assert second.artifact_dir != first.artifact_dir
+    # The build the first formulary was read from is kept for readers still using it
+    assert first.names == ["Aspirin"] and os.path.isdir(first.artifact_dir)
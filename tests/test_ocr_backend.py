@@ -0,0 +1,27 @@
+import os
+import shutil
+
+import ocr_backend
+import ocr_parallel
+
+
+def worker_constraints(_):
+    return ocr_backend.create_backend("subprocess").constraints
+
+
+def test_workers_inherit_constraints_compiled_by_the_parent(monkeypatch, tmp_path):
+    source = str(tmp_path / "medications.txt")
+    shutil.copy("indian_medications.txt", source)
+    monkeypatch.setenv("OCR_CONSTRAIN_TO", source)
+    monkeypatch.delenv("OCR_CONSTRAINTS", raising=False)
+
+    constraints = ocr_backend.export_constraints()
+    assert "--user-words" in constraints
+    assert os.environ["OCR_CONSTRAINTS"] == constraints
+
+    # Workers that loaded the formulary themselves would fail without the source file
+    os.remove(source)
+    try:
+        assert ocr_parallel.parallel_map(worker_constraints, range(3), workers=3) == [constraints] * 3
+    finally:
+        ocr_parallel.shutdown_executors()
@@ -0,0 +1,23 @@
+from ocr_benchmark import compare_reports, print_report
+
+
+def report(peak_rss_mb, per_stage=True):
+    return {"meta": {"peak_rss_per_stage": per_stage},
+            "stages": {"correction/1000": {"p50_ms": 1.0, "p95_ms": 2.0, "items_per_sec": 500.0,
+                                           "peak_rss_mb": peak_rss_mb}}}
+
+
+def test_memory_growth_is_a_regression():
+    regressions = compare_reports(report(160.0), report(120.0))
+    assert [(r["stage"], r["metric"]) for r in regressions] == [("correction/1000", "peak_rss_mb")]
+
+
+def test_memory_is_only_compared_when_measured_per_stage():
+    assert compare_reports(report(160.0, per_stage=False), report(120.0)) == []
+
+
+def test_report_prints_stages_without_items(capsys):
+    print_report({"stages": {"generation": {"p50_ms": None, "p95_ms": None, "items_per_sec": None,
+                                            "peak_rss_mb": None}},
+                  "skipped": {}})
+    assert "None" in capsys.readouterr().out
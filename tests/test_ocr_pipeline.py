@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from ocr_pipeline import run_pipeline
+
+
+def test_failing_path_iterator_fails_the_run(tmp_path):
+    def paths():
+        yield str(tmp_path / "missing.png")
+        raise OSError("directory went away")
+
+    output = tmp_path / "results.jsonl"
+    with pytest.raises(OSError, match="directory went away"):
+        run_pipeline(paths(), str(output), ["Aspirin"], ocr_threads=1)
+
+    # The path read before the failure is written and checkpointed for resuming
+    assert [json.loads(line)["path"] for line in output.read_text().splitlines()] == \
+        [str(tmp_path / "missing.png")]
+    assert json.loads((tmp_path / "results.jsonl.checkpoint").read_text())["count"] == 1
@@ -0,0 +1,21 @@
+import numpy as np
+
+import ocr_preprocessing
+from ocr_preprocessing import MAX_SIDE, TARGET_TEXT_HEIGHT, normalize_resolution
+
+
+def test_max_side_applies_when_text_is_already_at_target(monkeypatch):
+    monkeypatch.setattr(ocr_preprocessing, "estimate_text_height", lambda img: TARGET_TEXT_HEIGHT)
+    img = np.full((400, 3900), 255, dtype=np.uint8)
+
+    resized, scale = normalize_resolution(img)
+    assert max(resized.shape) <= MAX_SIDE
+    assert scale == MAX_SIDE / 3900
+
+
+def test_small_change_is_skipped(monkeypatch):
+    monkeypatch.setattr(ocr_preprocessing, "estimate_text_height", lambda img: TARGET_TEXT_HEIGHT * 1.05)
+    img = np.full((400, 1200), 255, dtype=np.uint8)
+
+    resized, scale = normalize_resolution(img)
+    assert resized is img and scale == 1.0
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytesseract
+import pytest
+
+import ocr_backend
+import ocr_metrics
+import ocr_server
+from medication_matcher import MedicationMatcher
+from ocr_scheduler import VariantScheduler
+
+
+def fake_recognize_batch(sizes, release=None):
+    """A recognize_batch stand-in that records batch sizes and echoes the blobs back."""
+    def recognize_batch(blobs):
+        sizes.append(len(blobs))
+        if release is not None:
+            release.wait(5)
+        return [{"text": blob.decode(), "raw_text": blob.decode()} for blob in blobs], \
+            ocr_metrics.MetricsCollector().snapshot()
+    return recognize_batch
+
+
+@pytest.fixture
+def threaded_server(monkeypatch):
+    """Run create_app's workers as threads and skip loading the formulary."""
+    monkeypatch.setattr(ocr_server, "ProcessPoolExecutor",
+                        lambda max_workers, initializer, initargs: ThreadPoolExecutor(max_workers))
+    monkeypatch.setattr(ocr_server, "load_formulary", lambda source: None)
+
+
+@pytest.fixture
+def subprocess_worker(monkeypatch):
+    """Set up the worker state and a fresh default subprocess backend in this process."""
+    monkeypatch.setenv("OCR_BACKEND", "subprocess")
+    monkeypatch.delenv("OCR_CONSTRAIN_TO", raising=False)
+    monkeypatch.setattr(ocr_backend, "_default_backend", None)
+    monkeypatch.setattr(ocr_server, "_worker", {
+        "matcher": MedicationMatcher(["Aspirin", "Ibuprofen", "Metformin"]),
+        "scheduler": VariantScheduler(),
+    })
+
+
+def fake_tesseract(path, text):
+    """Write a tesseract stand-in that prints text into its output file."""
+    path.write_text(f"#!/bin/sh\nprintf '{text}\\n' > \"$2.txt\"\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def label_png():
+    _, png = cv2.imencode(".png", np.full((60, 300), 255, dtype=np.uint8))
+    return png.tobytes()
+
+
+def post_scan(blob):
+    app = ocr_server.create_app(workers=1, max_wait=0, timeout=30)
+
+    async def run():
+        async with app.test_app() as test_app:
+            response = await test_app.test_client().post("/api/ocr", data=blob)
+            return response.status_code, await response.get_json()
+
+    return asyncio.run(run())
+
+
+def test_scan_runs_the_subprocess_backend(monkeypatch, tmp_path, threaded_server, subprocess_worker):
+    monkeypatch.setattr(pytesseract.pytesseract, "tesseract_cmd",
+                        fake_tesseract(tmp_path / "tesseract", "Asprin"))
+
+    status, result = post_scan(label_png())
+    assert status == 200
+    assert result["raw_text"] == "Asprin"
+    assert result["text"] == "Aspirin"
+
+
+def test_missing_tesseract_fails_the_scan(monkeypatch, tmp_path, threaded_server, subprocess_worker):
+    monkeypatch.setattr(pytesseract.pytesseract, "tesseract_cmd", str(tmp_path / "missing"))
+
+    status, _ = post_scan(label_png())
+    assert status == 500
+
+
+def test_dispatcher_batches_up_to_max_batch_size(monkeypatch):
+    sizes = []
+    monkeypatch.setattr(ocr_server, "recognize_batch", fake_recognize_batch(sizes))
+
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            dispatcher = ocr_server.BatchDispatcher(executor, max_batch_size=3, max_wait=0.05)
+            dispatcher.start()
+            try:
+                return await asyncio.gather(*(dispatcher.submit(f"{i}".encode(), timeout=5)
+                                              for i in range(7)))
+            finally:
+                await dispatcher.stop()
+
+    results = asyncio.run(run())
+    assert [result["text"] for result in results] == [f"{i}" for i in range(7)]
+    assert sizes == [3, 3, 1]
+
+
+def test_dispatcher_stop_cancels_running_batches(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(ocr_server, "recognize_batch", fake_recognize_batch([], release))
+
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            dispatcher = ocr_server.BatchDispatcher(executor, max_wait=0)
+            dispatcher.start()
+            request = asyncio.create_task(dispatcher.submit(b"a", timeout=5))
+            await asyncio.sleep(0.05)
+            assert len(dispatcher._batch_tasks) == 1
+            await dispatcher.stop()
+            release.set()
+            with pytest.raises(asyncio.CancelledError):
+                await request
+            assert not dispatcher._batch_tasks
+
+    asyncio.run(run())
+
+
+def test_full_queue_gets_503_with_retry_after(monkeypatch, threaded_server):
+    release = threading.Event()
+    monkeypatch.setattr(ocr_server, "recognize_batch", fake_recognize_batch([], release))
+    app = ocr_server.create_app(workers=1, max_batch_size=1, max_wait=0, max_queue=1, timeout=5)
+
+    async def run():
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+            try:
+                # The first scan occupies the only worker, the second fills the queue
+                running = asyncio.create_task(client.post("/api/ocr", data=b"a"))
+                await asyncio.sleep(0.05)
+                queued = asyncio.create_task(client.post("/api/ocr", data=b"b"))
+                await asyncio.sleep(0.05)
+
+                rejected = await client.post("/api/ocr", data=b"c")
+                assert rejected.status_code == 503
+                assert rejected.headers["Retry-After"] == "1"
+            finally:
+                release.set()
+            assert (await running).status_code == 200
+            assert (await (await queued).get_json())["text"] == "b"
+
+    asyncio.run(run())
+
+
+def test_slow_scan_gets_504(monkeypatch, threaded_server):
+    release = threading.Event()
+    monkeypatch.setattr(ocr_server, "recognize_batch", fake_recognize_batch([], release))
+    app = ocr_server.create_app(workers=1, max_wait=0, timeout=0.1)
+
+    async def run():
+        async with app.test_app() as test_app:
+            try:
+                response = await test_app.test_client().post("/api/ocr", data=b"a")
+                assert response.status_code == 504
+            finally:
+                release.set()
+
+    asyncio.run(run())